@@ -0,0 +1,158 @@
+"""
+Generate synthetic movies, links and ratings tables at MovieLens scale.
+
+Example:
+    python -m benchmarks.generate --n_ratings 1000000 --output_dir data/benchmark
+"""
+
+import argparse
+import logging.config
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.artifacts import write_table
+
+logger = logging.getLogger(__name__)
+
+# the time span of the ratings, 2005-01-01 to 2020-01-01
+TIMESTAMPS = (1104537600, 1577836800)
+
+
+def get_scale(n_ratings):
+    """
+    Get the number of movies and users of a ratings table of the given size.
+
+    The ratios follow MovieLens, about 1,000 movies and 700 users for 100k ratings and
+    30,000 movies and 170,000 users for 25M ratings.
+
+    Args:
+        n_ratings (int) - the number of ratings
+
+    Returns:
+        n_movies (int) - the number of movies
+        n_users (int) - the number of users
+    """
+    return max(50, int(n_ratings ** 0.6)), max(100, n_ratings // 150)
+
+def get_long_tail(n_items, skew, rng):
+    """
+    Draw the probabilities of a long-tailed popularity over items in random order.
+
+    Args:
+        n_items (int) - the number of items
+        skew (float) - the exponent of the power law, larger for a longer tail
+        rng (numpy.random.Generator) - the random generator
+
+    Returns:
+        probabilities (numpy.array) - the probability of each item
+    """
+    weights = rng.permutation(1. / np.arange(1, n_items + 1) ** skew)
+
+    return weights / weights.sum()
+
+def sample_pairs(n_ratings, movie_p, user_p, rng):
+    """
+    Sample distinct (user, movie) pairs from the popularity of movies and users.
+
+    Args:
+        n_ratings (int) - the number of pairs
+        movie_p (numpy.array) - the probability of each movie
+        user_p (numpy.array) - the probability of each user
+        rng (numpy.random.Generator) - the random generator
+
+    Returns:
+        users (numpy.array) - the user of each pair, sorted
+        movies (numpy.array) - the movie of each pair
+    """
+    n_movies = len(movie_p)
+    if n_ratings > n_movies * len(user_p):
+        logger.error("Cannot draw %d distinct ratings from %d movies and %d users", n_ratings,
+                     n_movies, len(user_p))
+        raise ValueError("Cannot draw %d distinct ratings from %d movies and %d users"
+                         % (n_ratings, n_movies, len(user_p)))
+
+    # popular movies of active users are drawn more than once, so more pairs are drawn
+    n_draws = n_ratings
+    keys = np.empty(0, dtype=np.int64)
+    while len(keys) < n_ratings:
+        n_draws = int(n_draws * 1.25)
+        keys = np.unique(rng.choice(len(user_p), n_draws, p=user_p).astype(np.int64) * n_movies
+                         + rng.choice(n_movies, n_draws, p=movie_p))
+
+    keys = np.sort(rng.choice(keys, n_ratings, replace=False))
+
+    return keys // n_movies, keys % n_movies
+
+def generate(n_ratings, n_movies=None, n_users=None, skew=1.0, seed=423):
+    """
+    Generate synthetic raw movies, links and ratings tables.
+
+    Movie popularity follows a power law and user activity a log-normal distribution, so
+    a few movies and users hold most ratings as in MovieLens. The ratings are half stars
+    from a movie quality, a user bias and noise, sorted by user.
+
+    Args:
+        n_ratings (int) - the number of ratings
+        n_movies (int) - the number of movies, from `get_scale` if None
+        n_users (int) - the number of users, from `get_scale` if None
+        skew (float) - the exponent of the power law of movie popularity
+        seed (int) - the random seed
+
+    Returns:
+        movies (pandas.DataFrame) - the movieId and title of each movie
+        links (pandas.DataFrame) - the movieId, imdbId and doubanId of each movie
+        ratings (pandas.DataFrame) - the userId, movieId, rating and timestamp of each rating
+    """
+    default_movies, default_users = get_scale(n_ratings)
+    n_movies = n_movies or default_movies
+    n_users = n_users or default_users
+    rng = np.random.default_rng(seed)
+
+    movie_p = get_long_tail(n_movies, skew, rng)
+    user_p = rng.lognormal(sigma=1., size=n_users)
+    users, movies = sample_pairs(n_ratings, movie_p, user_p / user_p.sum(), rng)
+
+    quality = rng.normal(3.5, 0.5, n_movies)
+    bias = rng.normal(0., 0.4, n_users)
+    rating = quality[movies] + bias[users] + rng.normal(0., 0.8, n_ratings)
+    ratings = pd.DataFrame({'userId': users, 'movieId': movies,
+                            'rating': np.clip(np.round(rating * 2) / 2, 0.5, 5.),
+                            'timestamp': rng.integers(*TIMESTAMPS, size=n_ratings)})
+
+    movie_id = np.arange(n_movies)
+    movies = pd.DataFrame({'movieId': movie_id, 'title': ['Movie %d' % i for i in movie_id]})
+    # some movies have no imdb link, as in the Douban data
+    imdb_id = (1000000 + movie_id).astype(float)
+    imdb_id[rng.random(n_movies) < 0.1] = np.nan
+    links = pd.DataFrame({'movieId': movie_id, 'imdbId': imdb_id,
+                          'doubanId': (3000000 + movie_id).astype(float)})
+
+    logger.info("Generated %d ratings of %d movies by %d users", n_ratings, n_movies, n_users)
+
+    return movies, links, ratings
+
+
+if __name__ == '__main__':
+    logging.config.fileConfig('config/logging/local.conf')
+
+    parser = argparse.ArgumentParser(description="Generate synthetic movies, links and ratings")
+    parser.add_argument('--n_ratings', type=int, default=1000000, help='Number of ratings')
+    parser.add_argument('--n_movies', type=int, default=None, help='Number of movies')
+    parser.add_argument('--n_users', type=int, default=None, help='Number of users')
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help='Exponent of the power law of movie popularity')
+    parser.add_argument('--seed', type=int, default=423, help='Random seed')
+    parser.add_argument('--output_dir', default='data/benchmark',
+                        help='Directory to save movies, links and ratings to')
+    parser.add_argument('--artifact_format', default='csv', choices=['csv', 'parquet', 'feather'],
+                        help='Format of the saved tables')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for name, data in zip(['movies', 'links', 'ratings'],
+                          generate(args.n_ratings, args.n_movies, args.n_users, args.skew,
+                                   args.seed)):
+        write_table(data, os.path.join(args.output_dir, '%s.%s' % (name, args.artifact_format)))
+    logger.info("Synthetic data saved to %s", args.output_dir)
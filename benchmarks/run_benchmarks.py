@@ -0,0 +1,196 @@
+"""
+Time and memory-profile the model pipeline stages on synthetic data.
+
+Example:
+    python -m benchmarks.run_benchmarks --n_ratings 1000000 \
+        --output benchmarks/results/1m.json --baseline benchmarks/results/1m-baseline.json
+"""
+
+import argparse
+import json
+import logging.config
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from benchmarks.generate import generate
+from src.add_movie import MovieManager, create_db
+from src.pipeline import run_clean, run_evaluate, run_featurize, run_predict, run_train
+
+logger = logging.getLogger(__name__)
+
+STAGES = ['clean', 'featurize', 'train', 'predict', 'evaluate', 'ingest']
+STAGE_FUNCTIONS = {'clean': run_clean, 'featurize': run_featurize, 'train': run_train,
+                   'predict': run_predict, 'evaluate': run_evaluate}
+
+
+def ingest(data, config, workdir):
+    """
+    Ingest the featurized movies and the predictions into a fresh sqlite database.
+
+    Args:
+        data (dict) - the outputs of the previous stages
+        config (dict) - the model configuration, unused
+        workdir (str) - the directory of the database and of the ingested csv files
+
+    Returns:
+        outputs (dict) - nothing, the stage only writes to the database
+    """
+    engine_string = 'sqlite:///%s' % os.path.join(workdir, 'benchmark.db')
+    create_db(engine_string)
+    data['movies'].to_csv(os.path.join(workdir, 'movies.csv'), index=False)
+    data['predictions'].to_csv(os.path.join(workdir, 'predictions.csv'), index=False)
+
+    manager = MovieManager(engine_string=engine_string)
+    manager.add_movie_from_csv(os.path.join(workdir, 'movies.csv'))
+    manager.add_prediction_from_csv(os.path.join(workdir, 'predictions.csv'))
+    manager.close()
+
+    return {}
+
+def measure(func, *args):
+    """
+    Run a function and measure its wall time, CPU time and peak traced memory.
+
+    The memory is traced with tracemalloc, which numpy and pandas report their buffers
+    to, and adds some overhead to the allocations of Python objects.
+
+    Args:
+        func (function) - the function to run
+        *args - its arguments
+
+    Returns:
+        result (object) - the output of the function
+        measures (dict) - the wall and CPU seconds and the peak memory in MB
+    """
+    tracemalloc.start()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        result = func(*args)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return result, {'wall_seconds': wall, 'cpu_seconds': cpu, 'peak_memory_mb': peak / 2**20}
+
+def run_benchmarks(config, n_ratings, stages=None, seed=423):
+    """
+    Benchmark the pipeline stages one after the other on synthetic data.
+
+    Args:
+        config (dict) - the model configuration
+        n_ratings (int) - the number of synthetic ratings
+        stages (list) - the stages to measure, all of `STAGES` if None, the stages they
+        depend on run without being measured
+        seed (int) - the random seed of the synthetic data
+
+    Returns:
+        results (dict) - the scale, environment and measures of each stage
+    """
+    stages = STAGES if stages is None else stages
+    movies, links, ratings = generate(n_ratings, seed=seed)
+    data = {'movies': movies, 'links': links, 'ratings': ratings}
+
+    results = {'n_ratings': n_ratings, 'n_movies': len(movies),
+               'n_users': int(ratings['userId'].nunique()), 'seed': seed,
+               'python': platform.python_version(), 'numpy': np.__version__,
+               'pandas': pd.__version__, 'stages': {}}
+
+    workdir = tempfile.mkdtemp(prefix='benchmark-')
+    try:
+        # every stage up to the last one asked for runs, as each needs the ones before
+        for stage in STAGES[:max(STAGES.index(stage) for stage in stages) + 1]:
+            func = STAGE_FUNCTIONS.get(stage)
+            args = (dict(data), config) if func is not None else (data, config, workdir)
+            if stage in stages:
+                outputs, measures = measure(func or ingest, *args)
+                results['stages'][stage] = measures
+                logger.info("%s: %.2f s wall, %.2f s CPU, %.1f MB peak", stage,
+                            measures['wall_seconds'], measures['cpu_seconds'],
+                            measures['peak_memory_mb'])
+            else:
+                outputs = (func or ingest)(*args)
+            data.update(outputs)
+    finally:
+        shutil.rmtree(workdir)
+
+    return results
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compare benchmark results with a baseline run.
+
+    Args:
+        results (dict) - the output of `run_benchmarks`
+        baseline (dict) - the output of an earlier `run_benchmarks`
+        tolerance (float) - how much slower or larger a stage may get before it counts as
+        a regression
+
+    Returns:
+        comparison (pandas.DataFrame) - the ratio of each measure to the baseline and
+        whether it is a regression, by stage
+    """
+    if results['n_ratings'] != baseline['n_ratings']:
+        logger.warning("The baseline has %d ratings, not %d", baseline['n_ratings'],
+                       results['n_ratings'])
+
+    rows = []
+    for stage, measures in results['stages'].items():
+        if stage not in baseline['stages']:
+            continue
+        row = {'stage': stage}
+        for measure in ('wall_seconds', 'peak_memory_mb'):
+            row[measure] = measures[measure]
+            row[measure + '_ratio'] = measures[measure] / max(baseline['stages'][stage][measure],
+                                                              1e-9)
+        row['regression'] = max(row['wall_seconds_ratio'],
+                                row['peak_memory_mb_ratio']) > 1 + tolerance
+        rows.append(row)
+
+    return pd.DataFrame(rows).set_index('stage')
+
+
+if __name__ == '__main__':
+    logging.config.fileConfig('config/logging/local.conf')
+
+    parser = argparse.ArgumentParser(description="Benchmark the model pipeline stages")
+    parser.add_argument('--config', default='config/modelconfig.yaml',
+                        help='Model configuration file')
+    parser.add_argument('--n_ratings', type=int, default=100000,
+                        help='Number of synthetic ratings, e.g. 100000, 1000000 or 25000000')
+    parser.add_argument('--stages', nargs='+', default=None, choices=STAGES,
+                        help='Stages to measure, all by default')
+    parser.add_argument('--seed', type=int, default=423, help='Random seed of the data')
+    parser.add_argument('--output', default=None, help='Path to save the results (.json)')
+    parser.add_argument('--baseline', default=None,
+                        help='Path of earlier results (.json) to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative slowdown or memory growth counted as a regression')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    results = run_benchmarks(config, args.n_ratings, args.stages, args.seed)
+
+    if args.output is not None:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        logger.info("Benchmark results saved to %s", args.output)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            comparison = compare(results, json.load(f), args.tolerance)
+        print(comparison.to_string(float_format='%.2f'))
+        for stage in comparison.index[comparison['regression']]:
+            logger.warning("Stage %s regressed beyond %.0f%% of the baseline", stage,
+                           args.tolerance * 100)
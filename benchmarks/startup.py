@@ -0,0 +1,166 @@
+"""
+Time each run.py subcommand end to end on tiny inputs, where startup dominates.
+
+The subcommands that need S3 (`upload`, `acquire`) or a trained neighbour index
+(`update`) are not timed. Another version of run.py, e.g. one with eager imports, can be
+timed alongside for comparison:
+    git show <revision>:run.py > /tmp/run-baseline.py
+    python -m benchmarks.startup --baseline_run_py /tmp/run-baseline.py
+"""
+
+import argparse
+import glob
+import json
+import logging.config
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+import yaml
+
+from benchmarks.generate import generate
+
+logger = logging.getLogger(__name__)
+
+
+def get_commands(workdir, config_path):
+    """
+    Get the arguments of each timed subcommand, reading and writing in the work directory.
+
+    Args:
+        workdir (str) - the directory of the inputs and outputs
+        config_path (str) - the path of the model configuration
+
+    Returns:
+        commands (dict) - the run.py arguments of each subcommand, in the order to run them
+    """
+    def path(name):
+        return os.path.join(workdir, name)
+
+    engine = ['--engine_string', 'sqlite:///%s' % path('movies.db')]
+    config = ['--config', config_path]
+    model = ['--input_movie_id', path('movieID-train.npy'), '--input_corr', path('corr-train.npy')]
+
+    return {
+        'create_db': ['create_db'] + engine,
+        'clean': config + ['clean'] + config + [
+            '--input_movies', path('movies.csv'), '--input_links', path('links.csv'),
+            '--input_ratings', path('ratings.csv'), '--output_movies', path('movies-clean.csv'),
+            '--output_ratings', path('ratings-clean.csv')],
+        'featurize': config + ['featurize', '--input_movies', path('movies-clean.csv'),
+                               '--input_ratings', path('ratings-clean.csv'),
+                               '--output_movies', path('movies-feature.csv')],
+        'train': config + ['train', '--input_ratings', path('ratings-clean.csv'),
+                           '--output_ratings_pivot', path('ratings-pivot-train.csv'),
+                           '--output_movie_id', path('movieID-train.npy'),
+                           '--output_user_id', path('userID-train.npy'),
+                           '--output_corr', path('corr-train.npy')],
+        'predict': config + ['predict'] + model + [
+            '--output_predictions', path('predictions-predict.csv')],
+        'evaluate': config + ['evaluate'] + model + [
+            '--input_ratings_pivot', path('ratings-pivot-train.csv'),
+            '--input_user_id', path('userID-train.npy'), '--output', path('score-evaluate.txt')],
+        'metrics': config + ['metrics', '--input_ratings', path('ratings-clean.csv'),
+                             '--output', path('metrics-evaluate.csv')],
+        'cv': config + ['cv', '--input_ratings', path('ratings-clean.csv'),
+                        '--output', path('cv-evaluate.csv')],
+        'ingest_to_movies': ['ingest_to_movies'] + engine + [
+            '--file_path', path('movies-feature.csv')],
+        'ingest_to_predictions': ['ingest_to_predictions'] + engine + [
+            '--file_path', path('predictions-predict.csv')],
+    }
+
+def time_command(run_py, arguments, workdir):
+    """
+    Time one run of run.py from the repository root.
+
+    Args:
+        run_py (str) - the path of the run.py to time
+        arguments (list) - its arguments
+        workdir (str) - the work directory, cleared of fingerprints so no stage is skipped
+
+    Returns:
+        seconds (float) - the wall time of the process
+    """
+    for path in glob.glob(os.path.join(workdir, '*.fingerprint')):
+        os.remove(path)
+
+    # run.py may live elsewhere, but always imports src and config from the repository
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    start = time.perf_counter()
+    subprocess.run([sys.executable, run_py] + arguments, check=True, env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    return time.perf_counter() - start
+
+def time_startup(run_pys, config, repeat=3, n_ratings=2000):
+    """
+    Time every subcommand of one or more versions of run.py on tiny synthetic inputs.
+
+    Args:
+        run_pys (dict) - the path of each version of run.py, by name
+        config (dict) - the model configuration, with the filters relaxed for tiny data
+        repeat (int) - how many times each subcommand runs, the fastest counts
+        n_ratings (int) - the number of synthetic ratings
+
+    Returns:
+        results (pandas.DataFrame) - the fastest wall time of each subcommand (rows) and
+        version (columns)
+    """
+    workdir = tempfile.mkdtemp(prefix='startup-')
+    try:
+        for name, data in zip(['movies', 'links', 'ratings'], generate(n_ratings)):
+            data.to_csv(os.path.join(workdir, name + '.csv'), index=False)
+        config_path = os.path.join(workdir, 'modelconfig.yaml')
+        with open(config_path, 'w') as f:
+            yaml.dump(config, f)
+
+        commands = get_commands(workdir, config_path)
+        seconds = {version: {command: [] for command in commands} for version in run_pys}
+        for _ in range(repeat):
+            for version, run_py in run_pys.items():
+                if os.path.exists(os.path.join(workdir, 'movies.db')):
+                    os.remove(os.path.join(workdir, 'movies.db'))
+                for command, arguments in commands.items():
+                    seconds[version][command].append(time_command(run_py, arguments, workdir))
+    finally:
+        shutil.rmtree(workdir)
+
+    return pd.DataFrame({version: {command: min(times) for command, times in timings.items()}
+                         for version, timings in seconds.items()})
+
+
+if __name__ == '__main__':
+    logging.config.fileConfig('config/logging/local.conf')
+
+    parser = argparse.ArgumentParser(description="Time the startup of the run.py subcommands")
+    parser.add_argument('--config', default='config/modelconfig.yaml',
+                        help='Model configuration file')
+    parser.add_argument('--run_py', default='run.py', help='Path of the run.py to time')
+    parser.add_argument('--baseline_run_py', default=None,
+                        help='Path of another run.py to time alongside, e.g. an older version')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs of each subcommand, the fastest counts')
+    parser.add_argument('--output', default=None, help='Path to save the timings (.json)')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    config['clean']['filter'] = {'user_min': 1, 'movie_min': 1}
+
+    run_pys = {'run_py': args.run_py}
+    if args.baseline_run_py is not None:
+        run_pys['baseline'] = args.baseline_run_py
+    results = time_startup(run_pys, config, args.repeat)
+    if args.baseline_run_py is not None:
+        results['speedup'] = results['baseline'] / results['run_py']
+    print(results.to_string(float_format='%.2f'))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results.to_dict(), f, indent=2)
+        logger.info("Startup timings saved to %s", args.output)
@@ -3,25 +3,394 @@ The orchestration script.
 """
 
 import argparse
+import glob
+import os
+import time
 import logging.config
 # logging has to be configured here to show loggers from other modules
 logging.config.fileConfig('config/logging/local.conf')
 logger = logging.getLogger('douban-rs-pipeline')
 
-import yaml
-import pandas as pd
-import numpy as np
-
-from src.add_movie import MovieManager, create_db
-from src.data_acquisition import upload_file_to_s3
-import src.acquire as acquire
-import src.clean as clean
-import src.featurize as featurize
-import src.train as train
-import src.predict as predict
-import src.evaluate as evaluate
+import src.fingerprint as fingerprint
 from config.flaskconfig import SQLALCHEMY_DATABASE_URI
 
+# the arguments holding tables and rating matrices passed between stages
+TABLE_ARGS = ['file_path', 'input_movies', 'input_links', 'input_ratings', 'input_delta',
+              'output_movies', 'output_links', 'output_ratings', 'output_predictions']
+MATRIX_ARGS = ['input_ratings_pivot', 'output_ratings_pivot']
+
+# the configuration sections of the stages that are skipped when their fingerprint is unchanged
+STAGE_CONFIG = {'acquire': ['acquire'], 'clean': ['clean'], 'featurize': ['featurize'],
+                'train': ['train'], 'update': ['train'], 'predict': ['predict'], 'evaluate': [],
+                'metrics': ['train', 'evaluate'],
+                'cv': ['clean', 'train', 'predict', 'evaluate', 'cross_validate']}
+
+
+def run_upload(args, config):
+    """Upload to s3 (the `upload` subcommand)."""
+    from src.data_acquisition import upload_file_to_s3, upload_files_to_s3
+
+    if args.batch or args.data_file == 'all':
+        # the whole directory, or the three datasets, through one client
+        file_names = None if args.batch else ['movies.csv', 'links.csv', 'ratings.csv']
+        upload_files_to_s3(args.local_path, args.s3_path, file_names,
+                           **config['upload']['upload_files_to_s3'])
+    else:
+        upload_file_to_s3(args.local_path, args.s3_path, args.data_file)
+
+def run_create_db(args, config):
+    """Create database (the `create_db` subcommand)."""
+    from src.add_movie import create_db
+
+    create_db(args.engine_string)
+
+def run_ingest_to_movies(args, config):
+    """Movies data ingestion (the `ingest_to_movies` subcommand)."""
+    from src.add_movie import MovieManager
+
+    mm = MovieManager(engine_string=args.engine_string)
+    mm.add_movie_from_csv(args.file_path)
+    mm.close()
+
+def run_ingest_to_predictions(args, config):
+    """Predictions data ingestion (the `ingest_to_predictions` subcommand)."""
+    from src.add_movie import MovieManager
+
+    mm = MovieManager(engine_string=args.engine_string)
+    mm.add_prediction_from_csv(args.file_path)
+    mm.close()
+
+def run_acquire(args, config):
+    """Model pipeline data acquisition (the `acquire` subcommand)."""
+    import src.acquire as acquire
+    from src.artifacts import write_table
+
+    movies, links, ratings = acquire.acquire(**config['acquire']['acquire'])
+
+    try:
+        write_table(movies, args.output_movies)
+        write_table(links, args.output_links)
+        write_table(ratings, args.output_ratings)
+        logger.info('Raw data saved to the given paths')
+    except IOError:
+        logger.error("Cannot write to files")
+
+def run_clean(args, config):
+    """Data cleaning (the `clean` subcommand)."""
+    import src.clean as clean
+    from src.artifacts import read_ratings, read_table, write_table
+
+    if config['clean']['streaming']: # the ratings are filtered in chunks, file to file
+        movies = clean.merge_data(read_table(args.input_movies), read_table(args.input_links))
+        clean.filter_rating_file(args.input_ratings, args.output_ratings,
+                                 chunksize=config['clean']['chunksize'],
+                                 **config['clean']['filter'])
+        write_table(movies, args.output_movies)
+        logger.info("Cleaned data saved to the given paths")
+        return
+
+    try:
+        movies = read_table(args.input_movies)
+        links = read_table(args.input_links)
+        # the rating times are kept if the raw data has them, for the metrics subcommand
+        ratings = read_ratings(args.input_ratings)
+        logger.info('Raw data loaded from the given paths')
+    except FileNotFoundError:
+        logger.error("Clean input files not found")
+
+    movies, ratings = clean.clean(movies, links, ratings, config['clean'])
+
+    try:
+        write_table(movies, args.output_movies)
+        write_table(ratings, args.output_ratings)
+        logger.info("Cleaned data saved to the given paths")
+    except IOError:
+        logger.error("Cannot write to files")
+
+def run_featurize(args, config):
+    """Feature engineering (the `featurize` subcommand)."""
+    import src.featurize as featurize
+    from src.artifacts import read_ratings, read_table, write_table
+
+    try:
+        movies = read_table(args.input_movies)
+        ratings = read_ratings(args.input_ratings, timestamp=False)
+        logger.info('Cleaned data loaded from the given paths')
+    except FileNotFoundError:
+        logger.error("Featurize input files not found")
+
+    movies = featurize.featurize(movies, ratings, **config['featurize']['featurize'])
+
+    try:
+        write_table(movies, args.output_movies)
+        logger.info("Featurized data saved to the given paths")
+    except IOError:
+        logger.error("Cannot write to file %s", args.output_movies)
+
+def run_train(args, config):
+    """Model training (the `train` subcommand)."""
+    import numpy as np
+
+    import src.als as als
+    import src.ann as ann
+    import src.stream as stream
+    import src.train as train
+    import src.update as update
+    from src.artifacts import read_ratings, write_matrix
+
+    if config['train']['engine'] == 'ann' and args.output_neighbors is None:
+        logger.error("The ann engine needs --output_neighbors")
+        raise ValueError("The ann engine needs --output_neighbors")
+    if config['train']['engine'] == 'als' and args.output_factors is None:
+        logger.error("The als engine needs --output_factors")
+        raise ValueError("The als engine needs --output_factors")
+    if config['train']['streaming'] and (config['train']['engine'] != 'exact'
+                                         or args.output_neighbors is None):
+        logger.error("Streaming training needs the exact engine and --output_neighbors")
+        raise ValueError("Streaming training needs the exact engine and --output_neighbors")
+    if config['train']['compute_distance']['metric'] != 'pearson' and \
+            (config['train']['engine'] in ('ann', 'als') or config['train']['streaming']
+             or args.output_stats is not None):
+        logger.error("The ann and als engines, streaming and --output_stats only support "
+                     "the pearson metric")
+        raise ValueError("The ann and als engines, streaming and --output_stats only "
+                         "support the pearson metric")
+
+    ratings_pivot, statistics = None, None
+    if config['train']['streaming']: # the ratings are read in chunks, no pivot is built
+        movieID, userID, neighbors, scores, statistics = \
+            stream.train_streaming(args.input_ratings, config['train'])
+    else:
+        try:
+            ratings = read_ratings(args.input_ratings, timestamp=False)
+            logger.info('Featurized data loaded from the given path %s', args.input_ratings)
+        except FileNotFoundError:
+            logger.error("Train input file not found")
+
+        if config['train']['engine'] == 'ann':
+            ratings_pivot, movieID, userID, neighbors, scores = \
+                ann.train_ann(ratings, config['train'])
+        elif config['train']['engine'] == 'als':
+            ratings_pivot, movieID, userID, item_factors = \
+                als.train_als(ratings, config['train'])
+        elif args.output_neighbors is not None:
+            ratings_pivot, movieID, userID, neighbors, scores = \
+                train.train_neighbors(ratings, config['train'])
+        else:
+            ratings_pivot, movieID, userID, corr = train.train(ratings, config['train'])
+    if ratings_pivot is not None:
+        write_matrix(ratings_pivot, args.output_ratings_pivot)
+
+    try:
+        np.save(args.output_movie_id, movieID)
+        np.save(args.output_user_id, userID)
+        if args.output_factors is not None:
+            np.savez(args.output_factors, movie_id=movieID, factors=item_factors)
+        elif args.output_neighbors is not None:
+            np.savez(args.output_neighbors, movie_id=movieID, neighbors=neighbors,
+                     scores=scores)
+        else:
+            np.save(args.output_corr, corr)
+        if args.output_stats is not None:
+            if statistics is None:
+                statistics = update.get_statistics(ratings_pivot, movieID, userID)
+            update.save_statistics(statistics, args.output_stats)
+        logger.info("Model outputs saved to the given paths")
+    except IOError:
+        logger.error("Cannot write to files")
+
+def run_update(args, config):
+    """Incremental model update (the `update` subcommand)."""
+    import numpy as np
+
+    import src.update as update
+    from src.artifacts import read_ratings
+
+    try:
+        statistics = update.load_statistics(args.input_stats)
+        with np.load(args.input_neighbors) as f:
+            neighbors = dict(f)
+        delta = read_ratings(args.input_delta, timestamp=False)
+        logger.info('Model and new ratings loaded from the given paths')
+    except FileNotFoundError:
+        logger.error('Update input files not found')
+
+    statistics, affected = update.update_statistics(statistics, delta)
+    neighbors, scores = update.update_neighbors(statistics, affected, neighbors,
+                                                **config['train']['get_neighbors'])
+
+    try:
+        update.save_statistics(statistics, args.output_stats)
+        np.savez(args.output_neighbors, movie_id=statistics['movie_id'], neighbors=neighbors,
+                 scores=scores)
+        logger.info("Updated model saved to the given paths")
+    except IOError:
+        logger.error("Cannot write to files")
+
+def run_predict(args, config):
+    """Predict (the `predict` subcommand)."""
+    import numpy as np
+
+    import src.predict as predict
+    from src.artifacts import write_table
+
+    try:
+        if args.input_neighbors is not None:
+            # the index carries its own movie IDs, which an update may have extended
+            with np.load(args.input_neighbors) as f:
+                neighbors, movieID = f['neighbors'], f['movie_id']
+        elif args.input_factors is not None:
+            with np.load(args.input_factors) as f:
+                item_factors, movieID = f['factors'], f['movie_id']
+        else:
+            # mapped rather than read, so process workers can share the file without a copy
+            corr = np.load(args.input_corr, mmap_mode='r')
+            movieID = np.load(args.input_movie_id)
+        logger.info('Trained objects loaded from the given paths')
+    except FileNotFoundError:
+        logger.error('Trained objects not found in the given paths')
+
+    if args.input_neighbors is not None:
+        predictions = predict.predict_neighbors(neighbors, movieID, config['predict'])
+    elif args.input_factors is not None:
+        predictions = predict.predict_factors(item_factors, movieID, config['predict'])
+    else:
+        predictions = predict.predict(corr, movieID, config['predict'])
+
+    try:
+        write_table(predictions, args.output_predictions)
+        logger.info("Predictions saved to the given paths")
+    except IOError:
+        logger.error("Cannot write to file %s", args.output_predictions)
+
+def run_evaluate(args, config):
+    """Model evaluation (the `evaluate` subcommand)."""
+    import numpy as np
+    import pandas as pd
+
+    import src.evaluate as evaluate
+    import src.predict as predict
+    from src.artifacts import read_matrix, read_ratings
+
+    if args.input_ratings is not None and args.input_neighbors is None and \
+            args.input_factors is None:
+        logger.error("Evaluating from --input_ratings needs --input_neighbors or "
+                     "--input_factors")
+        raise ValueError("Evaluating from --input_ratings needs --input_neighbors or "
+                         "--input_factors")
+
+    try:
+        corr, neighbors = None, None
+        if args.input_neighbors is not None:
+            with np.load(args.input_neighbors) as f:
+                index_movie_id, neighbors = f['movie_id'], f['neighbors']
+        elif args.input_factors is not None:
+            # the most similar movie of each movie, ranked from the factors
+            with np.load(args.input_factors) as f:
+                index_movie_id = f['movie_id']
+                neighbors = predict.get_factor_neighbors(f['factors'], index_movie_id,
+                                                         k=1)[0]
+        else:
+            corr = np.load(args.input_corr)
+
+        if args.input_ratings is not None:
+            ratings = read_ratings(args.input_ratings, timestamp=False)
+        else:
+            ratings_pivot = read_matrix(args.input_ratings_pivot)
+            movie_id = np.load(args.input_movie_id)
+            user_id = np.load(args.input_user_id)
+            if neighbors is not None:
+                # align the rows of the index with the movies of the rating matrix
+                neighbors = neighbors[pd.Index(index_movie_id).get_indexer(movie_id)]
+        logger.info('Inputs loaded from the given paths')
+    except FileNotFoundError:
+        logger.error('Inputs not found in the given paths')
+        raise
+
+    if args.input_ratings is not None:
+        result = evaluate.evaluate_ratings(ratings, index_movie_id, neighbors)
+    else:
+        result = evaluate.evaluate(ratings_pivot, movie_id, user_id, corr, neighbors)
+
+    try:
+        with open(args.output, 'w') as f:
+            f.write("Average satisfaction score %.2f: " % result)
+        logger.info("Evaluation score saved to the given path")
+    except IOError:
+        logger.error("Cannot write to file %s", args.output)
+
+def run_metrics(args, config):
+    """Ranking metrics on a holdout (the `metrics` subcommand)."""
+    import src.metrics as metrics
+    from src.artifacts import read_ratings
+
+    try:
+        ratings = read_ratings(args.input_ratings)
+        logger.info('Cleaned data loaded from the given path %s', args.input_ratings)
+    except FileNotFoundError:
+        logger.error("Metrics input file not found")
+
+    train_ratings, test_ratings = metrics.holdout_split(ratings,
+                                                        **config['evaluate']['holdout_split'])
+    movieID, neighbors, scores = metrics.fit_neighbors(train_ratings, config['train'])
+    result = metrics.evaluate_ranking(train_ratings, movieID, neighbors, scores, test_ratings,
+                                      **config['evaluate']['evaluate_ranking'])
+
+    try:
+        result.to_csv(args.output)
+        logger.info("Ranking metrics saved to the given path")
+    except IOError:
+        logger.error("Cannot write to file %s", args.output)
+
+def run_cv(args, config):
+    """Cross-validation (the `cv` subcommand)."""
+    import src.cross_validate as cross_validate
+    from src.artifacts import read_ratings
+
+    try:
+        ratings = read_ratings(args.input_ratings, timestamp=False)
+        logger.info('Ratings loaded from the given path %s', args.input_ratings)
+    except FileNotFoundError:
+        logger.error("Cross-validation input file not found")
+
+    result = cross_validate.cross_validate(ratings, config,
+                                           **config['cross_validate']['cross_validate'])
+
+    try:
+        result.to_csv(args.output, index=False)
+        logger.info("Cross-validation scores saved to the given path")
+    except IOError:
+        logger.error("Cannot write to file %s", args.output)
+
+def run_pipeline(args, config):
+    """The whole model pipeline in memory (the `pipeline` subcommand)."""
+    import src.pipeline as pipeline
+
+    raw_paths = None
+    if args.input_movies is not None or args.input_links is not None or \
+            args.input_ratings is not None:
+        if None in (args.input_movies, args.input_links, args.input_ratings):
+            logger.error("Loading raw data locally needs --input_movies, --input_links and "
+                         "--input_ratings")
+            raise ValueError("Loading raw data locally needs --input_movies, --input_links "
+                             "and --input_ratings")
+        raw_paths = {'movies': args.input_movies, 'links': args.input_links,
+                     'ratings': args.input_ratings}
+
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+    outputs = pipeline.run_pipeline(config, raw_paths, args.output_dir,
+                                    args.artifact_format or 'csv',
+                                    **config['pipeline']['run_pipeline'])
+    logger.info("Average satisfaction score %.2f", outputs['evaluate']['score'])
+
+# the handler of each subcommand, which imports the modules it needs only when it runs
+SUBCOMMANDS = {'upload': run_upload, 'create_db': run_create_db,
+               'ingest_to_movies': run_ingest_to_movies,
+               'ingest_to_predictions': run_ingest_to_predictions, 'acquire': run_acquire,
+               'clean': run_clean, 'featurize': run_featurize, 'train': run_train,
+               'update': run_update, 'predict': run_predict, 'evaluate': run_evaluate,
+               'metrics': run_metrics, 'cv': run_cv, 'pipeline': run_pipeline}
 
 
 if __name__ == '__main__':
@@ -29,13 +398,29 @@ if __name__ == '__main__':
     # Add parsers for both creating a database and adding movies to it
     parser = argparse.ArgumentParser(description="Create and/or add data to database")
     parser.add_argument('--config', default=None, help='Path to configuration file')
+    parser.add_argument('--artifact_format', default=None, choices=['csv', 'parquet', 'feather'],
+                        help='Format of the tables passed between stages, replacing the '
+                        'extension of their paths (rating matrices become sparse .npz in the '
+                        'binary formats), if not given the extensions of the paths are used')
+    parser.add_argument('--force', action='store_true',
+                        help='Run the stage even if its inputs, configuration and code are '
+                        'unchanged since its last run')
+    parser.add_argument('--profile', default=None,
+                        help='Path to save a JSON report of the wall time, CPU time, memory '
+                        'change and data volume of the stage and its major functions')
+    parser.add_argument('--profile_stats', default=None,
+                        help='Path to save a cProfile dump of the stage, readable with pstats')
 
     subparsers = parser.add_subparsers(dest='subparser_name')
 
     # UPLOAD DATA TO S3
     sb_upload = subparsers.add_parser("upload", description="Upload raw datasets to S3 bucket")
     sb_upload.add_argument("--data_file", default='movies.csv',
-                        choices=['movies.csv', 'links.csv', 'ratings.csv'], help="dataset name")
+                        choices=['movies.csv', 'links.csv', 'ratings.csv', 'all'],
+                        help="dataset name, all to upload the three datasets at once")
+    sb_upload.add_argument("--batch", action='store_true',
+                        help="upload every file under --local_path at once, skipping the "
+                        "ones already in S3")
     sb_upload.add_argument("--local_path", default='data/sample/',
                         help="local path to store and/or load from the raw datasets")
     sb_upload.add_argument('--s3_path', default='s3://2021-msia423-fei-lanqi/raw/',
@@ -53,14 +438,14 @@ if __name__ == '__main__':
     sb_ingest_movies.add_argument("--engine_string", default=SQLALCHEMY_DATABASE_URI,
                         help="SQLAlchemy connection URI for database")
     sb_ingest_movies.add_argument("--file_path", default="data/outputs/movies-feature.csv",
-                        help="Path of the csv file")
+                        help="Path of the csv, parquet or feather file")
 
     sb_ingest_pred = subparsers.add_parser("ingest_to_predictions",
                         description="Add data to predictions table")
     sb_ingest_pred.add_argument("--engine_string", default=SQLALCHEMY_DATABASE_URI,
     help="SQLAlchemy connection URI for database")
     sb_ingest_pred.add_argument("--file_path", default="models/predictions-predict.csv",
-    help="Path of the csv file")
+    help="Path of the csv, parquet or feather file")
 
     # MODEL PIPELINE
     # Sub-parser for acquiring data
@@ -101,13 +486,35 @@ if __name__ == '__main__':
     sb_train.add_argument("--input_ratings", default="data/outputs/ratings-clean.csv",
                         help="Path to load cleaned ratings data")
     sb_train.add_argument("--output_ratings_pivot", default="models/ratings-pivot-train.csv",
-                        help="Path to ratings matrix")
+                        help="Path to ratings matrix (saved as .npz if the matrix is sparse "
+                        "or the path ends with .npz)")
     sb_train.add_argument("--output_movie_id", default="models/movieID-train.npy",
     help="Path to save movie IDs array")
     sb_train.add_argument("--output_user_id", default="models/userID-train.npy",
                         help="Path to save user IDs array")
     sb_train.add_argument("--output_corr", default="models/corr-train.npy",
                         help="Path to save trained distance matrix")
+    sb_train.add_argument("--output_neighbors", default=None,
+                        help="Path to save a top-K neighbour index (.npz) instead of the "
+                        "full distance matrix")
+    sb_train.add_argument("--output_stats", default=None,
+                        help="Path to save the sufficient statistics (.npz) for incremental "
+                        "updates")
+    sb_train.add_argument("--output_factors", default=None,
+                        help="Path to save the movie factors (.npz) of the als engine")
+
+    # Sub-parser for incremental model updates
+    sb_update = subparsers.add_parser("update", description="Fold new ratings into the model")
+    sb_update.add_argument("--input_stats", default="models/stats-train.npz",
+                        help="Path to load the sufficient statistics")
+    sb_update.add_argument("--input_neighbors", default="models/neighbors-train.npz",
+                        help="Path to load the top-K neighbour index")
+    sb_update.add_argument("--input_delta", default="data/outputs/ratings-delta.csv",
+                        help="Path to load the new ratings")
+    sb_update.add_argument("--output_stats", default="models/stats-train.npz",
+                        help="Path to save the updated sufficient statistics")
+    sb_update.add_argument("--output_neighbors", default="models/neighbors-train.npz",
+                        help="Path to save the updated top-K neighbour index")
 
     # Sub-parser for generating predictions
     sb_predict = subparsers.add_parser("predict", description="Generate predictions")
@@ -115,135 +522,160 @@ if __name__ == '__main__':
                         help="Path to load movieID array")
     sb_predict.add_argument("--input_corr", default="models/corr-train.npy",
                         help="Path to load distance matrix")
+    sb_predict.add_argument("--input_neighbors", default=None,
+                        help="Path to load a top-K neighbour index, used instead of the "
+                        "distance matrix if given")
+    sb_predict.add_argument("--input_factors", default=None,
+                        help="Path to load the movie factors of the als engine, used instead "
+                        "of the distance matrix if given")
     sb_predict.add_argument("--output_predictions", default="models/predictions-predict.csv",
                         help="Path to save predictions")
 
     # Sub-parser for evaluating model
     sb_evaluate = subparsers.add_parser("evaluate", description="Evaluate model performance")
+    sb_evaluate.add_argument("--input_ratings", default=None,
+                        help="Path to load the cleaned long-format ratings, used with "
+                        "--input_neighbors or --input_factors instead of the ratings matrix")
     sb_evaluate.add_argument("--input_ratings_pivot", default="models/ratings-pivot-train.csv",
-                        help="Path to load ratings matrix")
+                        help="Path to load ratings matrix (a table or sparse .npz)")
     sb_evaluate.add_argument("--input_user_id", default="models/userID-train.npy",
                         help="Path to load userID array")
     sb_evaluate.add_argument("--input_movie_id", default="models/movieID-train.npy",
                         help="Path to load movieID array")
     sb_evaluate.add_argument("--input_corr", default="models/corr-train.npy",
                         help="Path to load distance matrix")
+    sb_evaluate.add_argument("--input_neighbors", default=None,
+                        help="Path to load a top-K neighbour index, used instead of the "
+                        "distance matrix if given")
+    sb_evaluate.add_argument("--input_factors", default=None,
+                        help="Path to load the movie factors of the als engine, used instead "
+                        "of the distance matrix if given")
     sb_evaluate.add_argument("--output", default="data/outputs/score-evaluate.txt",
                         help="Path to save the satisfaction score")
 
+    # Sub-parser for ranking metrics
+    sb_metrics = subparsers.add_parser("metrics",
+                        description="Compute ranking metrics on a time-based holdout")
+    sb_metrics.add_argument("--input_ratings", default="data/outputs/ratings-clean.csv",
+                        help="Path to load cleaned ratings data")
+    sb_metrics.add_argument("--output", default="data/outputs/metrics-evaluate.csv",
+                        help="Path to save the metrics at each cutoff")
+
+    # Sub-parser for cross-validation
+    sb_cv = subparsers.add_parser("cv",
+                        description="Cross-validate train, predict and evaluate over k folds")
+    sb_cv.add_argument("--input_ratings", default="data/outputs/ratings-clean.csv",
+                        help="Path to load the ratings data")
+    sb_cv.add_argument("--output", default="data/outputs/cv-evaluate.csv",
+                        help="Path to save the scores of each fold and their aggregate")
+
+    # Sub-parser for the whole model pipeline in one process
+    sb_pipeline = subparsers.add_parser("pipeline",
+                        description="Run acquire, clean, featurize, train, predict and evaluate "
+                        "in one process")
+    sb_pipeline.add_argument("--config", default="config/modelconfig.yaml",
+                        help="Model configuration file")
+    sb_pipeline.add_argument("--input_movies", default=None,
+                        help="Path to load raw movies data instead of acquiring it from S3")
+    sb_pipeline.add_argument("--input_links", default=None,
+                        help="Path to load raw links data instead of acquiring it from S3")
+    sb_pipeline.add_argument("--input_ratings", default=None,
+                        help="Path to load raw ratings data instead of acquiring it from S3")
+    sb_pipeline.add_argument("--output_dir", default=None,
+                        help="Directory to save the outputs of every stage, nothing is saved "
+                        "if not given")
+
     args = parser.parse_args()
     sp_used = args.subparser_name
 
+    if args.artifact_format is not None:
+        from src.artifacts import with_format
+        # only the default paths are rewritten, the ones given are used as they are
+        defaults = subparsers.choices[sp_used] if sp_used is not None else parser
+        for name in TABLE_ARGS + MATRIX_ARGS:
+            path = getattr(args, name, None)
+            if path is None:
+                continue
+            if path == defaults.get_default(name):
+                setattr(args, name, with_format(path, args.artifact_format,
+                                                matrix=name in MATRIX_ARGS))
+            elif with_format(path, args.artifact_format, matrix=name in MATRIX_ARGS) != path:
+                logger.warning("--%s %s is not in the %s format and is used as given", name,
+                               path, args.artifact_format)
+
     # Load configuration file for parameters and tmo path
+    config = None
     if args.config is not None:
+        import yaml
         try:
             with open(args.config, "r") as f:
                 config = yaml.load(f, Loader=yaml.FullLoader)
         except FileNotFoundError:
             logger.error("Configuration file not found in %s", args.config)
-    if sp_used == 'upload': # upload to s3
-        upload_file_to_s3(args.local_path, args.s3_path, args.data_file)
-    elif sp_used == 'create_db': # create database
-        create_db(args.engine_string)
-    elif sp_used == 'ingest_to_movies': # movies data ingestion
-        mm = MovieManager(engine_string=args.engine_string)
-        mm.add_movie_from_csv(args.file_path)
-        mm.close()
-    elif sp_used == 'ingest_to_predictions': # predictions data ingestion
-        mm = MovieManager(engine_string=args.engine_string)
-        mm.add_prediction_from_csv(args.file_path)
-        mm.close()
-    elif sp_used == 'acquire': # model pipeline data acquisition
-        movies, links, ratings = acquire.acquire(**config['acquire']['acquire'])
-
-        try:
-            movies.to_csv(args.output_movies, index=False)
-            links.to_csv(args.output_links, index=False)
-            ratings.to_csv(args.output_ratings, index=False)
-            logger.info('Raw data saved to the given paths')
-        except IOError:
-            logger.error("Cannot write to files")
-    elif sp_used == 'clean': # data cleaning
-        try:
-            movies = pd.read_csv(args.input_movies)
-            links = pd.read_csv(args.input_links)
-            ratings = pd.read_csv(args.input_ratings)
-            logger.info('Raw data loaded from the given paths')
-        except FileNotFoundError:
-            logger.error("Clean input files not found")
-
-        movies, ratings = clean.clean(movies, links, ratings, config['clean'])
 
-        try:
-            movies.to_csv(args.output_movies, index=False)
-            ratings.to_csv(args.output_ratings, index=False)
-            logger.info("Cleaned data saved to the given paths")
-        except IOError:
-            logger.error("Cannot write to files")
-    elif sp_used == 'featurize': # feature engineering
-        try:
-            movies = pd.read_csv(args.input_movies)
-            ratings = pd.read_csv(args.input_ratings)
-            logger.info('Cleaned data loaded from the given paths')
-        except FileNotFoundError:
-            logger.error("Featurize input files not found")
-
-        movies = featurize.featurize(movies, ratings, **config['featurize']['featurize'])
-
-        try:
-            movies.to_csv(args.output_movies, index=False)
-            logger.info("Featurized data saved to the given paths")
-        except IOError:
-            logger.error("Cannot write to file %s", args.output_movies)
-    elif sp_used == 'train': # model training
-        try:
-            ratings = pd.read_csv(args.input_ratings)
-            logger.info('Featurized data loaded from the given path %s', args.input_ratings)
-        except FileNotFoundError:
-            logger.error("Train input file not found")
-
-        ratings_pivot, movieID, userID, corr = train.train(ratings)
-        ratings_pivot.to_csv(args.output_ratings_pivot, index=False)
-
-        try:
-            np.save(args.output_movie_id, movieID)
-            np.save(args.output_user_id, userID)
-            np.save(args.output_corr, corr)
-            logger.info("Model outputs saved to the given paths")
-        except IOError:
-            logger.error("Cannot write to files")
-    elif sp_used == 'predict': # predict
-        try:
-            corr = np.load(args.input_corr)
-            movieID = np.load(args.input_movie_id)
-            logger.info('Trained objects loaded from the given paths')
-        except FileNotFoundError:
-            logger.error('Trained objects not found in the given paths')
+    # sparse rating matrices are stored as .npz, so that train writes where it says it does
+    if config is not None and config['train']['get_rating_matrix']['sparse']:
+        path = getattr(args, 'output_ratings_pivot', None)
+        if path is not None and not path.endswith('.npz'):
+            args.output_ratings_pivot = os.path.splitext(path)[0] + '.npz'
+            logger.info("The rating matrix is sparse, --output_ratings_pivot is %s",
+                        args.output_ratings_pivot)
+    # the rating matrix read is the one train wrote last, whatever the configuration given
+    if getattr(args, 'input_ratings_pivot', None) is not None:
+        from src.artifacts import find_matrix
+        args.input_ratings_pivot = find_matrix(args.input_ratings_pivot)
 
-        predictions = predict.predict(corr, movieID, config['predict'])
+    options = {name: value for name, value in vars(args).items()
+               if name not in ('config', 'force', 'profile', 'profile_stats')}
+    inputs = [value for name, value in options.items()
+              if (name.startswith('input') or name == 'file_path') and value is not None]
+    outputs = [value for name, value in options.items()
+               if name.startswith('output') and value is not None]
 
-        try:
-            predictions.to_csv(args.output_predictions, index=False)
-            logger.info("Predictions saved to the given paths")
-        except IOError:
-            logger.error("Cannot write to file %s", args.output_predictions)
-    elif sp_used == 'evaluate': # model evaluation
-        try:
-            ratings_pivot = pd.read_csv(args.input_ratings_pivot)
-            corr = np.load(args.input_corr)
-            movie_id = np.load(args.input_movie_id)
-            user_id = np.load(args.input_user_id)
-            logger.info('Inputs loaded from the given paths')
-        except FileNotFoundError:
-            logger.error('Inputs not found in the given paths')
+    if args.profile is not None:
+        import src.profiling as profiling
+        profiling.enable()
+        stage_token = profiling.start(sp_used)
+    if args.profile_stats is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
 
-        result = evaluate.evaluate(ratings_pivot, movie_id, user_id, corr)
+    # a stage is skipped if it ran on the same inputs, configuration, options and code
+    fresh = False
+    if sp_used in STAGE_CONFIG:
+        # the raw objects of acquire are remote, so their versions stand for the input files
+        remote = None
+        if sp_used == 'acquire':
+            import src.acquire as acquire
+            acquire_config = config['acquire']['acquire']
+            remote = acquire.get_versions(acquire_config['s3_path'], [
+                acquire_config[name] for name in ('file_name_movies', 'file_name_links',
+                                                  'file_name_ratings')])
+        stage_fingerprint = fingerprint.get_fingerprint(
+            inputs, {section: config[section] for section in STAGE_CONFIG[sp_used]}, options,
+            fingerprint.get_code_version(glob.glob('src/*.py') + [__file__]), remote)
+        fingerprint_path = outputs[0] + '.fingerprint'
+        # without the versions of the raw objects, acquire cannot tell they are unchanged
+        fresh = not args.force and not (sp_used == 'acquire' and remote is None) and \
+            fingerprint.is_fresh(fingerprint_path, stage_fingerprint)
+        start = time.time()
 
-        try:
-            with open(args.output, 'w') as f:
-                f.write("Average satisfaction score %.2f: " % result)
-            logger.info("Evaluation score saved to the given path")
-        except IOError:
-            logger.error("Cannot write to file %s", args.output)
+    if fresh:
+        logger.info("Stage %s is up to date with its inputs, configuration and code, skipped "
+                    "(use --force to run it anyway)", sp_used)
+    elif sp_used in SUBCOMMANDS:
+        SUBCOMMANDS[sp_used](args, config)
     else:
         parser.print_help()
+
+    if sp_used in STAGE_CONFIG and not fresh:
+        fingerprint.save_fingerprint(fingerprint_path, stage_fingerprint, outputs, start)
+
+    if args.profile_stats is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile_stats)
+        logger.info("cProfile stats saved to %s", args.profile_stats)
+    if args.profile is not None:
+        profiling.stop(stage_token, inputs, outputs)
+        profiling.save_report(args.profile)
@@ -1,14 +1,240 @@
 """Model pipeline acquire script."""
 
+import gzip
 import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import pandas as pd
+import boto3
 import botocore
+from botocore.config import Config
+
+import src.cache as cache
+from src.artifacts import read_ratings
+from src.data_acquisition import parse_s3
+from src.fingerprint import hash_file
 
 logger = logging.getLogger(__name__)
 
+# how many bytes of a response body are read and written at a time
+BUFFER_SIZE = 2**20
+
+
+def get_ranges(size, part_size):
+    """
+    Split an object into the byte ranges of its parts.
+
+    Args:
+        size (int) - the size of the object in bytes
+        part_size (int) - the largest size of a part in bytes
+
+    Returns:
+        ranges (list) - the first and last byte of each part, inclusive as in HTTP ranges
+    """
+    if part_size <= 0:
+        logger.error("The part size should be positive, not %d", part_size)
+        raise ValueError("The part size should be positive, not %d" % part_size)
+
+    return [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+def download_part(client, bucket, key, first, last, path, retries=3, backoff=1.):
+    """
+    Download a byte range of an object into the same range of a local file.
+
+    Failed or incomplete transfers are retried, waiting twice as long before each retry.
+
+    Args:
+        client (botocore.client.S3) - the S3 client, or a stand-in with `get_object`
+        bucket (str) - the bucket of the object
+        key (str) - the key of the object
+        first (int) - the first byte of the range
+        last (int) - the last byte of the range, inclusive
+        path (str) - the local file, already created, to write the range to
+        retries (int) - how many times a failed transfer is retried
+        backoff (float) - the seconds to wait before the first retry
+
+    Returns:
+        size (int) - the number of bytes downloaded
+    """
+    for attempt in range(retries + 1):
+        try:
+            body = client.get_object(Bucket=bucket, Key=key,
+                                     Range='bytes=%d-%d' % (first, last))['Body']
+            written = 0
+            with open(path, 'r+b') as f:
+                f.seek(first)
+                for chunk in iter(lambda: body.read(BUFFER_SIZE), b''):
+                    f.write(chunk)
+                    written += len(chunk)
+            if written != last - first + 1:
+                raise IOError("Got %d of %d bytes" % (written, last - first + 1))
+            return written
+        except botocore.exceptions.NoCredentialsError:
+            raise
+        except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError,
+                IOError) as error:
+            if attempt == retries:
+                logger.error("Downloading bytes %d-%d of s3://%s/%s failed %d times: %s",
+                             first, last, bucket, key, retries + 1, error)
+                raise
+            logger.warning("Downloading bytes %d-%d of s3://%s/%s failed, retrying: %s",
+                           first, last, bucket, key, error)
+            time.sleep(backoff * 2**attempt)
+
+def decompress(path, output_path):
+    """
+    Decompress a gzip file chunk by chunk, without holding it in memory.
+
+    The ranges of a gzip object are downloaded in parallel into the compressed file first,
+    as a gzip stream can only be decompressed from its start, so the disk holds both the
+    compressed and the decompressed copy until the compressed one is removed.
+
+    Args:
+        path (str) - the gzip file, removed once decompressed
+        output_path (str) - the path of the decompressed file
+
+    Returns: None
+    """
+    if os.path.lexists(output_path):
+        os.remove(output_path)
+    with gzip.open(path, 'rb') as source, open(output_path, 'wb') as target:
+        shutil.copyfileobj(source, target, BUFFER_SIZE)
+    os.remove(path)
+
+def download_files(s3_path, file_names, output_dir, part_size_mb=8, n_jobs=8, retries=3,
+                   backoff=1., cache_dir=None, cache_size_mb=2048, client=None):
+    """
+    Download objects from an s3 path concurrently, splitting the large ones in byte ranges.
+
+    The parts of every object share one pool of connections, so small objects download
+    alongside the parts of a large one. Gzip objects (.gz) are decompressed by `decompress`
+    once fully downloaded, not while their parts arrive. With a cache directory, objects
+    whose ETag is unchanged since an earlier download are linked from the cache instead.
+
+    Args:
+        s3_path (str) - the s3 path of the objects, e.g. s3://bucket/raw/
+        file_names (list) - the names of the objects under the s3 path
+        output_dir (str) - the local directory to download to
+        part_size_mb (float) - the size of the byte ranges downloaded in parallel, in MB
+        n_jobs (int) - how many ranges are downloaded at the same time
+        retries (int) - how many times a failed range is retried
+        backoff (float) - the seconds to wait before the first retry of a range
+        cache_dir (str) - the directory of the cache of downloaded objects, no cache if None
+        cache_size_mb (float) - the size of the cache, the least recently used objects are
+        evicted beyond it
+        client (botocore.client.S3) - the S3 client, or a stand-in with `head_object` and
+        `get_object`, a new one if None
+
+    Returns:
+        paths (list) - the local path of each object, without the .gz extension
+    """
+    if client is None:
+        client = boto3.client('s3', config=Config(max_pool_connections=max(n_jobs, 10)))
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+
+    objects, cached = {}, {}
+    for file_name in file_names:
+        bucket, key = parse_s3(s3_path + file_name)
+        head = client.head_object(Bucket=bucket, Key=key)
+        path = os.path.join(output_dir, os.path.basename(key))
+        item = {'bucket': bucket, 'key': key, 'etag': head.get('ETag'), 'path': path}
+
+        cache_path = None
+        if cache_dir is not None and item['etag'] is not None:
+            cache_path = cache.lookup(cache_dir, bucket, key, item['etag'])
+        if cache_path is not None:
+            item['path'] = path[:-len('.gz')] if path.endswith('.gz') else path
+            cache.link_file(cache_path, item['path'])
+            cached[file_name] = item
+            continue
+
+        # an earlier file may be linked from the cache, so it is replaced rather than written
+        if os.path.lexists(path):
+            os.remove(path)
+        with open(path, 'wb') as f:
+            f.truncate(head['ContentLength'])
+        item.update(size=head['ContentLength'],
+                    ranges=get_ranges(head['ContentLength'], int(part_size_mb * 2**20)))
+        objects[file_name] = item
+
+    done = {file_name: 0 for file_name in file_names}
+    total = sum(item['size'] for item in objects.values())
+    with ThreadPoolExecutor(max(n_jobs, 1)) as executor:
+        futures = {executor.submit(download_part, client, item['bucket'], item['key'], first,
+                                   last, item['path'], retries, backoff): file_name
+                   for file_name, item in objects.items() for first, last in item['ranges']}
+        downloaded = 0
+        for future in as_completed(futures):
+            file_name = futures[future]
+            size = future.result()
+            done[file_name] += size
+            downloaded += size
+            logger.debug("Downloaded %.1f of %.1f MB", downloaded / 2**20, total / 2**20)
+            if done[file_name] == objects[file_name]['size']:
+                logger.info("%s downloaded (%.1f MB)", file_name, done[file_name] / 2**20)
+
+    for item in objects.values():
+        if item['path'].endswith('.gz'):
+            decompress(item['path'], item['path'][:-len('.gz')])
+            item['path'] = item['path'][:-len('.gz')]
+
+    seconds = time.perf_counter() - start
+    logger.info("%d files (%.1f MB) downloaded in %.1f s, %.1f MB/s, %d reused from the cache",
+                len(objects), total / 2**20, seconds, total / 2**20 / max(seconds, 1e-9),
+                len(cached))
+
+    if cache_dir is not None:
+        in_use = [cache.get_cache_path(cache_dir, item['bucket'], item['key'], item['etag'])
+                  for item in cached.values()]
+        for item in objects.values():
+            if item['etag'] is not None:
+                in_use.append(cache.store(cache_dir, item['bucket'], item['key'],
+                                          item['etag'], item['path']))
+        cache.evict(cache_dir, cache_size_mb, keep=in_use)
+
+    return [(objects.get(file_name) or cached[file_name])['path'] for file_name in file_names]
+
+def get_versions(s3_path, file_names, client=None):
+    """
+    Get the version of each raw object, so that a new upload reruns the acquisition.
+
+    S3 objects are described by their ETag and size from `head_object`, without being
+    downloaded, and local files by the hash of their content.
+
+    Args:
+        s3_path (str) - the s3 path of the objects, or a local directory
+        file_names (list) - the names of the objects under the path
+        client (botocore.client.S3) - the S3 client, or a stand-in with `head_object`, a
+        new one if None
+
+    Returns:
+        versions (dict) - the version of each object by path, None if S3 cannot be reached
+    """
+    versions = {}
+    for file_name in file_names:
+        path = s3_path + file_name
+        if not path.startswith('s3://'):
+            versions[path] = hash_file(path)
+            continue
+
+        if client is None:
+            client = boto3.client('s3')
+        bucket, key = parse_s3(path)
+        try:
+            head = client.head_object(Bucket=bucket, Key=key)
+        except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as error:
+            logger.warning("Cannot check the version of %s: %s", path, error)
+            return None
+        versions[path] = {'etag': head.get('ETag'), 'size': head['ContentLength']}
+
+    return versions
 
-def acquire(s3_path, file_name_movies, file_name_links, file_name_ratings):
+def acquire(s3_path, file_name_movies, file_name_links, file_name_ratings, timestamp=None,
+            download=None):
     """
     Load the raw data from the s3 path and returns the pandas dataframe.
 
@@ -17,6 +243,11 @@ def acquire(s3_path, file_name_movies, file_name_links, file_name_ratings):
         file_name_movies (str) - movies data file name
         file_name_links (str) - links data file name
         file_name_ratings (str) - ratings data file name
+        timestamp (bool) - whether to keep the rating times, only used by the ranking metrics,
+        if None they are kept when the ratings have them
+        download (dict) - the keyword arguments of `download_files` but the s3 path and file
+        names, to download the files concurrently before reading them locally, if None
+        they are read from S3 one after another, .csv.gz ones decompressed as they are read
 
     Returns:
         movies (pandas.DataFrame) - movies dataframe
@@ -24,10 +255,16 @@ def acquire(s3_path, file_name_movies, file_name_links, file_name_ratings):
         ratings (pandas.DataFrame) - ratings dataframe
     """
     try:
+        if download is not None:
+            paths = download_files(s3_path, [file_name_movies, file_name_links,
+                                             file_name_ratings], **download)
+        else:
+            paths = [s3_path + file_name for file_name in (file_name_movies, file_name_links,
+                                                           file_name_ratings)]
         # download three raw datasets
-        movies = pd.read_csv(s3_path+file_name_movies)
-        links = pd.read_csv(s3_path+file_name_links)
-        ratings = pd.read_csv(s3_path+file_name_ratings)
+        movies = pd.read_csv(paths[0])
+        links = pd.read_csv(paths[1])
+        ratings = read_ratings(paths[2], timestamp)
     except botocore.exceptions.NoCredentialsError:
         logger.error('Please provide AWS credentials via AWS_ACCESS_KEY_ID "+\
         "and AWS_SECRET_ACCESS_KEY env variables.')
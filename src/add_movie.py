@@ -8,7 +8,8 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import Column, Integer, String, Float
 from sqlalchemy.exc import SQLAlchemyError
 from flask_sqlalchemy import SQLAlchemy
-import pandas as pd
+
+from src.profiling import profiled
 
 
 logger = logging.getLogger(__name__)
@@ -212,10 +213,14 @@ class MovieManager:
         else:
             logger.debug("Invalid record encountered and dropped during ingestion")
 
+    @profiled
     def add_movie_from_csv(self, file_path):
-        """Add movies to database from a csv file."""
+        """Add movies to database from a csv, parquet or feather file."""
+        # pandas is only needed for ingestion, not to create the database
+        from src.artifacts import read_table
+
         try:
-            data = pd.read_csv(file_path)
+            data = read_table(file_path)
             logger.info("Movies data loaded.")
         except FileNotFoundError:
             logger.error("The movie data is not found in %s", file_path)
@@ -288,10 +293,14 @@ class MovieManager:
         else:
             logger.debug("Invalid record encountered and dropped during ingestion")
 
+    @profiled
     def add_prediction_from_csv(self, file_path):
-        """Add predictions to database from a csv file."""
+        """Add predictions to database from a csv, parquet or feather file."""
+        # pandas is only needed for ingestion, not to create the database
+        from src.artifacts import read_table
+
         try:
-            data = pd.read_csv(file_path)
+            data = read_table(file_path)
             logger.info("Predictions data loaded.")
         except FileNotFoundError:
             logger.error("The prediction data is not found in %s", file_path)
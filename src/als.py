@@ -0,0 +1,171 @@
+"""Matrix factorization of the ratings by alternating least squares."""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from src.parallel import get_blocks, get_n_jobs
+from src.profiling import profiled
+from src.train import get_rating_matrix
+
+logger = logging.getLogger(__name__)
+
+
+def solve_block(rated, targets, counts, outer, regularization, start, stop, factors):
+    """
+    Solve the regularized least squares of one block of rows into the factors.
+
+    Args:
+        rated (scipy.sparse.csr_matrix) - the implicit matrix of who rated what
+        targets (numpy.array) - the ratings of each row projected on the fixed factors
+        counts (numpy.array) - the number of ratings of each row
+        outer (numpy.array) - the upper triangle of the outer product of each fixed factor
+        with itself
+        regularization (float) - the weight of the L2 penalty per rating
+        start (int) - the first row of the block
+        stop (int) - the row after the last row of the block
+        factors (numpy.array) - the output, filled in place for the block rows
+
+    Returns: None
+    """
+    rank = factors.shape[1]
+    upper, lower = np.triu_indices(rank)
+    # the Gram matrix of each row only sums the fixed factors it has ratings for
+    triangle = rated[start:stop] @ outer
+    gram = np.empty((stop - start, rank, rank))
+    gram[:, upper, lower] = triangle
+    gram[:, lower, upper] = triangle
+    gram += (regularization * np.maximum(counts[start:stop], 1))[:, None, None] * np.eye(rank)
+    factors[start:stop] = np.linalg.solve(gram, targets[start:stop, :, None])[:, :, 0]
+
+def solve_factors(ratings_matrix, fixed, regularization=0.1, block_size=1024, n_jobs=1):
+    """
+    Update the factors of every row of the ratings with the other side held fixed.
+
+    Only the given ratings enter the loss, with a penalty weighted by the number of
+    ratings of each row (ALS-WR). The Gram matrices of a block of rows come from a single
+    sparse product with the outer products of the fixed factors, of which only the upper
+    triangle is needed by symmetry, and are solved as a batch, so the work runs in
+    compiled code which releases the GIL for the threads.
+
+    Args:
+        ratings_matrix (scipy.sparse.csr_matrix) - the ratings, one row per solved factor
+        fixed (numpy.array) - the factors of the columns
+        regularization (float) - the weight of the L2 penalty per rating
+        block_size (int) - how many rows are solved at a time
+        n_jobs (int) - the number of threads, -1 for all cores
+
+    Returns:
+        factors (numpy.array) - the factors of the rows
+    """
+    n_rows, rank = ratings_matrix.shape[0], fixed.shape[1]
+    rated = ratings_matrix.copy()
+    rated.data[:] = 1
+
+    upper, lower = np.triu_indices(rank)
+    outer = fixed[:, upper] * fixed[:, lower]
+    targets = ratings_matrix @ fixed
+    counts = np.diff(ratings_matrix.indptr)
+
+    factors = np.empty((n_rows, rank))
+    blocks = get_blocks(n_rows, block_size)
+    n_jobs = min(get_n_jobs(n_jobs), len(blocks))
+
+    if n_jobs == 1:
+        for start, stop in blocks:
+            solve_block(rated, targets, counts, outer, regularization, start, stop, factors)
+    else:
+        with ThreadPoolExecutor(n_jobs) as executor:
+            list(executor.map(lambda block: solve_block(rated, targets, counts, outer,
+                                                        regularization, *block, factors),
+                              blocks))
+
+    return factors
+
+def get_rmse(ratings_matrix, item_factors, user_factors, block_size=1024):
+    """
+    Compute the root mean squared error of the factorization on the given ratings.
+
+    Args:
+        ratings_matrix (scipy.sparse.csr_matrix) - the movies by users ratings
+        item_factors (numpy.array) - the factors of the movies
+        user_factors (numpy.array) - the factors of the users
+        block_size (int) - how many movies are scored at a time
+
+    Returns:
+        rmse (float) - the error on the given ratings
+    """
+    squared_error = 0.
+    for start, stop in get_blocks(ratings_matrix.shape[0], block_size):
+        block = ratings_matrix[start:stop].tocoo()
+        predicted = np.einsum('ij,ij->i', item_factors[start + block.row],
+                              user_factors[block.col])
+        squared_error += ((block.data - predicted)**2).sum()
+
+    return np.sqrt(squared_error / max(ratings_matrix.nnz, 1))
+
+@profiled
+def fit_als(ratings_pivot, rank=32, n_iter=10, regularization=0.1, block_size=1024, n_jobs=1,
+            seed=423):
+    """
+    Factorize the movies by users ratings into low-rank movie and user factors.
+
+    Args:
+        ratings_pivot (pandas.DataFrame or scipy.sparse matrix) - the pivoted ratings
+        rank (int) - the dimension of the factors
+        n_iter (int) - the number of alternating sweeps over users and movies
+        regularization (float) - the weight of the L2 penalty per rating
+        block_size (int) - how many rows are solved at a time
+        n_jobs (int) - the number of threads, -1 for all cores
+        seed (int) - the random seed of the initial movie factors
+
+    Returns:
+        item_factors (numpy.array) - the factors of the movies
+        user_factors (numpy.array) - the factors of the users
+    """
+    if isinstance(ratings_pivot, pd.DataFrame):
+        ratings_matrix = scipy.sparse.csr_matrix(ratings_pivot.values, dtype=np.float64)
+    elif scipy.sparse.issparse(ratings_pivot):
+        ratings_matrix = scipy.sparse.csr_matrix(ratings_pivot, dtype=np.float64)
+    else:
+        logger.error("Provided argument `ratings_pivot` is not a Panda's DataFrame object")
+        raise TypeError("Provided argument `ratings_pivot` is not a Panda's DataFrame object")
+
+    ratings_t = ratings_matrix.T.tocsr()
+    rng = np.random.default_rng(seed)
+    item_factors = rng.normal(scale=0.1, size=(ratings_matrix.shape[0], rank))
+
+    for iteration in range(n_iter):
+        user_factors = solve_factors(ratings_t, item_factors, regularization, block_size,
+                                     n_jobs)
+        item_factors = solve_factors(ratings_matrix, user_factors, regularization, block_size,
+                                     n_jobs)
+        logger.debug("ALS sweep %d of %d done", iteration + 1, n_iter)
+
+    logger.info("The rank %d factorization of %d movies and %d users has a training RMSE of "
+                "%.3f", rank, ratings_matrix.shape[0], ratings_matrix.shape[1],
+                get_rmse(ratings_matrix, item_factors, user_factors, block_size))
+
+    return item_factors, user_factors
+
+def train_als(ratings, config):
+    """
+    Perform all model training steps with the matrix factorization engine.
+
+    Args:
+        ratings (pandas.DataFrame) - the cleaned ratings dataframe
+        config (dict) - the `train` section of the model configuration
+
+    Returns:
+        ratings_pivot (pandas.DataFrame or scipy.sparse.csr_matrix) - the pivoted ratings
+        movie_id (list) - the movie IDs used for modeling
+        user_id (list) - the user IDs used for modeling
+        item_factors (numpy.array) - the factors of the movies (the trained model object)
+    """
+    ratings_pivot, movie_id, user_id = get_rating_matrix(ratings, **config['get_rating_matrix'])
+    item_factors, _ = fit_als(ratings_pivot, **config['fit_als'])
+
+    return ratings_pivot, movie_id, user_id, item_factors
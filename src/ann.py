@@ -0,0 +1,337 @@
+"""Approximate nearest neighbours of movies by random-projection LSH."""
+
+import logging
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from src.profiling import profiled
+from src.train import get_rating_matrix, get_row_moments, get_top_k, iter_corr_blocks
+
+logger = logging.getLogger(__name__)
+
+
+# the extra hyperplanes of each table that split the buckets larger than the maximum size
+SPLIT_BITS = 4
+
+
+def get_n_bits(n_movies, max_bucket_size=256):
+    """
+    Get the number of bits per table that spreads the movies over buckets of about the
+    maximum size, so that the cost per movie stays the same as the catalogue grows.
+
+    Args:
+        n_movies (int) - the number of movies
+        max_bucket_size (int) - the maximum number of movies compared within a bucket
+
+    Returns:
+        n_bits (int) - the number of bits per table
+    """
+    return max(0, int(np.ceil(np.log2(n_movies / max_bucket_size))))
+
+def get_embedding(ratings_matrix, rank=32, n_iter=1, seed=423):
+    """
+    Embed the movies in the leading principal components of their centered rating vectors.
+
+    The components come from a randomized SVD with `n_iter` power iterations. The centered
+    products are taken as X R - mean (1' R) and X' Q - 1 (mean' Q), which keeps the rating
+    matrix sparse.
+
+    Args:
+        ratings_matrix (scipy.sparse matrix) - the movies by users ratings
+        rank (int) - the number of components
+        n_iter (int) - the number of power iterations, which sharpen the components
+        seed (int) - the random seed of the range finder
+
+    Returns:
+        embedding (numpy.array) - the coordinates of each movie (row) on the components
+    """
+    rng = np.random.default_rng(seed)
+    n_movies, n_users = ratings_matrix.shape
+    mean = get_row_moments(ratings_matrix)[0]
+    # a few more directions than kept make the leading components more accurate
+    size = min(rank + 8, n_movies, n_users)
+
+    def multiply(matrix):
+        return ratings_matrix @ matrix - np.multiply.outer(mean, matrix.sum(axis=0))
+
+    def multiply_t(matrix):
+        return ratings_matrix.T @ matrix - mean @ matrix
+
+    basis = np.linalg.qr(multiply(rng.standard_normal((n_users, size))))[0]
+    for _ in range(n_iter):
+        basis = np.linalg.qr(multiply_t(basis))[0]
+        basis = np.linalg.qr(multiply(basis))[0]
+    left, singular, _ = np.linalg.svd(multiply_t(basis).T, full_matrices=False)
+
+    return (basis @ left[:, :rank]) * singular[:rank]
+
+def get_hash_codes(ratings_matrix, n_tables=4, n_bits=4, rank=32, seed=423):
+    """
+    Hash each movie by the signs of its principal components on random hyperplanes.
+
+    The Pearson correlation is the cosine similarity of the centered rating vectors, so
+    highly correlated movies tend to fall on the same side of each hyperplane. Neighbours
+    often correlate weakly over all users, e.g. 0.2 to 0.3, and agree on a hyperplane of
+    the full space little more often than unrelated movies. Their leading components keep
+    what they have in common and drop the noise, so they agree much more often there.
+
+    Args:
+        ratings_matrix (scipy.sparse matrix) - the movies by users ratings
+        n_tables (int) - the number of hash tables
+        n_bits (int) - the number of hyperplanes, i.e. bits, per table
+        rank (int) - the number of principal components hashed
+        seed (int) - the random seed of the components and the hyperplanes
+
+    Returns:
+        codes (numpy.array) - the bucket code of each movie (row) in each table (column),
+        the first hyperplane being the most significant bit
+    """
+    embedding = get_embedding(ratings_matrix, rank, seed=seed)
+
+    rng = np.random.default_rng(seed)
+    planes = rng.standard_normal((embedding.shape[1], n_tables * n_bits))
+    bits = (embedding @ planes > 0).reshape(embedding.shape[0], n_tables, n_bits)
+
+    return bits @ (1 << np.arange(n_bits, dtype=np.int64)[::-1])
+
+def get_buckets(codes, split_bits=0, max_bucket_size=256):
+    """
+    Group the movies of one hash table by bucket code.
+
+    The buckets are the codes without their last `split_bits` bits. A bucket larger than
+    the maximum size is split by the next bit, i.e. the next hyperplane, until it fits or
+    the bits run out, so that similar movies are still likely to stay together.
+
+    Args:
+        codes (numpy.array) - the bucket code of each movie in the table
+        split_bits (int) - the number of last bits only used to split large buckets
+        max_bucket_size (int) - the maximum number of movies compared within a bucket
+
+    Returns:
+        order (numpy.array) - the movie positions sorted by bucket
+        starts (numpy.array) - the position in `order` where each bucket starts
+    """
+    shift = np.full(len(codes), split_bits, dtype=np.int64)
+    for _ in range(split_bits):
+        # the unused bits are set, so buckets of different depths never share a key
+        keys = codes | ((1 << shift) - 1)
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        split = (counts[inverse] > max_bucket_size) & (shift > 0)
+        if not split.any():
+            break
+        shift[split] -= 1
+
+    keys = codes | ((1 << shift) - 1)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+
+    return order, starts
+
+def get_candidate_similarity(ratings_matrix, codes, k=10, max_bucket_size=256, split_bits=0):
+    """
+    Find the best k candidates of each movie among the movies sharing a bucket with it.
+
+    For each table, consecutive buckets are multiplied together in chunks of at most
+    `max_bucket_size` movies, unless a bucket is larger on its own, so the sparse
+    products stay few and large. Pairs in
+    different buckets are masked out and only the top k of each movie per table are kept,
+    which bounds the candidates by n_tables * n_movies * k.
+
+    Args:
+        ratings_matrix (scipy.sparse.csr_matrix) - the movies by users ratings
+        codes (numpy.array) - the bucket codes of the movies in each table
+        k (int) - how many candidates to keep for each movie per table
+        max_bucket_size (int) - the maximum number of movies compared within a bucket
+        split_bits (int) - the number of last bits of the codes only used to split large
+        buckets
+
+    Returns:
+        first (numpy.array) - the position of the first movie of each pair, sorted
+        second (numpy.array) - the position of the second movie of each pair
+        similarity (numpy.array) - the exact correlation of each pair
+    """
+    n_movies, n_users = ratings_matrix.shape
+    mean, std = get_row_moments(ratings_matrix)
+    keys, similarities = [], []
+
+    for table in range(codes.shape[1]):
+        order, starts = get_buckets(codes[:, table], split_bits, max_bucket_size)
+        bucket = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, n_movies]))
+        # a chunk holds whole buckets, as many as fit in the maximum size
+        chunk_starts = []
+        for start, stop in zip(starts, np.r_[starts[1:], n_movies]):
+            if not chunk_starts or stop - chunk_starts[-1] > max_bucket_size:
+                chunk_starts.append(start)
+
+        for start, stop in zip(chunk_starts, chunk_starts[1:] + [n_movies]):
+            rows = order[start:stop]
+            if len(rows) < 2:
+                continue
+
+            corr_chunk = (ratings_matrix[rows] @ ratings_matrix[rows].T).toarray()
+            corr_chunk -= np.multiply.outer(n_users * mean[rows], mean[rows])
+            with np.errstate(divide='ignore', invalid='ignore'): # constant rows give nan
+                corr_chunk /= np.multiply.outer(std[rows], std[rows])
+
+            # only pairs of distinct movies in the same bucket are candidates
+            same = np.equal.outer(bucket[start:stop], bucket[start:stop])
+            np.fill_diagonal(same, False)
+            corr_chunk[~same] = -np.inf
+
+            top_k = get_top_k(corr_chunk, min(k, len(rows)))
+            similarity = np.take_along_axis(corr_chunk, top_k, axis=1)
+            first, rank = np.nonzero(np.isfinite(similarity))
+
+            keys.append(rows[first] * n_movies + rows[top_k[first, rank]])
+            similarities.append(similarity[first, rank])
+
+    if not keys:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+
+    # pairs found by several tables are kept once
+    keys, unique = np.unique(np.concatenate(keys), return_index=True)
+    similarity = np.clip(np.concatenate(similarities)[unique], -1, 1)
+
+    return keys // n_movies, keys % n_movies, similarity
+
+@profiled
+def lsh_neighbors(ratings_pivot, movie_id, k=10, min_similarity=None, n_tables=4,
+                  n_bits=None, max_bucket_size=256, rank=32, seed=423):
+    """
+    Find the approximate top-K neighbours of each movie in sub-quadratic time.
+
+    Only movies sharing an LSH bucket are compared, with their exact correlation, so the
+    scores are exact but some true neighbours may be missed. More tables and fewer bits
+    per table raise recall, while more bits shrink the buckets and the cost. By default the
+    bits grow with the catalogue so that the buckets hold about `max_bucket_size` movies,
+    and `SPLIT_BITS` more hyperplanes split the buckets that are still larger.
+
+    Args:
+        ratings_pivot (pandas.DataFrame or scipy.sparse matrix) - the pivoted ratings
+        movie_id (numpy.array) - the movie IDs used for modeling
+        k (int) - how many neighbours to keep for each movie
+        min_similarity (float) - neighbours below this correlation are dropped if given
+        n_tables (int) - the number of hash tables
+        n_bits (int) - the number of bits per table, from `get_n_bits` if None
+        max_bucket_size (int) - the maximum number of movies compared within a bucket
+        rank (int) - the number of principal components hashed
+        seed (int) - the random seed of the hyperplanes
+
+    Returns:
+        neighbors (numpy.array) - the movie IDs of the k neighbours of each movie, best
+        first, -1 where fewer than k candidates were found
+        scores (numpy.array) - the correlations with those neighbours, nan where missing
+    """
+    if isinstance(ratings_pivot, pd.DataFrame):
+        ratings_matrix = scipy.sparse.csr_matrix(ratings_pivot.values)
+    elif scipy.sparse.issparse(ratings_pivot):
+        ratings_matrix = scipy.sparse.csr_matrix(ratings_pivot, dtype=np.float64)
+    else:
+        logger.error("Provided argument `ratings_pivot` is not a Panda's DataFrame object")
+        raise TypeError("Provided argument `ratings_pivot` is not a Panda's DataFrame object")
+
+    movie_id = np.asarray(movie_id)
+    n_movies = ratings_matrix.shape[0]
+
+    if n_bits is None:
+        n_bits = get_n_bits(n_movies, max_bucket_size)
+    logger.info("Movies are hashed in %d tables of %d bits, and %d more to split large "
+                "buckets", n_tables, n_bits, SPLIT_BITS)
+
+    codes = get_hash_codes(ratings_matrix, n_tables, n_bits + SPLIT_BITS, rank, seed)
+    first, second, similarity = get_candidate_similarity(ratings_matrix, codes, k,
+                                                         max_bucket_size, SPLIT_BITS)
+
+    if min_similarity is not None:
+        with np.errstate(invalid='ignore'):
+            kept = similarity >= min_similarity
+        first, second, similarity = first[kept], second[kept], similarity[kept]
+
+    # rank the candidates of each movie, best first, ties by position like `get_top_k`
+    order = np.lexsort((-similarity, first))
+    first, second, similarity = first[order], second[order], similarity[order]
+    rank = np.arange(len(first)) - np.searchsorted(first, first)
+    kept = rank < k
+
+    neighbors = np.full((n_movies, k), -1, dtype=movie_id.dtype)
+    scores = np.full((n_movies, k), np.nan)
+    neighbors[first[kept], rank[kept]] = movie_id[second[kept]]
+    scores[first[kept], rank[kept]] = similarity[kept]
+
+    logger.info("The approximate top %d neighbours of %d movies are generated.", k, n_movies)
+
+    return neighbors, scores
+
+def get_recall(ratings_pivot, movie_id, neighbors, sample_size=500, seed=423,
+               min_recall=None):
+    """
+    Measure the recall@K of approximate neighbours against the exact correlation ranking.
+
+    A recall below `min_recall` is logged as a warning, as most neighbours are then wrong
+    and the hash tables need more tables or larger buckets.
+
+    Args:
+        ratings_pivot (pandas.DataFrame or scipy.sparse matrix) - the pivoted ratings
+        movie_id (numpy.array) - the movie IDs used for modeling
+        neighbors (numpy.array) - the approximate neighbours of each movie
+        sample_size (int) - how many movies are checked against the exact ranking
+        seed (int) - the random seed of the sample
+        min_recall (float) - the recall below which a warning is logged, none if None
+
+    Returns:
+        recall (float) - the share of the exact top-K neighbours that were found
+    """
+    if isinstance(ratings_pivot, pd.DataFrame):
+        ratings_pivot = ratings_pivot.values
+
+    movie_id = np.asarray(movie_id)
+    n_movies, k = neighbors.shape
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(n_movies, min(sample_size, n_movies), replace=False))
+
+    hits, total = 0, 0
+    for start, corr_block in iter_corr_blocks(ratings_pivot, block_size=256, rows=rows):
+        block_rows = rows[start:start + len(corr_block)]
+        corr_block[np.arange(len(block_rows)), block_rows] = -np.inf # the movie itself
+        top_k = get_top_k(corr_block, k)
+
+        exact = movie_id[top_k]
+        valid = np.isfinite(np.take_along_axis(corr_block, top_k, axis=1))
+        found = (exact[:, :, None] == neighbors[block_rows][:, None, :]).any(axis=2)
+        hits += (found & valid).sum()
+        total += valid.sum()
+
+    recall = hits / total if total else np.nan
+    logger.info("The recall@%d of the approximate neighbours on %d movies is %.3f", k,
+                len(rows), recall)
+    if min_recall is not None and recall < min_recall:
+        logger.warning("The recall@%d of the approximate neighbours is %.3f, below %.2f, "
+                       "raise lsh_neighbors.n_tables or max_bucket_size", k,
+                       recall, min_recall)
+
+    return recall
+
+def train_ann(ratings, config):
+    """
+    Perform all model training steps with the approximate neighbour engine.
+
+    Args:
+        ratings (pandas.DataFrame) - the cleaned ratings dataframe
+        config (dict) - the `train` section of the model configuration
+
+    Returns:
+        ratings_pivot (pandas.DataFrame or scipy.sparse.csr_matrix) - the pivoted ratings
+        movie_id (list) - the movie IDs used for modeling
+        user_id (list) - the user IDs used for modeling
+        neighbors (numpy.array) - the movie IDs of the top neighbours of each movie
+        scores (numpy.array) - the correlations with those neighbours
+    """
+    ratings_pivot, movie_id, user_id = get_rating_matrix(ratings, **config['get_rating_matrix'])
+    neighbors, scores = lsh_neighbors(ratings_pivot, movie_id, **config['get_neighbors'],
+                                      **config['lsh_neighbors'])
+    get_recall(ratings_pivot, movie_id, neighbors, **config['get_recall'])
+
+    return ratings_pivot, movie_id, user_id, neighbors, scores
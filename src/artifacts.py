@@ -0,0 +1,385 @@
+"""Reading and writing of the artifacts passed between pipeline stages."""
+
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from src.profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.feather': 'feather'}
+
+# the columns of the ratings used by the model, and the compact types they are loaded as,
+# ratings are half stars so float32 holds them exactly
+RATING_COLUMNS = ['userId', 'movieId', 'rating']
+RATING_DTYPES = {'userId': 'int32', 'movieId': 'int32', 'rating': 'float32',
+                 'timestamp': 'int64'}
+
+
+def get_format(path):
+    """
+    Get the artifact format of a table from the extension of its path.
+
+    Gzip compressed csv files (.csv.gz) are csv, pandas and pyarrow decompress them as they
+    read.
+
+    Args:
+        path (str) - the path of the table
+
+    Returns:
+        artifact_format (str) - csv, parquet or feather
+    """
+    root, extension = os.path.splitext(path)
+    extension = extension.lower()
+    if extension == '.gz' and os.path.splitext(root)[1].lower() == '.csv':
+        extension = '.csv'
+    if extension not in FORMATS:
+        logger.error("Unknown table extension `%s` of %s, should be one of %s", extension, path,
+                     ', '.join(FORMATS))
+        raise ValueError("Unknown table extension `%s` of %s" % (extension, path))
+
+    return FORMATS[extension]
+
+def with_format(path, artifact_format, matrix=False, sparse=False):
+    """
+    Replace the extension of an artifact path by the one of the given format.
+
+    Rating matrices are stored as .npz in the binary formats and as csv otherwise, but
+    sparse matrices are always stored as .npz, as they cannot be written as a table.
+
+    Args:
+        path (str) - the path of the artifact
+        artifact_format (str) - csv, parquet or feather
+        matrix (bool) - whether the artifact is a rating matrix rather than a table
+        sparse (bool) - whether the rating matrix is sparse
+
+    Returns:
+        path (str) - the path with the extension of the format
+    """
+    if artifact_format not in FORMATS.values():
+        logger.error("Unknown artifact format `%s`, should be one of %s", artifact_format,
+                     ', '.join(FORMATS.values()))
+        raise ValueError("Unknown artifact format `%s`" % artifact_format)
+
+    if matrix:
+        extension = '.csv' if artifact_format == 'csv' and not sparse else '.npz'
+    else:
+        extension = '.' + artifact_format
+
+    return os.path.splitext(path)[0] + extension
+
+def compact_dtypes(data):
+    """
+    Downcast the numeric columns of a table to the smallest types that hold them exactly.
+
+    Integers go down to 32 bits at most, so sums and products in later stages do not
+    overflow, and floats go down to 32 bits only when no value changes, as for ratings.
+
+    Args:
+        data (pandas.DataFrame) - the table
+
+    Returns:
+        data (pandas.DataFrame) - a copy of the table with compact column types
+    """
+    if not isinstance(data, pd.DataFrame):
+        logger.error("Provided argument `data` is not a Panda's DataFrame object")
+        raise TypeError("Provided argument `data` is not a Panda's DataFrame object")
+
+    data = data.copy()
+    for column in data.columns:
+        values = data[column].values
+        if values.dtype.kind in 'iu' and values.dtype.itemsize > 4 and len(values) > 0 and \
+                np.iinfo(np.int32).min <= values.min() and values.max() <= np.iinfo(np.int32).max:
+            data[column] = values.astype(np.int32)
+        elif values.dtype == np.float64 and \
+                np.array_equal(values.astype(np.float32), values, equal_nan=True):
+            data[column] = values.astype(np.float32)
+
+    return data
+
+@profiled
+def read_table(path, columns=None):
+    """
+    Read a table in the format given by the extension of its path.
+
+    Args:
+        path (str) - the path of the .csv, .parquet or .feather table
+        columns (list) - the columns to read, all if None
+
+    Returns:
+        data (pandas.DataFrame) - the table
+    """
+    artifact_format = get_format(path)
+    try:
+        if artifact_format == 'parquet':
+            return pd.read_parquet(path, columns=columns)
+        if artifact_format == 'feather':
+            return pd.read_feather(path, columns=columns)
+    except ImportError:
+        logger.error("Reading %s files needs pyarrow, install it or use csv artifacts",
+                     artifact_format)
+        raise
+
+    return pd.read_csv(path, usecols=columns)
+
+@profiled
+def write_table(data, path):
+    """
+    Write a table without its index in the format given by the extension of its path.
+
+    The binary formats store compact column types, csv keeps the table as is.
+
+    Args:
+        data (pandas.DataFrame) - the table
+        path (str) - the path of the .csv, .parquet or .feather table
+
+    Returns: None
+    """
+    artifact_format = get_format(path)
+    if artifact_format == 'csv':
+        data.to_csv(path, index=False)
+        return
+
+    # the binary formats need a default index and string column names
+    data = compact_dtypes(data).reset_index(drop=True)
+    data.columns = data.columns.astype(str)
+    try:
+        if artifact_format == 'parquet':
+            data.to_parquet(path, index=False)
+        else:
+            data.to_feather(path)
+    except ImportError:
+        logger.error("Writing %s files needs pyarrow, install it or use csv artifacts",
+                     artifact_format)
+        raise
+
+def get_columns(path):
+    """
+    Get the column names of a table without reading its rows.
+
+    Args:
+        path (str) - the path of the .csv, .parquet or .feather table
+
+    Returns:
+        columns (list) - the column names
+    """
+    artifact_format = get_format(path)
+    if artifact_format == 'csv':
+        return list(pd.read_csv(path, nrows=0).columns)
+
+    try:
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        logger.error("Reading %s files needs pyarrow, install it or use csv artifacts",
+                     artifact_format)
+        raise
+
+    if artifact_format == 'parquet':
+        return pyarrow.parquet.read_schema(path).names
+
+    return pyarrow.feather.read_table(path, memory_map=True).column_names
+
+@profiled
+def read_ratings(path, timestamp=None):
+    """
+    Read a ratings table with only the columns needed, in compact types.
+
+    The ids are read as int32 and the ratings as float32, which cuts the memory of the
+    table from 32 to 12 bytes a rating once the timestamp is dropped. Local csv files are
+    parsed by the multithreaded pyarrow reader when it is installed, other paths such as
+    s3:// ones by pandas.
+
+    Args:
+        path (str) - the path of the .csv, .csv.gz, .parquet or .feather ratings
+        timestamp (bool) - whether to keep the timestamp column, only needed to hold out
+        the latest ratings, if None (the default) it is kept when the table has one
+
+    Returns:
+        ratings (pandas.DataFrame) - the userId, movieId, rating and maybe timestamp columns
+    """
+    if timestamp is None:
+        timestamp = 'timestamp' in get_columns(path)
+    columns = RATING_COLUMNS + ['timestamp'] if timestamp else RATING_COLUMNS
+    dtypes = {column: RATING_DTYPES[column] for column in columns}
+
+    if get_format(path) != 'csv':
+        return read_table(path, columns).astype(dtypes)
+
+    if os.path.isfile(path):
+        try:
+            import pyarrow
+            import pyarrow.csv
+        except ImportError:
+            pyarrow = None
+        if pyarrow is not None:
+            convert_options = pyarrow.csv.ConvertOptions(
+                include_columns=columns,
+                column_types={column: pyarrow.type_for_alias(dtype)
+                              for column, dtype in dtypes.items()})
+            return pyarrow.csv.read_csv(path, pyarrow.csv.ReadOptions(use_threads=True),
+                                        convert_options=convert_options).to_pandas()
+
+    return pd.read_csv(path, usecols=columns, dtype=dtypes)[columns]
+
+def iter_table_chunks(path, columns=None, chunksize=1000000, dtypes=None):
+    """
+    Read a table chunk by chunk in the format given by the extension of its path.
+
+    Args:
+        path (str) - the path of the .csv, .parquet or .feather table
+        columns (list) - the columns to read, all if None
+        chunksize (int) - how many rows are read at a time
+        dtypes (dict) - the types to read some columns as, e.g. `RATING_DTYPES`, pandas
+        defaults if None
+
+    Yields:
+        chunk (pandas.DataFrame) - the next rows of the table
+    """
+    artifact_format = get_format(path)
+    if artifact_format == 'csv':
+        if dtypes is not None:
+            dtypes = {column: dtype for column, dtype in dtypes.items()
+                      if columns is None or column in columns}
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=chunksize, dtype=dtypes):
+            yield chunk
+        return
+
+    try:
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        logger.error("Reading %s files needs pyarrow, install it or use csv artifacts",
+                     artifact_format)
+        raise
+
+    if artifact_format == 'parquet':
+        batches = pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunksize,
+                                                                 columns=columns)
+    else:
+        # feather files are memory mapped, so only the batches converted are read
+        batches = pyarrow.feather.read_table(path, columns=columns,
+                                             memory_map=True).to_batches(chunksize)
+    for batch in batches:
+        chunk = batch.to_pandas()
+        if dtypes is not None:
+            chunk = chunk.astype({column: dtype for column, dtype in dtypes.items()
+                                  if column in chunk.columns})
+        yield chunk
+
+def write_table_chunks(chunks, path):
+    """
+    Write a table chunk by chunk, without holding it in memory.
+
+    The chunks should have the same columns and types. Feather files can only be written
+    whole, so csv or parquet are needed.
+
+    Args:
+        chunks (iterable) - the dataframes of the successive rows of the table
+        path (str) - the path of the .csv or .parquet table
+
+    Returns: None
+    """
+    artifact_format = get_format(path)
+    if artifact_format == 'feather':
+        logger.error("Tables written in chunks should be csv or parquet, not feather")
+        raise ValueError("Tables written in chunks should be csv or parquet, not feather")
+
+    if artifact_format == 'csv':
+        header = True
+        for chunk in chunks:
+            chunk.to_csv(path, mode='w' if header else 'a', header=header, index=False)
+            header = False
+        return
+
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        logger.error("Writing parquet files needs pyarrow, install it or use csv artifacts")
+        raise
+
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+@profiled
+def write_matrix(ratings_pivot, path):
+    """
+    Write a rating matrix, as a sparse .npz or as a table.
+
+    Sparse matrices are always written as .npz, so a table path gets the .npz extension
+    instead, as `scipy.sparse.save_npz` would otherwise append it.
+
+    Args:
+        ratings_pivot (pandas.DataFrame or scipy.sparse matrix) - the pivoted ratings
+        path (str) - the path of the .npz matrix or of the table
+
+    Returns:
+        path (str) - the path written
+    """
+    if scipy.sparse.issparse(ratings_pivot):
+        if not path.endswith('.npz'):
+            logger.warning("Sparse rating matrices are stored as .npz, writing %s instead of %s",
+                           os.path.splitext(path)[0] + '.npz', path)
+            path = os.path.splitext(path)[0] + '.npz'
+        scipy.sparse.save_npz(path, ratings_pivot.tocsr())
+    elif path.endswith('.npz'):
+        scipy.sparse.save_npz(path, scipy.sparse.csr_matrix(ratings_pivot.values))
+    else:
+        write_table(ratings_pivot, path)
+
+    return path
+
+def find_matrix(path):
+    """
+    Find the rating matrix written for a path, as `write_matrix` writes a sparse matrix as
+    .npz whatever the extension of the path.
+
+    When both the path and its .npz sibling exist, the one written last is the current
+    matrix and the other one is left over from an earlier run.
+
+    Args:
+        path (str) - the path of the .npz matrix or of the table
+
+    Returns:
+        path (str) - the path of the matrix to read, the given one if none exists
+    """
+    candidates = [candidate for candidate in dict.fromkeys([path,
+                                                            os.path.splitext(path)[0] + '.npz'])
+                  if os.path.exists(candidate)]
+    if not candidates:
+        return path
+
+    found = max(candidates, key=os.path.getmtime)
+    if found != path:
+        logger.info("The rating matrix of %s was written to %s, reading it instead", path, found)
+
+    return found
+
+@profiled
+def read_matrix(path):
+    """
+    Read a rating matrix written by `write_matrix`. A .npz matrix stays sparse.
+
+    Args:
+        path (str) - the path of the .npz matrix or of the table
+
+    Returns:
+        ratings_pivot (scipy.sparse.csr_matrix or pandas.DataFrame) - the pivoted ratings
+    """
+    if path.endswith('.npz'):
+        return scipy.sparse.load_npz(path).tocsr()
+
+    return read_table(path)
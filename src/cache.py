@@ -0,0 +1,128 @@
+"""Local cache of downloaded S3 objects, keyed by their ETag and evicted least recently used."""
+
+import hashlib
+import logging
+import os
+import shutil
+
+logger = logging.getLogger(__name__)
+
+
+def get_cache_path(cache_dir, bucket, key, etag):
+    """
+    Get the path of the cached copy of a version of an S3 object.
+
+    Args:
+        cache_dir (str) - the cache directory
+        bucket (str) - the bucket of the object
+        key (str) - the key of the object
+        etag (str) - the ETag of the object, which changes with its content
+
+    Returns:
+        path (str) - the path of the cached copy, whether it exists or not
+    """
+    digest = hashlib.sha256(('%s/%s/%s' % (bucket, key, etag)).encode()).hexdigest()
+    name = os.path.basename(key)
+    if name.endswith('.gz'): # the copies are stored decompressed
+        name = name[:-len('.gz')]
+
+    return os.path.join(cache_dir, '%s-%s' % (digest[:16], name))
+
+def link_file(source, target):
+    """
+    Hard link a file to a new path, or copy it where links are not supported.
+
+    The target is removed first, so writing to it later cannot change the source.
+
+    Args:
+        source (str) - the existing file
+        target (str) - the new path
+
+    Returns: None
+    """
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+def lookup(cache_dir, bucket, key, etag):
+    """
+    Find the cached copy of a version of an S3 object, marking it as recently used.
+
+    Args:
+        cache_dir (str) - the cache directory
+        bucket (str) - the bucket of the object
+        key (str) - the key of the object
+        etag (str) - the ETag of the object
+
+    Returns:
+        path (str) - the path of the cached copy, None if the version is not cached
+    """
+    path = get_cache_path(cache_dir, bucket, key, etag)
+    if not os.path.isfile(path):
+        return None
+
+    os.utime(path) # the modification time orders the copies by last use
+    logger.info("Cached copy of s3://%s/%s is up to date", bucket, key)
+
+    return path
+
+def store(cache_dir, bucket, key, etag, path):
+    """
+    Add a downloaded object to the cache.
+
+    Args:
+        cache_dir (str) - the cache directory
+        bucket (str) - the bucket of the object
+        key (str) - the key of the object
+        etag (str) - the ETag of the object
+        path (str) - the downloaded, decompressed object
+
+    Returns:
+        cache_path (str) - the path of the cached copy
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_path = get_cache_path(cache_dir, bucket, key, etag)
+    link_file(path, cache_path)
+    os.utime(cache_path)
+
+    return cache_path
+
+def evict(cache_dir, max_size_mb, keep=()):
+    """
+    Remove the least recently used copies until the cache fits in its size.
+
+    Args:
+        cache_dir (str) - the cache directory
+        max_size_mb (float) - the largest size of the cache in MB
+        keep (list) - the paths of copies not to remove, e.g. the ones in use
+
+    Returns:
+        removed (list) - the paths of the removed copies
+    """
+    if not os.path.isdir(cache_dir):
+        return []
+
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)]
+    entries = sorted((path for path in entries if os.path.isfile(path)), key=os.path.getmtime)
+    size = sum(os.path.getsize(path) for path in entries)
+    keep = {os.path.abspath(path) for path in keep}
+
+    removed = []
+    for path in entries:
+        if size <= max_size_mb * 2**20:
+            break
+        if os.path.abspath(path) in keep:
+            continue
+        size -= os.path.getsize(path)
+        os.remove(path)
+        removed.append(path)
+        logger.info("Evicted %s from the cache", path)
+
+    if size > max_size_mb * 2**20:
+        logger.warning("The cache in %s holds %.1f MB in use, more than its %.1f MB", cache_dir,
+                       size / 2**20, max_size_mb)
+
+    return removed
@@ -2,8 +2,12 @@
 
 import logging
 
+import numpy as np
 import pandas as pd
 
+from src.artifacts import (RATING_COLUMNS, RATING_DTYPES, get_columns, iter_table_chunks,
+                           write_table_chunks)
+
 logger = logging.getLogger(__name__)
 
 
@@ -31,9 +35,50 @@ def merge_data(movies, links):
 
     return movies_merged
 
+def get_kcore_mask(user_codes, movie_codes, user_min=50, movie_min=50):
+    """
+    Find the ratings of the k-core, where every user and every movie has enough ratings.
+
+    Dropping the ratings of a user can leave a movie with too few ratings and the other way
+    around, so the ratings of users and movies below their minimum are dropped until none
+    is left. Only the counts of the dropped ratings are subtracted at each iteration.
+
+    Args:
+        user_codes (numpy.array) - the user of each rating, as integer codes from 0
+        movie_codes (numpy.array) - the movie of each rating, as integer codes from 0
+        user_min (int) - the minimum number of ratings a user needs to have
+        movie_min (int) - the minimum number of ratings a movie needs to have
+
+    Returns:
+        keep (numpy.array) - whether each rating is kept
+    """
+    n_users = user_codes.max() + 1 if len(user_codes) else 0
+    n_movies = movie_codes.max() + 1 if len(movie_codes) else 0
+    user_count = np.bincount(user_codes, minlength=n_users)
+    movie_count = np.bincount(movie_codes, minlength=n_movies)
+
+    index, users, movies = np.arange(len(user_codes)), user_codes, movie_codes
+    n_iter = 0
+    while True:
+        is_kept = (user_count >= user_min)[users] & (movie_count >= movie_min)[movies]
+        if is_kept.all():
+            break
+        n_iter += 1
+        user_count -= np.bincount(users[~is_kept], minlength=n_users)
+        movie_count -= np.bincount(movies[~is_kept], minlength=n_movies)
+        index, users, movies = index[is_kept], users[is_kept], movies[is_kept]
+
+    logger.info("%d of %d ratings are kept after %d filtering passes", len(index),
+                len(user_codes), n_iter)
+
+    keep = np.zeros(len(user_codes), dtype=bool)
+    keep[index] = True
+
+    return keep
+
 def filter_rating(ratings, user_min=50, movie_min=50):
     """
-    Drop users and movies with few ratings.
+    Drop users and movies with few ratings, until every user and movie left has enough.
 
     Args:
         ratings (pandas.DataFrame) - ratings dataframe
@@ -47,21 +92,60 @@ def filter_rating(ratings, user_min=50, movie_min=50):
         logger.error("Provided argument `ratings` is not a Panda's DataFrame object")
         raise TypeError("Provided argument `ratings` is not a Panda's DataFrame object")
 
-    # filter out users with less than user_min ratings
-    user_rating_count = ratings['userId'].value_counts()
-    ratings = ratings[ratings['userId'].isin(user_rating_count[user_rating_count>=user_min].index)]
+    keep = get_kcore_mask(pd.factorize(ratings['userId'])[0],
+                          pd.factorize(ratings['movieId'])[0], user_min, movie_min)
+    ratings = ratings[keep]
 
     logger.info('Ratings of users with less than %d ratings are dropped', user_min)
-
-    # filter out movies with less than movie_min ratings
-    movie_rating_count = ratings['movieId'].value_counts()
-    ratings = ratings[ratings['movieId'].\
-                isin(movie_rating_count[movie_rating_count>=movie_min].index)]
-
     logger.info('Ratings of movies with less than %d ratings are dropped', movie_min)
 
     return ratings
 
+def filter_rating_file(path, output_path, user_min=50, movie_min=50, chunksize=1000000):
+    """
+    Drop users and movies with few ratings from a ratings file, chunk by chunk.
+
+    Only the user and movie IDs are held in memory, as the ratings are read twice: once
+    for the IDs, and once to write the kept ratings.
+
+    Args:
+        path (str) - the path of the ratings table (.csv, .parquet or .feather)
+        output_path (str) - the path of the filtered ratings (.csv or .parquet)
+        user_min (int) - the minimum number of ratings a user needs to have
+        movie_min (int) - the minimum number of ratings a movie needs to have
+        chunksize (int) - how many ratings are read at a time
+
+    Returns:
+        n_ratings (int) - the number of ratings kept
+    """
+    user_ids, movie_ids = [], []
+    for chunk in iter_table_chunks(path, ['userId', 'movieId'], chunksize, RATING_DTYPES):
+        user_ids.append(chunk['userId'].values)
+        movie_ids.append(chunk['movieId'].values)
+    if not user_ids:
+        logger.error("No ratings found in %s", path)
+        raise ValueError("No ratings found in %s" % path)
+
+    keep = get_kcore_mask(pd.factorize(np.concatenate(user_ids))[0],
+                          pd.factorize(np.concatenate(movie_ids))[0], user_min, movie_min)
+    del user_ids, movie_ids
+
+    # the rating times are kept if the file has them, as by `read_ratings`
+    columns = RATING_COLUMNS + ['timestamp'] if 'timestamp' in get_columns(path) \
+        else RATING_COLUMNS
+
+    def iter_kept_chunks():
+        start = 0
+        for chunk in iter_table_chunks(path, columns, chunksize, RATING_DTYPES):
+            yield chunk[keep[start:start + len(chunk)]]
+            start += len(chunk)
+
+    write_table_chunks(iter_kept_chunks(), output_path)
+    logger.info('Ratings of users with less than %d ratings and movies with less than %d '
+                'ratings are dropped from %s', user_min, movie_min, path)
+
+    return int(keep.sum())
+
 def clean(movies, links, ratings, config):
     """Perform all data cleaning and returns the cleaned dataframes."""
     movies = merge_data(movies, links)
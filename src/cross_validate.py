@@ -0,0 +1,169 @@
+"""K-fold cross-validation of the model pipeline."""
+
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.clean import filter_rating
+from src.metrics import evaluate_ranking, fit_neighbors
+from src.parallel import attach_array, check_shared_memory, get_n_jobs, release, share_array
+
+logger = logging.getLogger(__name__)
+
+RATING_COLUMNS = ['userId', 'movieId', 'rating']
+
+
+def get_folds(n_ratings, n_folds=5, seed=423):
+    """
+    Assign each rating to one of k folds of equal size at random.
+
+    Args:
+        n_ratings (int) - the number of ratings
+        n_folds (int) - the number of folds
+        seed (int) - the random seed of the assignment
+
+    Returns:
+        folds (numpy.array) - the fold of each rating
+    """
+    if n_folds < 2:
+        logger.error("Cross-validation needs at least 2 folds, got %d", n_folds)
+        raise ValueError("Cross-validation needs at least 2 folds, got %d" % n_folds)
+
+    rng = np.random.default_rng(seed)
+
+    return (rng.permutation(n_ratings) % n_folds).astype(np.int16)
+
+def run_fold(ratings, folds, fold, config):
+    """
+    Run train, predict and evaluate with one fold held out.
+
+    The training ratings go through the `clean.filter` thresholds, the model keeps the
+    `predict_df.top_n` most similar movies of each movie like the predictions do, and the
+    held out ratings are scored with the ranking metrics.
+
+    Args:
+        ratings (pandas.DataFrame) - the ratings with userId, movieId and rating columns
+        folds (numpy.array) - the fold of each rating
+        fold (int) - the fold held out
+        config (dict) - the model configuration
+
+    Returns:
+        scores (pandas.DataFrame) - the ranking metrics (columns) at each cutoff k (rows)
+        seconds (float) - the wall time of the fold
+    """
+    start = time.perf_counter()
+    is_test = folds == fold
+
+    train = filter_rating(ratings[~is_test], **config['clean']['filter'])
+    movie_id, neighbors, scores = fit_neighbors(train, config['train'])
+
+    top_n = config['predict']['predict_df']['top_n']
+    # the folds are the unit of parallelism, each one is scored by a single process
+    ranking_config = dict(config['evaluate']['evaluate_ranking'], n_jobs=1)
+    result = evaluate_ranking(train, movie_id, neighbors[:, :top_n], scores[:, :top_n],
+                              ratings[is_test], **ranking_config)
+
+    seconds = time.perf_counter() - start
+    logger.info("Fold %d is trained on %d ratings and evaluated in %.1f s", fold, len(train),
+                seconds)
+
+    return result, seconds
+
+def get_ratings_frame(columns):
+    """
+    Wrap the rating columns in a dataframe without copying them.
+
+    Each column stays its own block, so a frame built on shared memory views reads the
+    shared buffers and only the ratings selected for a fold are copied.
+
+    Args:
+        columns (list) - the userId, movieId and rating arrays
+
+    Returns:
+        ratings (pandas.DataFrame) - the ratings, backed by the given arrays
+    """
+    return pd.DataFrame(dict(zip(RATING_COLUMNS, columns)), copy=False)
+
+def run_fold_shared(specs, folds_spec, fold, config):
+    """
+    Worker process entry point of `run_fold` on ratings held in shared memory.
+
+    Args:
+        specs (list) - the shared memory specs of the rating columns
+        folds_spec (tuple) - the shared memory spec of the fold assignment
+        fold (int) - the fold held out
+        config (dict) - the model configuration
+
+    Returns:
+        the outputs of `run_fold`
+    """
+    shms, columns = zip(*[attach_array(spec) for spec in specs + [folds_spec]])
+    ratings = None
+    try:
+        ratings = get_ratings_frame(columns[:-1])
+        return run_fold(ratings, columns[-1], fold, config)
+    finally:
+        del columns, ratings # views must go before the buffers are closed
+        for shm in shms:
+            shm.close()
+
+def cross_validate(ratings, config, n_folds=5, seed=423, n_jobs=1):
+    """
+    Cross-validate the whole model pipeline over k folds of the ratings.
+
+    With several jobs the folds run in worker processes, which attach to one shared
+    memory copy of the rating columns instead of receiving the ratings pickled.
+
+    Args:
+        ratings (pandas.DataFrame) - the ratings with userId, movieId and rating columns
+        config (dict) - the model configuration
+        n_folds (int) - the number of folds
+        seed (int) - the random seed of the folds
+        n_jobs (int) - the number of worker processes, -1 for all cores
+
+    Returns:
+        results (pandas.DataFrame) - the metrics and wall time of each fold at each cutoff,
+        followed by their mean and standard deviation over the folds
+    """
+    if not isinstance(ratings, pd.DataFrame):
+        logger.error("Provided argument `ratings` is not a Panda's DataFrame object")
+        raise TypeError("Provided argument `ratings` is not a Panda's DataFrame object")
+
+    folds = get_folds(len(ratings), n_folds, seed)
+    n_jobs = min(get_n_jobs(n_jobs), n_folds)
+
+    if n_jobs == 1:
+        ratings = ratings[RATING_COLUMNS].reset_index(drop=True)
+        outputs = [run_fold(ratings, folds, fold, config) for fold in range(n_folds)]
+    else:
+        check_shared_memory()
+        shms, specs = zip(*[share_array(ratings[column].values) for column in RATING_COLUMNS])
+        folds_shm, folds_spec = share_array(folds)
+        try:
+            with ProcessPoolExecutor(n_jobs) as executor:
+                outputs = list(executor.map(run_fold_shared, *zip(*[
+                    (list(specs), folds_spec, fold, config) for fold in range(n_folds)])))
+        finally:
+            release(*shms, folds_shm)
+
+    results = []
+    for fold, (result, seconds) in enumerate(outputs):
+        result['seconds'] = seconds
+        results.append(result.reset_index().assign(fold=fold))
+    results = pd.concat(results, ignore_index=True)
+
+    summary = results.drop(columns='fold').groupby('k').agg(['mean', 'std'])
+    for statistic in ('mean', 'std'):
+        results = pd.concat([results, summary.xs(statistic, axis=1, level=1).reset_index().
+                             assign(fold=statistic)], ignore_index=True)
+
+    for k, row in summary.iterrows():
+        logger.info("Cross-validated at k=%d: precision %.4f +/- %.4f, recall %.4f +/- %.4f, "
+                    "ndcg %.4f +/- %.4f", k, row[('precision', 'mean')],
+                    row[('precision', 'std')], row[('recall', 'mean')], row[('recall', 'std')],
+                    row[('ndcg', 'mean')], row[('ndcg', 'std')])
+
+    return results[['fold'] + [column for column in results.columns if column != 'fold']]
@@ -1,14 +1,24 @@
 """Data acquisition script."""
 
 import logging
+import os
 import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 import botocore
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+from src.fingerprint import hash_file
 
 
 logger = logging.getLogger('s3')
 
+# how many bytes of a file are compressed at a time
+BUFFER_SIZE = 2**20
+
 def parse_s3(s3path):
     """
     Parse the input s3 path to get the bucket name.
@@ -51,3 +61,154 @@ def upload_file_to_s3(local_path, s3path, file_name):
         AWS_SECRET_ACCESS_KEY env variables.')
     else:
         logger.info('Data %s uploaded from %s to %s', file_name, local_path, s3path)
+
+class GzipReader:
+    """Read a local file gzip-compressed chunk by chunk, so that an upload can stream it."""
+
+    def __init__(self, path, block_size=BUFFER_SIZE):
+        """
+        Open the file to compress.
+
+        Args:
+            path (str) - the path of the file
+            block_size (int) - how many bytes of the file are compressed at a time
+        """
+        self.file = open(path, 'rb')
+        self.block_size = block_size
+        # wbits of 31 writes the gzip header and trailer
+        self.compressor = zlib.compressobj(wbits=31)
+        self.buffer = bytearray()
+        self.done = False
+
+    def read(self, size=-1):
+        """
+        Read the next compressed bytes.
+
+        Args:
+            size (int) - how many bytes to read, all the rest if negative
+
+        Returns:
+            data (bytes) - the compressed bytes, empty at the end of the file
+        """
+        while not self.done and (size < 0 or len(self.buffer) < size):
+            block = self.file.read(self.block_size)
+            if block:
+                self.buffer += self.compressor.compress(block)
+            else:
+                self.buffer += self.compressor.flush()
+                self.done = True
+
+        size = len(self.buffer) if size < 0 else size
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+
+        return data
+
+    def close(self):
+        """Close the file."""
+        self.file.close()
+
+def get_remote_sha256(client, s3bucket, key):
+    """
+    Get the sha256 recorded in the metadata of an uploaded object.
+
+    Args:
+        client (botocore.client.S3) - the S3 client
+        s3bucket (str) - the bucket name
+        key (str) - the key of the object
+
+    Returns:
+        digest (str) - the sha256 of the uploaded file, None if the object does not exist
+        or was not uploaded by `upload_files_to_s3`
+    """
+    try:
+        head = client.head_object(Bucket=s3bucket, Key=key)
+    except botocore.exceptions.ClientError as error:
+        if error.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+    return head.get('Metadata', {}).get('sha256')
+
+def upload_one(client, path, s3bucket, key, transfer_config, compress=False):
+    """
+    Upload a file unless the object already holds the same content.
+
+    Args:
+        client (botocore.client.S3) - the S3 client
+        path (str) - the path of the local file
+        s3bucket (str) - the bucket name
+        key (str) - the key of the object, with .gz appended if compressed
+        transfer_config (boto3.s3.transfer.TransferConfig) - the multipart settings
+        compress (bool) - whether to gzip the file while uploading it
+
+    Returns:
+        uploaded (bool) - whether the file was uploaded, False if it was unchanged
+    """
+    digest = hash_file(path)
+    if get_remote_sha256(client, s3bucket, key) == digest:
+        logger.info('s3://%s/%s is up to date, skipped', s3bucket, key)
+        return False
+
+    source = GzipReader(path) if compress else open(path, 'rb')
+    try:
+        client.upload_fileobj(source, s3bucket, key, ExtraArgs={'Metadata': {'sha256': digest}},
+                              Config=transfer_config)
+    finally:
+        source.close()
+    logger.info('%s uploaded to s3://%s/%s', path, s3bucket, key)
+
+    return True
+
+def upload_files_to_s3(local_path, s3path, file_names=None, chunk_size_mb=8,
+                       max_concurrency=8, n_jobs=4, compress=False, client=None):
+    """
+    Upload several files concurrently through one client, skipping the unchanged ones.
+
+    Large files are uploaded in parts of `chunk_size_mb`. The sha256 of each file is stored
+    in the metadata of its object, so files whose content is already in S3 are skipped.
+
+    Args:
+        local_path (str) - the local directory which has the data
+        s3path (str) - the s3 path which the data will be uploaded to
+        file_names (list) - the paths of the files relative to the local directory, every
+        file under it if None
+        chunk_size_mb (float) - the size of the parts of multipart uploads, at least 5 MB
+        max_concurrency (int) - how many parts of a file are uploaded at the same time
+        n_jobs (int) - how many files are uploaded at the same time
+        compress (bool) - whether to gzip the files while uploading them, as <name>.gz
+        client (botocore.client.S3) - the S3 client, a new one if None
+
+    Returns:
+        uploaded (dict) - whether each file was uploaded, False if it was unchanged
+    """
+    if file_names is None:
+        file_names = sorted(os.path.relpath(os.path.join(root, name), local_path)
+                            .replace(os.sep, '/')
+                            for root, _, names in os.walk(local_path) for name in names)
+    if client is None:
+        client = boto3.client('s3', config=Config(
+            max_pool_connections=max(n_jobs * max_concurrency, 10)))
+    transfer_config = TransferConfig(multipart_threshold=int(chunk_size_mb * 2**20),
+                                     multipart_chunksize=int(chunk_size_mb * 2**20),
+                                     max_concurrency=max_concurrency)
+
+    uploaded = {}
+    try:
+        with ThreadPoolExecutor(max(n_jobs, 1)) as executor:
+            futures = {}
+            for file_name in file_names:
+                s3bucket, key = parse_s3(s3path + file_name + ('.gz' if compress else ''))
+                futures[file_name] = executor.submit(upload_one, client,
+                                                     os.path.join(local_path, file_name),
+                                                     s3bucket, key, transfer_config, compress)
+            for file_name, future in futures.items():
+                uploaded[file_name] = future.result()
+    except botocore.exceptions.NoCredentialsError:
+        logger.error('Please provide AWS credentials via AWS_ACCESS_KEY_ID and \
+        AWS_SECRET_ACCESS_KEY env variables.')
+    else:
+        logger.info('%d of %d files uploaded from %s to %s, the others are unchanged',
+                    sum(uploaded.values()), len(file_names), local_path, s3path)
+
+    return uploaded
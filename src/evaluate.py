@@ -4,6 +4,10 @@ import logging
 
 import numpy as np
 import pandas as pd
+import scipy.sparse
+
+from src.profiling import profiled
+from src.train import get_top_k
 
 logger = logging.getLogger(__name__)
 
@@ -38,35 +42,146 @@ def get_fav_movies(ratings_pivot, movie_id, user_id):
 
     return fav_movies, ratings_pivot_t
 
-def get_most_similar_movie(fav_movies, movie_id, corr):
+def get_fav_movies_from_ratings(ratings):
+    """
+    For each user, find his or her favorite movie from the long-format ratings.
+
+    Ties go to the smallest movie ID, like the argmax over the rows of the pivot.
+
+    Args:
+        ratings (pandas.DataFrame) - the cleaned ratings with userId, movieId and rating
+
+    Returns:
+        fav_movies (pandas.DataFrame) - the dataframe aggregated by user, consisting of
+        each user's favorite movie ID
+    """
+    if not isinstance(ratings, pd.DataFrame):
+        logger.error("Provided argument `ratings` is not a Panda's DataFrame object")
+        raise TypeError("Provided argument `ratings` is not a Panda's DataFrame object")
+
+    # the first rating of each user after sorting is the best one
+    best = ratings.sort_values(['rating', 'movieId'], ascending=[False, True], kind='mergesort')
+    best = best.drop_duplicates('userId').sort_values('userId')
+
+    fav_movies = pd.DataFrame({'fav_movie': best['movieId'].values,
+                               'userId': best['userId'].values})
+
+    return fav_movies
+
+def get_ratings_from_matrix(ratings_matrix, movie_id, user_id):
+    """
+    Unpivot a sparse rating matrix into long-format ratings, keeping only the rated entries.
+
+    Args:
+        ratings_matrix (scipy.sparse.spmatrix) - the movie by user rating matrix
+        movie_id (numpy.array) - the movie IDs used in model training
+        user_id (numpy.array) - the user IDs used in model training
+
+    Returns:
+        ratings (pandas.DataFrame) - the ratings with userId, movieId and rating
+    """
+    if not scipy.sparse.issparse(ratings_matrix):
+        logger.error("Provided argument `ratings_matrix` is not a sparse matrix")
+        raise TypeError("Provided argument `ratings_matrix` is not a sparse matrix")
+
+    entries = ratings_matrix.tocoo()
+    ratings = pd.DataFrame({'userId': np.asarray(user_id)[entries.col],
+                            'movieId': np.asarray(movie_id)[entries.row],
+                            'rating': entries.data})
+
+    return ratings[ratings['rating'] != 0]
+
+def drop_unknown(fav_movies, positions, name):
+    """
+    Drop the users whose lookup found no position, which `get_indexer` marks with -1.
+
+    Args:
+        fav_movies (pandas.DataFrame) - the favorite movies dataframe, one row per user
+        positions (numpy.array) - the looked up position of each row, -1 if not found
+        name (str) - what was looked up, for the log message
+
+    Returns:
+        fav_movies (pandas.DataFrame) - the users with a known position
+        positions (numpy.array) - their positions
+    """
+    known = positions >= 0
+    if not known.all():
+        logger.warning("%d users are dropped as their %s is not in the model",
+                       (~known).sum(), name)
+        fav_movies = fav_movies[known].copy()
+
+    return fav_movies, positions[known]
+
+def get_most_similar_movie(fav_movies, movie_id, corr, block_size=1024):
     """
     For each user, find the most-similar movie to his or her favorite movie.
 
+    Favorite movies are looked up by position in one pass, and the top-1 of each distinct
+    favorite is ranked once, a block of correlation rows at a time, then broadcast back to
+    the users. Like `predict_aux`, the best match of a row (the movie itself) is skipped.
+
     Args:
         fav_movies (pandas.DataFrame) - the dataframe aggregated by user, consisting of
         each user's favorite movie ID
         movie_id (numpy.array) - the movie IDs used in model training
         corr (numpy.array) - the correlation matrix from model training
+        block_size (int) - how many distinct favorite movies are ranked at a time
 
     Returns:
         fav_movies (pandas.DataFrame) - the updated favorate movies dataframe,
         consisting of each user's favorite movie ID, and the most-similar movie to that
-        favorite movie.
+        favorite movie, users whose favorite movie is not in the model are dropped
     """
     if not isinstance(fav_movies, pd.DataFrame):
         logger.error("Provided argument `fav_movies` is not a Panda's DataFrame object")
         raise TypeError("Provided argument `fav_movies` is not a Panda's DataFrame object")
 
+    movie_id = np.asarray(movie_id)
+    positions = pd.Index(movie_id).get_indexer(fav_movies['fav_movie'])
+    fav_movies, positions = drop_unknown(fav_movies, positions, 'favorite movie')
+    favorites, users = np.unique(positions, return_inverse=True)
+
     # recommend movie based on the favorite movie
-    fav_movies['most_similar_to_fav'] = fav_movies['fav_movie'].\
-        apply(lambda x: movie_id[np.argsort(-corr[movie_id.index(x)])[1]])
+    most_similar = np.empty(len(favorites), dtype=int)
+    for start in range(0, len(favorites), block_size):
+        rows = favorites[start:start + block_size]
+        most_similar[start:start + len(rows)] = get_top_k(corr[rows], 2)[:, 1]
+
+    fav_movies['most_similar_to_fav'] = movie_id[most_similar][users]
 
     return fav_movies
 
+def get_most_similar_movie_from_neighbors(fav_movies, movie_id, neighbors):
+    """
+    For each user, look up the most-similar movie to his or her favorite movie in the
+    top-K neighbour index instead of the full correlation matrix.
+
+    Args:
+        fav_movies (pandas.DataFrame) - the dataframe aggregated by user, consisting of
+        each user's favorite movie ID
+        movie_id (list) - the movie IDs used in model training
+        neighbors (numpy.array) - the movie IDs of the top neighbours of each movie
+
+    Returns:
+        fav_movies (pandas.DataFrame) - the updated favorate movies dataframe, users whose
+        favorite movie is not in the model or has no neighbour left are dropped
+    """
+    if not isinstance(fav_movies, pd.DataFrame):
+        logger.error("Provided argument `fav_movies` is not a Panda's DataFrame object")
+        raise TypeError("Provided argument `fav_movies` is not a Panda's DataFrame object")
+
+    position = pd.Index(movie_id).get_indexer(fav_movies['fav_movie'])
+    fav_movies, position = drop_unknown(fav_movies, position, 'favorite movie')
+    fav_movies['most_similar_to_fav'] = neighbors[position, 0]
+
+    return fav_movies[fav_movies['most_similar_to_fav'] >= 0]
+
 def get_score(fav_movies, ratings_pivot_t):
     """
     Compute the satisfaction score as users average rating for the most similar movie.
 
+    Users or movies missing from the pivot are dropped with a warning rather than looked up.
+
     Args:
         fav_movies (pandas.DataFrame) - the favorate movies dataframe, consisting of each
         user's favorite movie ID, and the most-similar movie to that favorite movie.
@@ -84,8 +199,13 @@ def get_score(fav_movies, ratings_pivot_t):
         logger.error("Provided argument `ratings_pivot_t` is not a Panda's DataFrame object")
         raise TypeError("Provided argument `ratings_pivot_t` is not a Panda's DataFrame object")
 
-    fav_movies['most_similar_rating'] = fav_movies[['userId','most_similar_to_fav']].\
-        apply(lambda x: ratings_pivot_t.loc[x[0],x[1]], axis=1)
+    # gather the ratings by position instead of a label lookup per user
+    rows = ratings_pivot_t.index.get_indexer(fav_movies['userId'])
+    columns = ratings_pivot_t.columns.get_indexer(fav_movies['most_similar_to_fav'])
+    known = (rows >= 0) & (columns >= 0)
+    fav_movies, rows = drop_unknown(fav_movies, np.where(known, rows, -1),
+                                    'user or most similar movie')
+    fav_movies['most_similar_rating'] = ratings_pivot_t.values[rows, columns[known]]
 
     satisfaction = fav_movies.most_similar_rating
     # 0 rating means the user has not watched the movie
@@ -95,14 +215,68 @@ def get_score(fav_movies, ratings_pivot_t):
 
     return satisfaction
 
-def evaluate(ratings_pivot, movie_id, user_id, corr):
-    """Generate the final satisfaction score."""
+def get_score_from_ratings(fav_movies, ratings):
+    """
+    Compute the satisfaction score from the long-format ratings with a hash join.
+
+    Args:
+        fav_movies (pandas.DataFrame) - the favorate movies dataframe, consisting of each
+        user's favorite movie ID, and the most-similar movie to that favorite movie.
+        ratings (pandas.DataFrame) - the cleaned ratings with userId, movieId and rating
+
+    Returns:
+        satisfaction (float) - the average satisfaction score that defines the success
+        of the app
+    """
+    if not isinstance(fav_movies, pd.DataFrame):
+        logger.error("Provided argument `fav_movies` is not a Panda's DataFrame object")
+        raise TypeError("Provided argument `fav_movies` is not a Panda's DataFrame object")
+
+    if not isinstance(ratings, pd.DataFrame):
+        logger.error("Provided argument `ratings` is not a Panda's DataFrame object")
+        raise TypeError("Provided argument `ratings` is not a Panda's DataFrame object")
+
+    # users who have not watched the most similar movie find no match
+    watched = fav_movies.merge(ratings[['userId', 'movieId', 'rating']],
+                               left_on=['userId', 'most_similar_to_fav'],
+                               right_on=['userId', 'movieId'])
+    satisfaction = watched['rating'][watched['rating'] != 0].mean()
+
+    logger.info("The average satisfaction score is %.2f", satisfaction)
+
+    return satisfaction
+
+@profiled
+def evaluate(ratings_pivot, movie_id, user_id, corr=None, neighbors=None):
+    """Generate the final satisfaction score from either the correlation matrix or the
+    top-K neighbour index. A sparse rating matrix is scored from its rated entries, so it
+    is never made dense."""
     # load index lists
     movie_id = movie_id.tolist()
     user_id = user_id.tolist()
 
-    fav_movies, ratings_pivot_t = get_fav_movies(ratings_pivot, movie_id, user_id)
-    fav_movies = get_most_similar_movie(fav_movies, movie_id, corr)
-    result = get_score(fav_movies, ratings_pivot_t)
+    if scipy.sparse.issparse(ratings_pivot):
+        ratings = get_ratings_from_matrix(ratings_pivot, movie_id, user_id)
+        fav_movies = get_fav_movies_from_ratings(ratings)
+    else:
+        fav_movies, ratings_pivot_t = get_fav_movies(ratings_pivot, movie_id, user_id)
+    if neighbors is not None:
+        fav_movies = get_most_similar_movie_from_neighbors(fav_movies, movie_id, neighbors)
+    else:
+        fav_movies = get_most_similar_movie(fav_movies, movie_id, corr)
+    if scipy.sparse.issparse(ratings_pivot):
+        result = get_score_from_ratings(fav_movies, ratings)
+    else:
+        result = get_score(fav_movies, ratings_pivot_t)
+
+    return result
+
+@profiled
+def evaluate_ratings(ratings, movie_id, neighbors):
+    """Generate the final satisfaction score from the long-format ratings and the top-K
+    neighbour index, in memory proportional to the number of ratings."""
+    fav_movies = get_fav_movies_from_ratings(ratings)
+    fav_movies = get_most_similar_movie_from_neighbors(fav_movies, movie_id, neighbors)
+    result = get_score_from_ratings(fav_movies, ratings)
 
     return result
@@ -0,0 +1,114 @@
+"""Fingerprints of pipeline stages to skip the ones whose inputs have not changed."""
+
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(path, block_size=1048576):
+    """
+    Hash the content of a file.
+
+    Args:
+        path (str) - the path of the file
+        block_size (int) - how many bytes are read at a time
+
+    Returns:
+        digest (str) - the sha256 of the content, None if the file does not exist
+    """
+    if not os.path.isfile(path):
+        return None
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+def get_code_version(paths):
+    """
+    Hash the source code a stage runs.
+
+    Args:
+        paths (list) - the paths of the source files
+
+    Returns:
+        code_version (str) - the sha256 of the source files
+    """
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update(path.encode())
+        digest.update(hash_file(path).encode())
+
+    return digest.hexdigest()
+
+def get_fingerprint(inputs, config, options, code_version, remote=None):
+    """
+    Combine everything a stage depends on into a single fingerprint.
+
+    Args:
+        inputs (list) - the paths of the input files, hashed by content
+        config (dict) - the configuration sections used by the stage
+        options (dict) - the command line options of the stage
+        code_version (str) - the hash of the source code from `get_code_version`
+        remote (dict) - the versions of the inputs that are not local files, e.g. the
+        ETags of S3 objects, if the stage reads any
+
+    Returns:
+        fingerprint (str) - the sha256 of the inputs, configuration, options and code
+    """
+    state = {'inputs': {path: hash_file(path) for path in inputs}, 'config': config,
+             'options': options, 'code': code_version}
+    if remote is not None:
+        state['remote'] = remote
+
+    return hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()
+
+def is_fresh(path, fingerprint):
+    """
+    Check whether a stage already ran with the same fingerprint and its outputs are there.
+
+    Args:
+        path (str) - the path of the fingerprint record of the stage
+        fingerprint (str) - the current fingerprint of the stage
+
+    Returns:
+        fresh (bool) - whether the stage can be skipped
+    """
+    try:
+        with open(path, 'r') as f:
+            record = json.load(f)
+    except (IOError, ValueError):
+        return False
+
+    # a stage that wrote nothing, for instance on an error, is never up to date
+    outputs = record.get('outputs', {})
+    return record.get('fingerprint') == fingerprint and len(outputs) > 0 and \
+        all(os.path.isfile(output) and os.path.getsize(output) == size
+            for output, size in outputs.items())
+
+def save_fingerprint(path, fingerprint, outputs, start):
+    """
+    Record the fingerprint of a stage next to its outputs.
+
+    Only the outputs written since the stage started are recorded with their size, as
+    some are optional.
+
+    Args:
+        path (str) - the path of the fingerprint record of the stage
+        fingerprint (str) - the fingerprint of the stage
+        outputs (list) - the paths of the outputs of the stage
+        start (float) - the time the stage started, in seconds since the epoch
+
+    Returns: None
+    """
+    # file systems may only keep modification times to the second
+    written = {output: os.path.getsize(output) for output in outputs
+               if os.path.isfile(output) and os.path.getmtime(output) >= int(start)}
+    with open(path, 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'outputs': written}, f, indent=2)
+    logger.debug("Fingerprint %s saved to %s", fingerprint, path)
@@ -0,0 +1,303 @@
+"""Offline ranking metrics of the recommendations on a time-based holdout."""
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from src.als import train_als
+from src.ann import train_ann
+from src.parallel import attach_sparse, check_shared_memory, get_blocks, get_n_jobs, \
+    release, share_sparse
+from src.predict import get_factor_neighbors
+from src.profiling import profiled
+from src.train import get_top_k, train_neighbors
+
+logger = logging.getLogger(__name__)
+
+METRICS = ['precision', 'recall', 'ndcg', 'map']
+
+
+def holdout_split(ratings, test_ratio=0.2):
+    """
+    Hold out the latest ratings of each user as the test set.
+
+    Users keep at least one training rating, so users with a single rating are only
+    used for training.
+
+    Args:
+        ratings (pandas.DataFrame) - the cleaned ratings with a timestamp column
+        test_ratio (float) - the share of each user's ratings held out
+
+    Returns:
+        train (pandas.DataFrame) - the earlier ratings of each user
+        test (pandas.DataFrame) - the held out ratings
+    """
+    if not isinstance(ratings, pd.DataFrame):
+        logger.error("Provided argument `ratings` is not a Panda's DataFrame object")
+        raise TypeError("Provided argument `ratings` is not a Panda's DataFrame object")
+    if 'timestamp' not in ratings.columns:
+        logger.error("The ratings have no timestamp column, set `acquire.acquire.timestamp` "
+                     "to True or null in the model configuration and acquire and clean the "
+                     "ratings again to keep the rating times")
+        raise ValueError("The ratings have no timestamp column, set `acquire.acquire.timestamp` "
+                         "to True or null to keep them")
+
+    ratings = ratings.sort_values(['userId', 'timestamp'], kind='mergesort')
+    user = ratings['userId'].values
+    # position of each rating within its user, from the run lengths of the sorted users
+    starts = np.flatnonzero(np.r_[True, user[1:] != user[:-1]])
+    counts = np.diff(np.r_[starts, len(user)])
+    rank = np.arange(len(user)) - np.repeat(starts, counts)
+
+    n_test = np.minimum(np.floor(counts * test_ratio).astype(int), counts - 1)
+    is_test = rank >= np.repeat(counts - n_test, counts)
+
+    logger.info("%d ratings of %d users are held out for testing", is_test.sum(),
+                (n_test > 0).sum())
+
+    return ratings[~is_test], ratings[is_test]
+
+def get_neighbor_matrix(neighbors, scores, movie_id):
+    """
+    Store a top-K neighbour index as a sparse movies by movies similarity matrix.
+
+    Args:
+        neighbors (numpy.array) - the movie IDs of the top neighbours of each movie
+        scores (numpy.array) - the similarities with those neighbours
+        movie_id (numpy.array) - the movie IDs of the rows of the index
+
+    Returns:
+        neighbor_matrix (scipy.sparse.csr_matrix) - the similarities, 0 for non-neighbours
+    """
+    columns = pd.Index(movie_id).get_indexer(neighbors.ravel())
+    rows = np.repeat(np.arange(len(neighbors)), neighbors.shape[1])
+    kept = (columns >= 0) & np.isfinite(scores.ravel())
+
+    return scipy.sparse.csr_matrix((scores.ravel()[kept], (rows[kept], columns[kept])),
+                                   shape=(len(movie_id),)*2)
+
+def get_user_matrix(ratings, user_id, movie_id):
+    """
+    Store which movies each user rated as a sparse users by movies matrix.
+
+    Args:
+        ratings (pandas.DataFrame) - the ratings with userId and movieId columns
+        user_id (numpy.array) - the user IDs of the rows
+        movie_id (numpy.array) - the movie IDs of the columns, other movies are left out
+
+    Returns:
+        user_matrix (scipy.sparse.csr_matrix) - 1 where the user rated the movie
+    """
+    rows = pd.Index(user_id).get_indexer(ratings['userId'])
+    columns = pd.Index(movie_id).get_indexer(ratings['movieId'])
+    kept = (rows >= 0) & (columns >= 0)
+
+    user_matrix = scipy.sparse.csr_matrix((np.ones(kept.sum()), (rows[kept], columns[kept])),
+                                          shape=(len(user_id), len(movie_id)))
+    user_matrix.data[:] = 1 # repeated ratings are counted once
+
+    return user_matrix
+
+def rank_block(train_matrix, test_matrix, n_test, neighbor_matrix, ks, start, stop):
+    """
+    Recommend movies to one block of users and sum their ranking metrics.
+
+    A movie scores the sum of its similarities to the movies the user rated in training.
+    Rated movies and movies without a positive score are never recommended, so a user
+    may get fewer than k recommendations, the missing ones counting as misses.
+
+    Args:
+        train_matrix (scipy.sparse.csr_matrix) - the users by movies training ratings
+        test_matrix (scipy.sparse.csr_matrix) - the users by movies held out ratings
+        n_test (numpy.array) - the number of held out ratings of each user, including
+        movies the model does not know
+        neighbor_matrix (scipy.sparse.csr_matrix) - the movies by movies similarities
+        ks (list) - the cutoffs of the metrics
+        start (int) - the first user of the block
+        stop (int) - the user after the last user of the block
+
+    Returns:
+        sums (numpy.array) - the sum over users of each metric (row) at each cutoff (column)
+        n_users (int) - the number of users with held out ratings in the block
+        recommended (numpy.array) - whether each movie (column) was recommended at each
+        cutoff (row)
+    """
+    max_k = max(ks)
+    ks = np.asarray(ks)
+    users = start + np.flatnonzero(n_test[start:stop] > 0)
+    n_movies = neighbor_matrix.shape[0]
+
+    if len(users) == 0:
+        return np.zeros((len(METRICS), len(ks))), 0, np.zeros((len(ks), n_movies), dtype=bool)
+
+    seen = train_matrix[users]
+    scores = (seen @ neighbor_matrix).toarray()
+    scores[seen.nonzero()] = 0
+    scores[scores <= 0] = -np.inf
+
+    top_k = get_top_k(scores, min(max_k, n_movies))
+    valid = np.isfinite(np.take_along_axis(scores, top_k, axis=1))
+    hits = np.take_along_axis(test_matrix[users].toarray() > 0, top_k, axis=1) & valid
+    if hits.shape[1] < max_k: # fewer movies than the largest cutoff
+        pad = max_k - hits.shape[1]
+        hits = np.pad(hits, ((0, 0), (0, pad)))
+        valid = np.pad(valid, ((0, 0), (0, pad)))
+        top_k = np.pad(top_k, ((0, 0), (0, pad)))
+
+    relevant = n_test[users, None].astype(float)
+    discount = 1 / np.log2(np.arange(2, max_k + 2))
+    hit_counts = np.cumsum(hits, axis=1)[:, ks - 1]
+    dcg = np.cumsum(hits * discount, axis=1)[:, ks - 1]
+    idcg = np.cumsum(discount)[np.minimum(relevant, ks).astype(int) - 1]
+    # the precision at each hit, summed for the average precision
+    precision_hits = np.cumsum(hits, axis=1) / np.arange(1, max_k + 1) * hits
+    precision_at = np.cumsum(precision_hits, axis=1)[:, ks - 1]
+
+    sums = np.vstack([(hit_counts / ks).sum(axis=0),
+                      (hit_counts / relevant).sum(axis=0),
+                      (dcg / idcg).sum(axis=0),
+                      (precision_at / np.minimum(relevant, ks)).sum(axis=0)])
+
+    recommended = np.zeros((len(ks), n_movies), dtype=bool)
+    for position, k in enumerate(ks):
+        recommended[position, top_k[:, :k][valid[:, :k]]] = True
+
+    return sums, len(users), recommended
+
+def rank_block_shared(train_spec, test_spec, neighbor_spec, n_test, ks, start, stop):
+    """
+    Worker process entry point of `rank_block` on matrices held in shared memory.
+
+    Args:
+        train_spec (tuple) - the shared memory spec of the training matrix
+        test_spec (tuple) - the shared memory spec of the test matrix
+        neighbor_spec (tuple) - the shared memory spec of the similarity matrix
+        n_test (numpy.array) - the number of held out ratings of each user
+        ks (list) - the cutoffs of the metrics
+        start (int) - the first user of the block
+        stop (int) - the user after the last user of the block
+
+    Returns:
+        the outputs of `rank_block`
+    """
+    train_shms, train_matrix = attach_sparse(train_spec)
+    test_shms, test_matrix = attach_sparse(test_spec)
+    neighbor_shms, neighbor_matrix = attach_sparse(neighbor_spec)
+    try:
+        return rank_block(train_matrix, test_matrix, n_test, neighbor_matrix, ks, start, stop)
+    finally:
+        del train_matrix, test_matrix, neighbor_matrix # before the buffers are closed
+        for shm in train_shms + test_shms + neighbor_shms:
+            shm.close()
+
+def ranking_metrics(train_matrix, test_matrix, n_test, neighbor_matrix, ks=(5, 10, 20),
+                    block_size=1024, n_jobs=1):
+    """
+    Compute precision, recall, NDCG, MAP and catalogue coverage at several cutoffs.
+
+    Users are ranked a block at a time on sparse arrays. With several jobs the blocks are
+    sharded across worker processes, which attach to one shared memory copy of the
+    matrices.
+
+    Args:
+        train_matrix (scipy.sparse.csr_matrix) - the users by movies training ratings
+        test_matrix (scipy.sparse.csr_matrix) - the users by movies held out ratings
+        n_test (numpy.array) - the number of held out ratings of each user
+        neighbor_matrix (scipy.sparse.csr_matrix) - the movies by movies similarities
+        ks (list) - the cutoffs of the metrics
+        block_size (int) - how many users are ranked at a time
+        n_jobs (int) - the number of worker processes, -1 for all cores
+
+    Returns:
+        metrics (pandas.DataFrame) - the metrics (columns) at each cutoff k (rows),
+        averaged over the users with held out ratings
+    """
+    ks = sorted(ks)
+    blocks = get_blocks(train_matrix.shape[0], block_size)
+    n_jobs = min(get_n_jobs(n_jobs), len(blocks))
+
+    if n_jobs == 1:
+        results = [rank_block(train_matrix, test_matrix, n_test, neighbor_matrix, ks, *block)
+                   for block in blocks]
+    else:
+        check_shared_memory()
+        train_shms, train_spec = share_sparse(train_matrix)
+        test_shms, test_spec = share_sparse(test_matrix)
+        neighbor_shms, neighbor_spec = share_sparse(neighbor_matrix)
+        try:
+            with ProcessPoolExecutor(n_jobs) as executor:
+                results = list(executor.map(rank_block_shared, *zip(*[
+                    (train_spec, test_spec, neighbor_spec, n_test, ks, start, stop)
+                    for start, stop in blocks])))
+        finally:
+            release(*train_shms, *test_shms, *neighbor_shms)
+
+    sums, n_users, recommended = zip(*results)
+    n_users = sum(n_users)
+    metrics = pd.DataFrame((sum(sums) / max(n_users, 1)).T, columns=METRICS,
+                           index=pd.Index(ks, name='k'))
+    metrics['coverage'] = np.logical_or.reduce(recommended).mean(axis=1)
+
+    logger.info("Ranking metrics of %d users are computed in %d blocks by %d workers",
+                n_users, len(blocks), n_jobs)
+
+    return metrics
+
+def fit_neighbors(ratings, config):
+    """
+    Train the configured engine and return its top-K neighbour index.
+
+    Args:
+        ratings (pandas.DataFrame) - the training ratings
+        config (dict) - the `train` section of the model configuration
+
+    Returns:
+        movie_id (numpy.array) - the movie IDs of the rows of the index
+        neighbors (numpy.array) - the movie IDs of the top neighbours of each movie
+        scores (numpy.array) - the similarities with those neighbours
+    """
+    if config['engine'] == 'ann':
+        _, movie_id, _, neighbors, scores = train_ann(ratings, config)
+    elif config['engine'] == 'als':
+        _, movie_id, _, item_factors = train_als(ratings, config)
+        neighbors, scores = get_factor_neighbors(item_factors, movie_id,
+                                                 config['get_neighbors']['k'])
+    else:
+        _, movie_id, _, neighbors, scores = train_neighbors(ratings, config)
+
+    return np.asarray(movie_id), neighbors, scores
+
+@profiled
+def evaluate_ranking(ratings, movie_id, neighbors, scores, test, ks=(5, 10, 20),
+                     block_size=1024, n_jobs=1):
+    """
+    Score a neighbour index trained on the earlier ratings against the held out ones.
+
+    Args:
+        ratings (pandas.DataFrame) - the training ratings
+        movie_id (numpy.array) - the movie IDs of the rows of the index
+        neighbors (numpy.array) - the movie IDs of the top neighbours of each movie
+        scores (numpy.array) - the similarities with those neighbours
+        test (pandas.DataFrame) - the held out ratings
+        ks (list) - the cutoffs of the metrics
+        block_size (int) - how many users are ranked at a time
+        n_jobs (int) - the number of worker processes, -1 for all cores
+
+    Returns:
+        metrics (pandas.DataFrame) - the metrics (columns) at each cutoff k (rows)
+    """
+    user_id = np.unique(ratings['userId'])
+    train_matrix = get_user_matrix(ratings, user_id, movie_id)
+    test_matrix = get_user_matrix(test, user_id, movie_id)
+    # held out movies unknown to the model still count as relevant
+    n_test = test.drop_duplicates(['userId', 'movieId'])['userId'].value_counts().\
+        reindex(user_id, fill_value=0).values
+
+    neighbor_matrix = get_neighbor_matrix(neighbors, scores, movie_id)
+    metrics = ranking_metrics(train_matrix, test_matrix, n_test, neighbor_matrix, ks,
+                              block_size, n_jobs)
+
+    return metrics
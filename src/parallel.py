@@ -0,0 +1,187 @@
+"""Shared-memory helpers for running model steps in parallel."""
+
+import logging
+import mmap
+import os
+
+import numpy as np
+import scipy.sparse
+
+try:
+    from multiprocessing import shared_memory
+except ImportError: # python < 3.8, only thread workers are available
+    shared_memory = None
+
+logger = logging.getLogger(__name__)
+
+
+def get_n_jobs(n_jobs):
+    """
+    Resolve the number of workers, counting back from the number of cores if negative.
+
+    Args:
+        n_jobs (int) - the requested number of workers, -1 for all cores
+
+    Returns:
+        n_jobs (int) - the number of workers to start
+    """
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        n_jobs = (os.cpu_count() or 1) + 1 + n_jobs
+
+    return max(1, n_jobs)
+
+def get_blocks(n_rows, block_size):
+    """
+    Split a range of rows into contiguous blocks.
+
+    Args:
+        n_rows (int) - the number of rows
+        block_size (int) - the maximum number of rows per block
+
+    Returns:
+        blocks (list) - the (start, stop) pairs of the blocks
+    """
+    return [(start, min(start + block_size, n_rows)) for start in range(0, n_rows, block_size)]
+
+def check_shared_memory():
+    """
+    Make sure shared memory is available before starting worker processes.
+
+    Returns: None
+    """
+    if shared_memory is None:
+        logger.error("Process workers need multiprocessing.shared_memory (python 3.8+)")
+        raise RuntimeError("Process workers need multiprocessing.shared_memory (python 3.8+)")
+
+def share_array(array):
+    """
+    Copy an array into a new shared memory block that worker processes can attach to.
+
+    The caller owns the block and has to `close` and `unlink` it when done.
+
+    Args:
+        array (numpy.array) - the array to share
+
+    Returns:
+        shm (multiprocessing.shared_memory.SharedMemory) - the shared memory block
+        spec (tuple) - the (name, shape, dtype) needed by `attach_array`
+    """
+    check_shared_memory()
+    array = np.asarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+def create_shared_array(shape, dtype):
+    """
+    Allocate an empty array in shared memory, e.g. for the outputs of the workers.
+
+    Args:
+        shape (tuple) - the shape of the array
+        dtype (str) - the type of the array
+
+    Returns:
+        shm (multiprocessing.shared_memory.SharedMemory) - the shared memory block
+        spec (tuple) - the (name, shape, dtype) needed by `attach_array`
+    """
+    check_shared_memory()
+    dtype = np.dtype(dtype)
+    shm = shared_memory.SharedMemory(create=True,
+                                     size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+
+    return shm, (shm.name, tuple(shape), dtype.str)
+
+def get_memmap_spec(array):
+    """
+    Describe an array memory mapped from a file, e.g. by `np.load(path, mmap_mode='r')`.
+
+    Worker processes can map the same file with `attach_array`, so the array does not have
+    to be copied into shared memory.
+
+    Args:
+        array (numpy.array) - the array
+
+    Returns:
+        spec (tuple) - the (path, offset, shape, dtype) of the mapped file, None if the
+        array is not a whole memory mapped file
+    """
+    if not isinstance(array, np.memmap) or not isinstance(array.base, mmap.mmap) or \
+            array.filename is None or not array.flags['C_CONTIGUOUS']:
+        return None
+
+    return array.filename, array.offset, array.shape, array.dtype.str
+
+def attach_array(spec):
+    """
+    Attach to an array shared by `share_array` or `create_shared_array`, or to a memory
+    mapped file described by `get_memmap_spec`, without copying.
+
+    Args:
+        spec (tuple) - the (name, shape, dtype) of the shared array, or the
+        (path, offset, shape, dtype) of the mapped file
+
+    Returns:
+        shm (multiprocessing.shared_memory.SharedMemory) - the block, to be closed after use,
+        None for a mapped file
+        array (numpy.array) - the array backed by the shared memory or the file
+    """
+    if len(spec) == 4:
+        path, offset, shape, dtype = spec
+        return None, np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+def share_sparse(matrix):
+    """
+    Copy the arrays of a CSR matrix into shared memory blocks.
+
+    Args:
+        matrix (scipy.sparse matrix) - the matrix to share
+
+    Returns:
+        shms (list) - the shared memory blocks of the data, indices and indptr arrays
+        spec (tuple) - the array specs and the shape needed by `attach_sparse`
+    """
+    matrix = scipy.sparse.csr_matrix(matrix)
+    shms, specs = zip(*[share_array(array)
+                        for array in (matrix.data, matrix.indices, matrix.indptr)])
+
+    return list(shms), (specs, matrix.shape)
+
+def attach_sparse(spec):
+    """
+    Attach to a CSR matrix shared by `share_sparse`.
+
+    Args:
+        spec (tuple) - the array specs and the shape of the shared matrix
+
+    Returns:
+        shms (list) - the blocks, to be closed after use once the matrix is deleted
+        matrix (scipy.sparse.csr_matrix) - the matrix backed by the shared memory
+    """
+    specs, shape = spec
+    shms, arrays = zip(*[attach_array(array_spec) for array_spec in specs])
+
+    return list(shms), scipy.sparse.csr_matrix(tuple(arrays), shape=shape, copy=False)
+
+def release(*shms):
+    """
+    Close and unlink shared memory blocks owned by the caller.
+
+    Args:
+        shms (multiprocessing.shared_memory.SharedMemory) - the blocks to release, None
+        for the arrays that were not copied
+
+    Returns: None
+    """
+    for shm in shms:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,198 @@
+"""In-process model pipeline running its stages as a dependency graph."""
+
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+import scipy.sparse
+
+import src.acquire as acquire
+import src.als as als
+import src.ann as ann
+import src.clean as clean
+import src.evaluate as evaluate
+import src.featurize as featurize
+import src.predict as predict
+import src.train as train
+from src.artifacts import read_ratings, read_table, with_format, write_matrix, write_table
+from src.profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+# the stages each stage needs the outputs of
+STAGES = {'acquire': [], 'clean': ['acquire'], 'featurize': ['clean'], 'train': ['clean'],
+          'predict': ['train'], 'evaluate': ['train']}
+
+# the file names of the outputs of each stage, as written by the run.py subcommands
+ARTIFACTS = {'acquire': {'movies': 'movies-raw.csv', 'links': 'links-raw.csv',
+                         'ratings': 'ratings-raw.csv'},
+             'clean': {'movies': 'movies-clean.csv', 'ratings': 'ratings-clean.csv'},
+             'featurize': {'movies': 'movies-feature.csv'},
+             'train': {'ratings_pivot': 'ratings-pivot-train.csv', 'movie_id': 'movieID-train.npy',
+                       'user_id': 'userID-train.npy', 'corr': 'corr-train.npy',
+                       'neighbors': 'neighbors-train.npz', 'item_factors': 'factors-train.npz'},
+             'predict': {'predictions': 'predictions-predict.csv'},
+             'evaluate': {'score': 'score-evaluate.txt'}}
+
+
+@profiled
+def run_acquire(data, config):
+    """Acquire the raw data from S3, or from the local `raw_paths` if given."""
+    if data.get('raw_paths') is not None:
+        movies, links = [read_table(data['raw_paths'][name]) for name in ('movies', 'links')]
+        ratings = read_ratings(data['raw_paths']['ratings'],
+                               config['acquire']['acquire']['timestamp'])
+    else:
+        movies, links, ratings = acquire.acquire(**config['acquire']['acquire'])
+
+    return {'movies': movies, 'links': links, 'ratings': ratings}
+
+@profiled
+def run_clean(data, config):
+    """Clean and merge the raw data."""
+    movies, ratings = clean.clean(data['movies'], data['links'], data['ratings'],
+                                  config['clean'])
+
+    return {'movies': movies, 'ratings': ratings}
+
+@profiled
+def run_featurize(data, config):
+    """Add the movie features to the cleaned movies."""
+    movies = featurize.featurize(data['movies'], data['ratings'],
+                                 **config['featurize']['featurize'])
+
+    return {'movies': movies}
+
+@profiled
+def run_train(data, config):
+    """Train the model of the configured engine on the cleaned ratings."""
+    outputs = {}
+    if config['train']['engine'] == 'ann':
+        outputs['ratings_pivot'], outputs['movie_id'], outputs['user_id'], \
+            outputs['neighbors'], outputs['scores'] = ann.train_ann(data['ratings'],
+                                                                    config['train'])
+    elif config['train']['engine'] == 'als':
+        outputs['ratings_pivot'], outputs['movie_id'], outputs['user_id'], \
+            outputs['item_factors'] = als.train_als(data['ratings'], config['train'])
+    else:
+        outputs['ratings_pivot'], outputs['movie_id'], outputs['user_id'], \
+            outputs['corr'] = train.train(data['ratings'], config['train'])
+
+    return outputs
+
+@profiled
+def run_predict(data, config):
+    """Generate the predictions from the trained model."""
+    if 'neighbors' in data:
+        predictions = predict.predict_neighbors(data['neighbors'], data['movie_id'],
+                                                config['predict'])
+    elif 'item_factors' in data:
+        predictions = predict.predict_factors(data['item_factors'], data['movie_id'],
+                                              config['predict'])
+    else:
+        predictions = predict.predict(data['corr'], data['movie_id'], config['predict'])
+
+    return {'predictions': predictions}
+
+@profiled
+def run_evaluate(data, config):
+    """Score the trained model on the cleaned ratings."""
+    if 'corr' in data:
+        score = evaluate.evaluate(data['ratings_pivot'], data['movie_id'], data['user_id'],
+                                  data['corr'])
+    else:
+        if 'neighbors' in data:
+            neighbors = data['neighbors']
+        else:
+            neighbors = predict.get_factor_neighbors(data['item_factors'], data['movie_id'],
+                                                     k=1)[0]
+        score = evaluate.evaluate_ratings(data['ratings'][['userId', 'movieId', 'rating']],
+                                          data['movie_id'], neighbors)
+
+    return {'score': score}
+
+STAGE_FUNCTIONS = {'acquire': run_acquire, 'clean': run_clean, 'featurize': run_featurize,
+                   'train': run_train, 'predict': run_predict, 'evaluate': run_evaluate}
+
+def save_stage(stage, outputs, output_dir, artifact_format='csv'):
+    """
+    Write the outputs of a stage under the file names of the run.py subcommands.
+
+    Args:
+        stage (str) - the name of the stage
+        outputs (dict) - the outputs of the stage
+        output_dir (str) - the directory to write to
+        artifact_format (str) - the format of the tables, csv, parquet or feather
+
+    Returns: None
+    """
+    for name, file_name in ARTIFACTS[stage].items():
+        if name not in outputs:
+            continue
+        path = os.path.join(output_dir, file_name)
+
+        if name == 'ratings_pivot':
+            write_matrix(outputs[name], with_format(path, artifact_format, matrix=True,
+                                                    sparse=scipy.sparse.issparse(outputs[name])))
+        elif path.endswith('.csv'):
+            write_table(outputs[name], with_format(path, artifact_format))
+        elif name == 'neighbors':
+            np.savez(path, movie_id=outputs['movie_id'], neighbors=outputs['neighbors'],
+                     scores=outputs['scores'])
+        elif name == 'item_factors':
+            np.savez(path, movie_id=outputs['movie_id'], factors=outputs['item_factors'])
+        elif path.endswith('.npy'):
+            np.save(path, outputs[name])
+        else:
+            with open(path, 'w') as f:
+                f.write("Average satisfaction score %.2f: " % outputs[name])
+
+    logger.info("Outputs of stage %s saved to %s", stage, output_dir)
+
+def run_pipeline(config, raw_paths=None, output_dir=None, artifact_format='csv', n_jobs=2):
+    """
+    Run acquire, clean, featurize, train, predict and evaluate in one process.
+
+    Each stage starts as soon as the stages it depends on are done, so featurize runs
+    alongside train, and predict alongside evaluate. The outputs are passed in memory and
+    only written if an output directory is given.
+
+    Args:
+        config (dict) - the model configuration
+        raw_paths (dict) - the paths of the raw `movies`, `links` and `ratings` tables,
+        acquired from S3 if None
+        output_dir (str) - the directory to write the outputs of every stage to, if any
+        artifact_format (str) - the format of the tables, csv, parquet or feather
+        n_jobs (int) - how many stages may run at the same time
+
+    Returns:
+        outputs (dict) - the outputs of every stage, by stage name
+    """
+    data = {'raw_paths': raw_paths}
+    outputs = {}
+    pending = list(STAGES)
+    running = {}
+
+    with ThreadPoolExecutor(max(n_jobs, 1)) as executor:
+        while pending or running:
+            for stage in [stage for stage in pending
+                          if all(dependency in outputs for dependency in STAGES[stage])]:
+                pending.remove(stage)
+                logger.info("Stage %s started", stage)
+                # each stage gets a snapshot, as others may add their outputs meanwhile
+                running[executor.submit(STAGE_FUNCTIONS[stage], dict(data), config)] = \
+                    (stage, time.perf_counter())
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, start = running.pop(future)
+                outputs[stage] = future.result()
+                data.update(outputs[stage])
+                logger.info("Stage %s done in %.1f s", stage, time.perf_counter() - start)
+
+                if output_dir is not None:
+                    save_stage(stage, outputs[stage], output_dir, artifact_format)
+
+    return outputs
@@ -1,10 +1,16 @@
 """Prediction script."""
 
 import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
 
+from src.parallel import attach_array, create_shared_array, get_blocks, get_memmap_spec, \
+    get_n_jobs, release, share_array
+from src.profiling import profiled
+from src.train import get_top_k
+
 logger = logging.getLogger(__name__)
 
 
@@ -29,13 +35,70 @@ def predict_aux(dist_list, movie_id):
 
     return result
 
-def predict_matrix(corr, movie_id):
+def predict_block(corr, movie_id, n_ranked, start, stop, prediction_matrix):
+    """
+    Rank one block of rows of the correlation matrix into the prediction matrix.
+
+    Args:
+        corr (numpy.array) - the correlation matrix from model training step
+        movie_id (numpy.array) - the list of movie IDs used in model training
+        n_ranked (int) - how many movies to rank per row, including the movie itself
+        start (int) - the first row of the block
+        stop (int) - the row after the last row of the block
+        prediction_matrix (numpy.array) - the output, filled in place for the block rows
+
+    Returns: None
+    """
+    top_k = get_top_k(corr[start:stop], n_ranked)
+    # discard the most similar movie, which is itself
+    prediction_matrix[start:stop] = movie_id[top_k[:, 1:]]
+
+def predict_block_shared(corr_spec, prediction_spec, movie_id, n_ranked, start, stop):
+    """
+    Worker process entry point of `predict_block` on arrays held in shared memory.
+
+    Args:
+        corr_spec (tuple) - the shared memory or memory mapped file spec of the correlation
+        matrix
+        prediction_spec (tuple) - the shared memory spec of the prediction matrix
+        movie_id (numpy.array) - the list of movie IDs used in model training
+        n_ranked (int) - how many movies to rank per row, including the movie itself
+        start (int) - the first row of the block
+        stop (int) - the row after the last row of the block
+
+    Returns: None
+    """
+    corr_shm, corr = attach_array(corr_spec)
+    prediction_shm, prediction_matrix = attach_array(prediction_spec)
+    try:
+        predict_block(corr, movie_id, n_ranked, start, stop, prediction_matrix)
+    finally:
+        del corr, prediction_matrix # views must go before the buffers are closed
+        if corr_shm is not None: # a memory mapped file has no block to close
+            corr_shm.close()
+        prediction_shm.close()
+
+@profiled
+def predict_matrix(corr, movie_id, top_n=None, block_size=1024, n_jobs=1, backend='thread'):
     """
     Get the predictions (the similar movies) in a matrix form.
 
+    Rows are ranked a block at a time with `np.argpartition`, so only the `top_n` winners
+    of each row are sorted, and indices are mapped to movie IDs by array indexing. The
+    ranking is the same as `predict_aux` applied to every row.
+
+    With several jobs the blocks are ranked concurrently. Threads share `corr` directly.
+    Processes map the same file when `corr` is memory mapped, e.g. loaded with
+    `np.load(path, mmap_mode='r')`, and otherwise attach to a shared memory copy of it,
+    which doubles the memory held by `corr` while the workers run.
+
     Args:
         corr (numpy.array) - the trained model object, correlation matrix from model training step
         movie_id (numpy.array) - the list of movie IDs used in model training
+        top_n (int) - how many similar movies to keep per movie, all of them if None
+        block_size (int) - how many rows of `corr` are ranked at a time
+        n_jobs (int) - the number of workers, -1 for all cores
+        backend (str) - the kind of workers, 'thread' or 'process'
     Returns:
         prediction matrix (numpy.array) - the predictions, each row is the result list 
         (described in previous function) for a particular movie
@@ -44,8 +107,47 @@ def predict_matrix(corr, movie_id):
         logger.error("Provided argument `corr` is not a Numpy.Array object")
         raise TypeError("Provided argument `corr` is not a Numpy.Array object")
 
+    if backend not in ('thread', 'process'):
+        logger.error("Provided argument `backend` must be 'thread' or 'process'")
+        raise ValueError("Provided argument `backend` must be 'thread' or 'process'")
+
+    movie_id = np.asarray(movie_id)
+    if corr.shape[1] > len(movie_id):
+        logger.error("Provided `movie_id` has smaller length than `corr`")
+        raise IndexError("Provided `movie_id` has smaller length than `corr`")
+
+    n_ranked = corr.shape[1] if top_n is None else min(top_n + 1, corr.shape[1])
+    shape = (corr.shape[0], n_ranked - 1)
+    blocks = get_blocks(corr.shape[0], block_size)
+    n_jobs = min(get_n_jobs(n_jobs), len(blocks))
+
     # the predictions in matrix format
-    prediction_matrix = np.array([predict_aux(x, movie_id) for x in corr])
+    if n_jobs == 1:
+        prediction_matrix = np.empty(shape, dtype=movie_id.dtype)
+        for start, stop in blocks:
+            predict_block(corr, movie_id, n_ranked, start, stop, prediction_matrix)
+    elif backend == 'thread': # numpy releases the GIL while partitioning and sorting
+        prediction_matrix = np.empty(shape, dtype=movie_id.dtype)
+        with ThreadPoolExecutor(n_jobs) as executor:
+            list(executor.map(lambda block: predict_block(corr, movie_id, n_ranked, *block,
+                                                          prediction_matrix), blocks))
+    else:
+        corr_shm, corr_spec = None, get_memmap_spec(corr)
+        if corr_spec is None:
+            corr_shm, corr_spec = share_array(corr)
+        prediction_shm, prediction_spec = create_shared_array(shape, movie_id.dtype)
+        try:
+            with ProcessPoolExecutor(n_jobs) as executor:
+                list(executor.map(predict_block_shared, *zip(*[
+                    (corr_spec, prediction_spec, movie_id, n_ranked, start, stop)
+                    for start, stop in blocks])))
+            prediction_matrix = np.ndarray(shape, dtype=movie_id.dtype,
+                                           buffer=prediction_shm.buf).copy()
+        finally:
+            release(corr_shm, prediction_shm)
+
+    logger.debug("Predictions of %d movies ranked in %d blocks by %d %s workers", shape[0],
+                 len(blocks), n_jobs, backend)
 
     return prediction_matrix
 
@@ -75,7 +177,120 @@ def predict_df(prediction_matrix, movie_id, top_n = 10):
 
 def predict(corr, movie_id, config):
     """Perform all model prediction steps."""
-    prediction_matrix = predict_matrix(corr, movie_id)
+    prediction_matrix = predict_matrix(corr, movie_id, top_n=config['predict_df']['top_n'],
+                                       **config['predict_matrix'])
     predictions = predict_df(prediction_matrix, movie_id, **config['predict_df'])
 
     return predictions
+
+def predict_neighbors(neighbors, movie_id, config):
+    """
+    Generate the predictions from the top-K neighbour index saved in model training.
+
+    Args:
+        neighbors (numpy.array) - the movie IDs of the top neighbours of each movie
+        movie_id (numpy.array) - the list of movie IDs used in model training
+        config (dict) - the `predict` section of the model configuration
+
+    Returns:
+        predictions (pandas.DataFrame) - the predictions, missing neighbours left empty
+    """
+    if neighbors.shape[1] < config['predict_df']['top_n']:
+        logger.error("The neighbour index only holds %d neighbours per movie", neighbors.shape[1])
+        raise ValueError("The neighbour index only holds %d neighbours per movie"
+                         % neighbors.shape[1])
+
+    predictions = predict_df(neighbors, movie_id, **config['predict_df'])
+
+    # neighbours dropped by the similarity cutoff are stored as -1
+    columns = predictions.columns[1:]
+    predictions[columns] = predictions[columns].mask(predictions[columns] < 0).astype('Int64')
+
+    return predictions
+
+def rank_factor_block(normalized, movie_id, k, start, stop, neighbors, scores):
+    """
+    Rank the neighbours of one block of movies by the dot products of their factors.
+
+    Args:
+        normalized (numpy.array) - the movie factors scaled to unit norm
+        movie_id (numpy.array) - the list of movie IDs used in model training
+        k (int) - how many neighbours to keep for each movie
+        start (int) - the first row of the block
+        stop (int) - the row after the last row of the block
+        neighbors (numpy.array) - the output neighbour IDs, filled in place for the block
+        scores (numpy.array) - the output similarities, filled in place for the block
+
+    Returns: None
+    """
+    similarity = normalized[start:stop] @ normalized.T
+    similarity[np.arange(stop - start), np.arange(start, stop)] = -np.inf # the movie itself
+    top_k = get_top_k(similarity, k)
+    neighbors[start:stop] = movie_id[top_k]
+    scores[start:stop] = np.take_along_axis(similarity, top_k, axis=1)
+
+@profiled
+def get_factor_neighbors(item_factors, movie_id, k=10, block_size=1024, n_jobs=1):
+    """
+    Find the top-K neighbours of each movie by the cosine similarity of its factors.
+
+    The normalized factors are multiplied one block of rows at a time, so only a block of
+    the similarity matrix is ever held in memory.
+
+    Args:
+        item_factors (numpy.array) - the factors of the movies from the ALS engine
+        movie_id (numpy.array) - the list of movie IDs used in model training
+        k (int) - how many neighbours to keep for each movie
+        block_size (int) - how many movies are scored at a time
+        n_jobs (int) - the number of threads, -1 for all cores
+
+    Returns:
+        neighbors (numpy.array) - the movie IDs of the k neighbours of each movie, best first
+        scores (numpy.array) - the cosine similarities with those neighbours
+    """
+    if not isinstance(item_factors, np.ndarray):
+        logger.error("Provided argument `item_factors` is not a Numpy.Array object")
+        raise TypeError("Provided argument `item_factors` is not a Numpy.Array object")
+
+    movie_id = np.asarray(movie_id)
+    n_movies = len(item_factors)
+    k = min(k, n_movies - 1)
+
+    norm = np.linalg.norm(item_factors, axis=1, keepdims=True)
+    normalized = np.divide(item_factors, norm, out=np.zeros_like(item_factors), where=norm > 0)
+
+    neighbors = np.empty((n_movies, k), dtype=movie_id.dtype)
+    scores = np.empty((n_movies, k))
+    blocks = get_blocks(n_movies, block_size)
+    n_jobs = min(get_n_jobs(n_jobs), len(blocks))
+
+    if n_jobs == 1:
+        for start, stop in blocks:
+            rank_factor_block(normalized, movie_id, k, start, stop, neighbors, scores)
+    else: # the products and partitions run without the GIL
+        with ThreadPoolExecutor(n_jobs) as executor:
+            list(executor.map(lambda block: rank_factor_block(normalized, movie_id, k, *block,
+                                                              neighbors, scores), blocks))
+
+    logger.info("The top %d neighbours of %d movies are ranked from their factors.", k,
+                n_movies)
+
+    return neighbors, scores
+
+def predict_factors(item_factors, movie_id, config):
+    """
+    Generate the predictions from the movie factors saved by the ALS engine.
+
+    Args:
+        item_factors (numpy.array) - the factors of the movies
+        movie_id (numpy.array) - the list of movie IDs used in model training
+        config (dict) - the `predict` section of the model configuration
+
+    Returns:
+        predictions (pandas.DataFrame) - the predictions
+    """
+    neighbors, _ = get_factor_neighbors(item_factors, movie_id, config['predict_df']['top_n'],
+                                        config['predict_matrix']['block_size'],
+                                        config['predict_matrix']['n_jobs'])
+
+    return predict_df(neighbors, movie_id, **config['predict_df'])
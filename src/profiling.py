@@ -0,0 +1,210 @@
+"""Wall time, CPU time, memory and data volume of pipeline stages and functions."""
+
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError: # not available on Windows, where the peak memory is not recorded
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+ENABLED = False
+RECORDS = []
+_LOCK = threading.Lock()
+
+
+def enable():
+    """Start recording the profiled stages and functions."""
+    global ENABLED
+    ENABLED = True
+    del RECORDS[:]
+
+def disable():
+    """Stop recording, keeping the records so far."""
+    global ENABLED
+    ENABLED = False
+
+def get_peak_rss():
+    """
+    Get the peak resident memory of the process so far.
+
+    The peak is the high-water mark of the whole process since it started, not of the
+    current stage or function, which `stop` derives from the change of it and of `get_rss`.
+
+    Returns:
+        peak_rss_mb (float) - the peak resident set size in MB, None if unknown
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # the peak is in bytes on macOS and in kilobytes elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+def get_rss():
+    """
+    Get the current resident memory of the process.
+
+    Returns:
+        rss_mb (float) - the resident set size in MB, None where /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+def get_change(first, last):
+    """Subtract two optional measurements, None if either is unknown."""
+    return None if first is None or last is None else last - first
+
+def get_size(value):
+    """
+    Count the rows and bytes of the data held by a value.
+
+    Args:
+        value (object) - a dataframe, array, sparse matrix, file path or a collection of them
+
+    Returns:
+        rows (int) - the number of rows
+        size (int) - the number of bytes, in memory or on disk for a file path
+    """
+    # imported here so that modules using `profiled` load as fast as their own imports
+    import numpy as np
+    import pandas as pd
+    import scipy.sparse
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value), int(value.memory_usage(index=False, deep=False).sum())
+    if isinstance(value, np.ndarray):
+        return (value.shape[0] if value.ndim else 1), value.nbytes
+    if scipy.sparse.issparse(value):
+        value = value.tocsr()
+        return value.shape[0], value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    if isinstance(value, str):
+        return 0, (os.path.getsize(value) if os.path.isfile(value) else 0)
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        sizes = [get_size(item) for item in value]
+        return sum(rows for rows, _ in sizes), sum(size for _, size in sizes)
+
+    return 0, 0
+
+def start(name):
+    """
+    Start measuring a stage or function.
+
+    Args:
+        name (str) - the name of the stage or function
+
+    Returns:
+        token (dict) - the name and start times, to pass to `stop`
+    """
+    return {'name': name, 'wall': time.perf_counter(), 'cpu': time.process_time(),
+            'rss': get_rss(), 'peak_rss': get_peak_rss()}
+
+def stop(token, inputs=None, outputs=None, kind='stage'):
+    """
+    Record the resources used since `start`.
+
+    The CPU time is the one of the whole process, so it includes any threads running
+    alongside. The memory of the call is the change of the resident memory from start to
+    stop, which can be negative when memory is freed, and how much the call raised the
+    peak of the process, 0 when it stayed below an earlier peak. The peak of the process
+    so far is kept as `process_peak_rss_mb`.
+
+    Args:
+        token (dict) - the output of `start`
+        inputs (object) - the inputs, counted by `get_size`
+        outputs (object) - the outputs, counted by `get_size`
+        kind (str) - stage or function
+
+    Returns:
+        record (dict) - the recorded measurements
+    """
+    peak_rss = get_peak_rss()
+    input_rows, input_bytes = get_size(inputs)
+    output_rows, output_bytes = get_size(outputs)
+    record = {'name': token['name'], 'kind': kind,
+              'wall_seconds': time.perf_counter() - token['wall'],
+              'cpu_seconds': time.process_time() - token['cpu'],
+              'rss_change_mb': get_change(token['rss'], get_rss()),
+              'peak_rss_increase_mb': get_change(token['peak_rss'], peak_rss),
+              'process_peak_rss_mb': peak_rss,
+              'input_rows': input_rows, 'input_bytes': input_bytes,
+              'output_rows': output_rows, 'output_bytes': output_bytes}
+
+    with _LOCK:
+        RECORDS.append(record)
+    logger.debug("%s %s took %.3f s wall and %.3f s CPU", kind.capitalize(), token['name'],
+                 record['wall_seconds'], record['cpu_seconds'])
+
+    return record
+
+def profiled(func):
+    """
+    Decorate a function so that its calls are recorded while profiling is enabled.
+
+    Args:
+        func (function) - the function to profile
+
+    Returns:
+        wrapper (function) - the profiled function
+    """
+    name = '%s.%s' % (func.__module__, func.__qualname__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return func(*args, **kwargs)
+
+        token = start(name)
+        result = func(*args, **kwargs)
+        stop(token, [args, kwargs], result, kind='function')
+
+        return result
+
+    return wrapper
+
+def get_report():
+    """
+    Summarize the recorded stages and functions.
+
+    Returns:
+        report (dict) - every record in order of completion, and the total of each name
+    """
+    with _LOCK:
+        records = list(RECORDS)
+
+    summary = {}
+    for record in records:
+        total = summary.setdefault(record['name'], {'kind': record['kind'], 'calls': 0,
+                                                    'wall_seconds': 0., 'cpu_seconds': 0.})
+        total['calls'] += 1
+        total['wall_seconds'] += record['wall_seconds']
+        total['cpu_seconds'] += record['cpu_seconds']
+
+    return {'process_peak_rss_mb': get_peak_rss(), 'records': records, 'summary': summary}
+
+def save_report(path):
+    """
+    Write the profiling report as JSON.
+
+    Args:
+        path (str) - the path of the report
+
+    Returns: None
+    """
+    with open(path, 'w') as f:
+        json.dump(get_report(), f, indent=2)
+    logger.info("Profiling report saved to %s", path)
@@ -0,0 +1,149 @@
+"""Out-of-core model training from chunked ratings files."""
+
+import logging
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from src.artifacts import RATING_COLUMNS, RATING_DTYPES, iter_table_chunks
+from src.profiling import profiled
+from src.update import get_neighbors_from_statistics
+
+logger = logging.getLogger(__name__)
+
+
+def get_ids(path, chunksize=1000000):
+    """
+    Collect the movie and user IDs of a ratings file in a first pass over its chunks.
+
+    Args:
+        path (str) - the path of the ratings table (.csv, .parquet or .feather)
+        chunksize (int) - how many ratings are read at a time
+
+    Returns:
+        movie_id (numpy.array) - the sorted movie IDs
+        user_id (numpy.array) - the sorted user IDs
+    """
+    movie_ids, user_ids = [], []
+    for chunk in iter_table_chunks(path, ['userId', 'movieId'], chunksize, RATING_DTYPES):
+        movie_ids.append(chunk['movieId'].unique())
+        user_ids.append(chunk['userId'].unique())
+
+    if not movie_ids:
+        logger.error("No ratings found in %s", path)
+        raise ValueError("No ratings found in %s" % path)
+
+    return np.unique(np.concatenate(movie_ids)), np.unique(np.concatenate(user_ids))
+
+def iter_user_chunks(path, user_id, chunksize=1000000):
+    """
+    Read a ratings file in chunks that each hold all the ratings of their users.
+
+    The ratings of the last user of a chunk may continue in the next one, so they are
+    held back and prepended to it. This needs the file to be grouped by user, as the
+    co-rating products of a user cannot be split across chunks.
+
+    Args:
+        path (str) - the path of the ratings table (.csv, .parquet or .feather)
+        user_id (numpy.array) - the sorted user IDs from `get_ids`
+        chunksize (int) - how many ratings are read at a time
+
+    Yields:
+        chunk (pandas.DataFrame) - the complete ratings of a group of users
+    """
+    seen = np.zeros(len(user_id), dtype=bool)
+    carry = None
+
+    for chunk in iter_table_chunks(path, RATING_COLUMNS, chunksize, RATING_DTYPES):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+
+        last = chunk['userId'].values[-1]
+        is_last = chunk['userId'].values == last
+        carry, chunk = chunk[is_last], chunk[~is_last]
+        if chunk.empty:
+            continue
+
+        users = np.searchsorted(user_id, chunk['userId'].unique())
+        if seen[users].any():
+            logger.error("The ratings in %s are not grouped by user, sort them by userId to "
+                         "train in chunks", path)
+            raise ValueError("The ratings in %s are not grouped by user" % path)
+        seen[users] = True
+
+        yield chunk
+
+    if carry is not None:
+        if seen[np.searchsorted(user_id, carry['userId'].values[0])]:
+            logger.error("The ratings in %s are not grouped by user, sort them by userId to "
+                         "train in chunks", path)
+            raise ValueError("The ratings in %s are not grouped by user" % path)
+
+        yield carry
+
+@profiled
+def get_streaming_statistics(path, chunksize=1000000):
+    """
+    Accumulate the sufficient statistics of the movie correlations chunk by chunk.
+
+    The co-rating products X X' are the sum over users of the outer products of their
+    rating vectors, so each group of users adds its own sparse product. Only one chunk of
+    ratings and the movies by movies products are held in memory, never the full table or
+    pivot, so the statistics carry no rating matrix and cannot be updated incrementally.
+
+    Args:
+        path (str) - the path of the ratings table, grouped by user
+        chunksize (int) - how many ratings are read at a time
+
+    Returns:
+        statistics (dict) - the movie and user IDs, the `sums` and `sum_sq` of each movie
+        and the sparse `cross` products, as in `update.get_statistics`
+    """
+    movie_id, user_id = get_ids(path, chunksize)
+    n_movies = len(movie_id)
+
+    cross = scipy.sparse.csr_matrix((n_movies, n_movies))
+    sums = np.zeros(n_movies)
+    sum_sq = np.zeros(n_movies)
+    n_ratings = 0
+
+    for chunk in iter_user_chunks(path, user_id, chunksize):
+        rows = np.searchsorted(movie_id, chunk['movieId'].values)
+        cols, users = pd.factorize(chunk['userId'])
+        rating = chunk['rating'].values.astype(np.float64)
+
+        ratings_matrix = scipy.sparse.csr_matrix((rating, (rows, cols)),
+                                                 shape=(n_movies, len(users)))
+        cross += ratings_matrix @ ratings_matrix.T
+        sums += np.asarray(ratings_matrix.sum(axis=1)).ravel()
+        sum_sq += np.asarray(ratings_matrix.multiply(ratings_matrix).sum(axis=1)).ravel()
+        n_ratings += len(chunk)
+
+    logger.info("Statistics of %d movies and %d users are accumulated from %d ratings with "
+                "%d co-rated pairs.", n_movies, len(user_id), n_ratings, cross.nnz)
+
+    return {'movie_id': movie_id, 'user_id': user_id, 'sums': sums, 'sum_sq': sum_sq,
+            'cross': cross.tocsr()}
+
+def train_streaming(path, config):
+    """
+    Perform all model training steps on a ratings file without loading it in memory.
+
+    Args:
+        path (str) - the path of the cleaned ratings table, grouped by user
+        config (dict) - the `train` section of the model configuration
+
+    Returns:
+        movie_id (numpy.array) - the movie IDs used for modeling
+        user_id (numpy.array) - the user IDs used for modeling
+        neighbors (numpy.array) - the movie IDs of the top neighbours of each movie
+        scores (numpy.array) - the correlations with those neighbours
+        statistics (dict) - the accumulated sufficient statistics
+    """
+    statistics = get_streaming_statistics(path, **config['stream_ratings'])
+    neighbors, scores = get_neighbors_from_statistics(
+        statistics, **config['get_neighbors'], block_size=config['compute_distance']['block_size'],
+        max_memory_mb=config['compute_distance']['max_memory_mb'])
+
+    return statistics['movie_id'], statistics['user_id'], neighbors, scores, statistics
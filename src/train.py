@@ -4,19 +4,25 @@ import logging
 
 import numpy as np
 import pandas as pd
+import scipy.sparse
+
+from src.profiling import profiled
 
 logger = logging.getLogger(__name__)
 
 
-def get_rating_matrix(ratings):
+@profiled
+def get_rating_matrix(ratings, sparse=False):
     """
     Generate the rating matrix, row by movieId and column by userId.
 
     Args:
         ratings (pandas.DataFrame) - cleaned ratings dataframe
+        sparse (bool) - whether to build a scipy CSR matrix from factorized ids instead of
+        a dense pivot, unrated entries are implicit zeros either way
 
     Returns:
-        ratings_pivot (pandas.DataFrame) - the pivoted ratings dataframe
+        ratings_pivot (pandas.DataFrame or scipy.sparse.csr_matrix) - the pivoted ratings
         movieID (list) - the movie IDs used for modeling
         userID (list) - the user IDs used for modeling
     """
@@ -24,6 +30,22 @@ def get_rating_matrix(ratings):
         logger.error("Provided argument `ratings` is not a Panda's DataFrame object")
         raise TypeError("Provided argument `ratings` is not a Panda's DataFrame object")
 
+    if sparse:
+        # sorted codes give the same row/column order as the dense pivot
+        movie_codes, movie_id = pd.factorize(ratings['movieId'], sort=True)
+        user_codes, user_id = pd.factorize(ratings['userId'], sort=True)
+        movie_id = pd.Index(movie_id, name='movieId')
+        user_id = pd.Index(user_id, name='userId')
+
+        ratings_pivot = scipy.sparse.csr_matrix(
+            (ratings['rating'].values.astype(np.float64), (movie_codes, user_codes)),
+            shape=(len(movie_id), len(user_id)))
+
+        logger.info("The sparse rating matrix of shape (%d,%d) with %d ratings is generated.",
+                    ratings_pivot.shape[0], ratings_pivot.shape[1], ratings_pivot.nnz)
+
+        return ratings_pivot, movie_id, user_id
+
     ratings_pivot = ratings.pivot(index='movieId',columns='userId',
     values='rating').fillna(0) # fill empty entries by 0 rating to calculate correlation later
 
@@ -35,44 +57,476 @@ def get_rating_matrix(ratings):
 
     return ratings_pivot, movie_id, user_id
 
-def compute_distance(ratings_pivot):
+def get_block_size(n_rows, row_bytes, block_size=None, max_memory_mb=None, reserved_bytes=0):
+    """
+    Choose how many rows of the similarity matrix are computed at a time.
+
+    Args:
+        n_rows (int) - the number of rows to split into blocks
+        row_bytes (int) - the estimated working memory needed per row of a block
+        block_size (int) - the requested block size, used as an upper bound if given
+        max_memory_mb (float) - the peak memory ceiling of the computation in MB
+        reserved_bytes (int) - the memory already held by the inputs and outputs
+
+    Returns:
+        block_size (int) - the number of rows computed per block
+    """
+    if block_size is None:
+        block_size = n_rows
+
+    if max_memory_mb is not None:
+        budget = max_memory_mb * 2**20 - reserved_bytes
+        if budget < row_bytes:
+            logger.error("`max_memory_mb` of %s MB cannot hold a single block of rows",
+                         max_memory_mb)
+            raise ValueError("`max_memory_mb` of %s MB cannot hold a single block of rows"
+                             % max_memory_mb)
+        block_size = min(block_size, int(budget // row_bytes))
+
+    return max(1, min(int(block_size), n_rows))
+
+def get_row_moments(ratings_matrix):
+    """
+    Compute the mean and the centered norm of each movie's zero-filled rating vector.
+
+    Args:
+        ratings_matrix (numpy.array or scipy.sparse matrix) - the movies by users ratings
+
+    Returns:
+        mean (numpy.array) - the mean rating of each movie over all users
+        std (numpy.array) - the norm of each centered row, i.e. the standard deviation up to
+        a constant factor that cancels out in the correlation
+    """
+    n_users = ratings_matrix.shape[1]
+
+    if scipy.sparse.issparse(ratings_matrix):
+        squared = ratings_matrix.multiply(ratings_matrix)
+        sum_sq = np.asarray(squared.sum(axis=1, dtype=np.float64)).ravel()
+    else:
+        sum_sq = np.einsum('ij,ij->i', ratings_matrix, ratings_matrix, dtype=np.float64)
+
+    mean = np.asarray(ratings_matrix.sum(axis=1, dtype=np.float64)).ravel() / n_users
+    std = np.sqrt(np.maximum(sum_sq - n_users * mean**2, 0))
+
+    return mean, std
+
+def iter_corr_blocks(ratings_matrix, block_size=None, dtype='float64', max_memory_mb=None,
+                     reserved_bytes=0, extra_row_bytes=0, rows=None):
+    """
+    Compute the Pearson correlation between movies one block of rows at a time.
+
+    Unrated entries count as 0 ratings, exactly like the zero-filled dense pivot, so the
+    blocks reproduce `np.corrcoef`. The covariance is taken from co-rating products minus
+    the mean correction, hence the centered copy of the rating matrix is never built.
+
+    Args:
+        ratings_matrix (numpy.array or scipy.sparse matrix) - the movies by users ratings
+        block_size (int) - the maximum number of movies per block, all at once if None
+        dtype (str) - the float type used for the computation, e.g. float32 to halve memory
+        max_memory_mb (float) - the peak memory ceiling in MB, which bounds the block size
+        reserved_bytes (int) - the memory already held by the caller, e.g. the output
+        extra_row_bytes (int) - the working memory per block row the caller needs on top
+        rows (numpy.array) - the positions of the movies whose rows are computed, all if None
+
+    Yields:
+        start (int) - the index of the first movie (in `rows` if given) in the block
+        corr_block (numpy.array) - the correlations between the movies in the block and
+        all movies
+    """
+    dtype = np.dtype(dtype)
+    n_movies, n_users = ratings_matrix.shape
+
+    if scipy.sparse.issparse(ratings_matrix):
+        ratings_matrix = scipy.sparse.csr_matrix(ratings_matrix, dtype=dtype)
+        ratings_t = ratings_matrix.T.tocsr()
+        input_bytes = 2 * (ratings_matrix.data.nbytes + ratings_matrix.indices.nbytes)
+        # the sparse product of a block may be as dense as the block itself
+        row_bytes = n_movies * (3 * dtype.itemsize + ratings_matrix.indices.itemsize)
+    else:
+        ratings_matrix = np.asarray(ratings_matrix, dtype=dtype)
+        ratings_t = ratings_matrix.T
+        input_bytes = ratings_matrix.nbytes
+        row_bytes = n_movies * 2 * dtype.itemsize
+
+    # the 1/(n-1) factor of the covariance cancels out in the correlation
+    mean, std = (moment.astype(dtype) for moment in get_row_moments(ratings_matrix))
+    n_rows = n_movies if rows is None else len(rows)
+
+    block_size = get_block_size(n_rows, row_bytes + extra_row_bytes, block_size, max_memory_mb,
+                                reserved_bytes + input_bytes)
+    logger.debug("Correlations are computed in blocks of %d movies", block_size)
+
+    for start in range(0, n_rows, block_size):
+        stop = min(start + block_size, n_rows)
+        # slicing keeps dense blocks as views when all rows are computed
+        index = slice(start, stop) if rows is None else rows[start:stop]
+
+        corr_block = ratings_matrix[index] @ ratings_t
+        if scipy.sparse.issparse(corr_block):
+            corr_block = corr_block.toarray()
+
+        corr_block -= np.multiply.outer(n_users * mean[index], mean)
+        with np.errstate(divide='ignore', invalid='ignore'): # constant rows give nan like numpy
+            corr_block /= std[index, None]
+            corr_block /= std[None, :]
+        np.clip(corr_block, -1, 1, out=corr_block)
+
+        yield start, corr_block
+
+SIMILARITY_METRICS = ('pearson', 'cosine', 'adjusted_cosine', 'corated_pearson', 'jaccard')
+
+def center_users(ratings_matrix):
+    """
+    Subtract each user's mean rating from the ratings they gave, keeping unrated entries 0.
+
+    Args:
+        ratings_matrix (scipy.sparse matrix) - the movies by users ratings
+
+    Returns:
+        centered (scipy.sparse.csr_matrix) - the user-mean-centred ratings
+    """
+    centered = scipy.sparse.csc_matrix(ratings_matrix, copy=True)
+    counts = np.diff(centered.indptr)
+    sums = np.asarray(centered.sum(axis=0)).ravel()
+    centered.data -= np.repeat(sums / np.maximum(counts, 1), counts).astype(centered.dtype)
+
+    return centered.tocsr()
+
+def normalize_rows(ratings_matrix):
+    """
+    Scale each row of a sparse matrix to unit norm, rows of zeros are left as they are.
+
+    Args:
+        ratings_matrix (scipy.sparse matrix) - the movies by users ratings
+
+    Returns:
+        normalized (scipy.sparse.csr_matrix) - the normalized rows
+    """
+    squared = ratings_matrix.multiply(ratings_matrix)
+    norm = np.sqrt(np.asarray(squared.sum(axis=1)).ravel())
+    scale = np.divide(1, norm, out=np.zeros_like(norm), where=norm > 0)
+
+    return scipy.sparse.csr_matrix(scipy.sparse.diags(scale) @ ratings_matrix)
+
+def get_similarity_factors(ratings_matrix, metric):
+    """
+    Prepare the sparse matrices whose products give the similarities of a metric.
+
+    Args:
+        ratings_matrix (scipy.sparse.csr_matrix) - the movies by users ratings
+        metric (str) - one of cosine, adjusted_cosine, corated_pearson or jaccard
+
+    Returns:
+        factors (dict) - the sparse factors, each with its transpose under a `_t` key
+    """
+    if metric in ('cosine', 'adjusted_cosine'):
+        if metric == 'adjusted_cosine':
+            ratings_matrix = center_users(ratings_matrix)
+        factors = {'normalized': normalize_rows(ratings_matrix)}
+    else:
+        rated = ratings_matrix.copy()
+        rated.data[:] = 1 # the implicit matrix of who rated what
+        factors = {'rated': rated}
+        if metric == 'corated_pearson':
+            factors.update({'ratings': ratings_matrix,
+                            'squared': ratings_matrix.multiply(ratings_matrix).tocsr()})
+        else:
+            factors['counts'] = np.asarray(rated.sum(axis=1)).ravel()
+
+    for key in list(factors):
+        if scipy.sparse.issparse(factors[key]):
+            factors[key+'_t'] = factors[key].T.tocsr()
+
+    return factors
+
+def get_similarity_block(factors, metric, index, shrinkage=100):
+    """
+    Compute the similarities between a block of movies and all movies.
+
+    Args:
+        factors (dict) - the sparse factors from `get_similarity_factors`
+        metric (str) - one of cosine, adjusted_cosine, corated_pearson or jaccard
+        index (slice or numpy.array) - the positions of the movies in the block
+        shrinkage (float) - the corated_pearson similarity of movies co-rated by n users is
+        shrunk by n / (n + shrinkage) towards 0
+
+    Returns:
+        similarity_block (numpy.array) - the similarities of the block with all movies
+    """
+    if metric in ('cosine', 'adjusted_cosine'):
+        return (factors['normalized'][index] @ factors['normalized_t']).toarray()
+
+    rated = factors['rated'][index]
+    n_common = (rated @ factors['rated_t']).toarray()
+
+    if metric == 'jaccard':
+        counts = factors['counts']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return n_common / (counts[index, None] + counts[None, :] - n_common)
+
+    # sums over the users who rated both movies of a pair, for the block and the other movie
+    ratings = factors['ratings'][index]
+    sums = (ratings @ factors['rated_t']).toarray()
+    sums_other = (rated @ factors['ratings_t']).toarray()
+    sum_sq = (factors['squared'][index] @ factors['rated_t']).toarray()
+    sum_sq_other = (rated @ factors['squared_t']).toarray()
+    products = (ratings @ factors['ratings_t']).toarray()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = products - sums * sums_other / n_common
+        variance = (sum_sq - sums**2 / n_common) * (sum_sq_other - sums_other**2 / n_common)
+        similarity_block = covariance / np.sqrt(np.maximum(variance, 0))
+    # pairs without two co-ratings or with a constant co-rated profile carry no evidence
+    similarity_block[~np.isfinite(similarity_block)] = 0
+    similarity_block *= n_common / (n_common + shrinkage)
+
+    return similarity_block
+
+def iter_similarity_blocks(ratings_matrix, metric='pearson', shrinkage=100, block_size=None,
+                           dtype='float64', max_memory_mb=None, reserved_bytes=0,
+                           extra_row_bytes=0, rows=None):
+    """
+    Compute the similarities between movies one block of rows at a time for any metric.
+
+    Pearson over the zero-filled ratings is delegated to `iter_corr_blocks`. The other
+    metrics only look at the ratings that were given, so they are computed from sparse
+    products and every movie is most similar to itself, as the neighbour ranking expects.
+
+    Args:
+        ratings_matrix (numpy.array or scipy.sparse matrix) - the movies by users ratings
+        metric (str) - one of pearson, cosine, adjusted_cosine, corated_pearson or jaccard
+        shrinkage (float) - the significance shrinkage of corated_pearson
+        block_size (int) - the maximum number of movies per block, all at once if None
+        dtype (str) - the float type used for the computation
+        max_memory_mb (float) - the peak memory ceiling in MB, which bounds the block size
+        reserved_bytes (int) - the memory already held by the caller, e.g. the output
+        extra_row_bytes (int) - the working memory per block row the caller needs on top
+        rows (numpy.array) - the positions of the movies whose rows are computed, all if None
+
+    Yields:
+        start (int) - the index of the first movie (in `rows` if given) in the block
+        similarity_block (numpy.array) - the similarities between the movies in the block
+        and all movies
+    """
+    if metric not in SIMILARITY_METRICS:
+        logger.error("Unknown similarity metric %s, use one of %s", metric,
+                     ', '.join(SIMILARITY_METRICS))
+        raise ValueError("Unknown similarity metric %s" % metric)
+
+    if metric == 'pearson':
+        yield from iter_corr_blocks(ratings_matrix, block_size, dtype, max_memory_mb,
+                                    reserved_bytes, extra_row_bytes, rows)
+        return
+
+    dtype = np.dtype(dtype)
+    ratings_matrix = scipy.sparse.csr_matrix(ratings_matrix, dtype=dtype)
+    n_movies = ratings_matrix.shape[0]
+    n_rows = n_movies if rows is None else len(rows)
+
+    factors = get_similarity_factors(ratings_matrix, metric)
+    input_bytes = sum(factor.data.nbytes + factor.indices.nbytes
+                      for factor in factors.values() if scipy.sparse.issparse(factor))
+    # each sparse product of a block may be as dense as the block itself
+    n_products = 7 if metric == 'corated_pearson' else 2
+    row_bytes = n_movies * n_products * (dtype.itemsize + ratings_matrix.indices.itemsize)
+
+    block_size = get_block_size(n_rows, row_bytes + extra_row_bytes, block_size, max_memory_mb,
+                                reserved_bytes + input_bytes)
+    logger.debug("%s similarities are computed in blocks of %d movies", metric, block_size)
+
+    for start in range(0, n_rows, block_size):
+        stop = min(start + block_size, n_rows)
+        index = np.arange(start, stop) if rows is None else np.asarray(rows[start:stop])
+
+        similarity_block = get_similarity_block(factors, metric, index, shrinkage)
+        np.clip(similarity_block, -1, 1, out=similarity_block)
+        similarity_block[np.arange(len(index)), index] = 1
+
+        yield start, similarity_block.astype(dtype, copy=False)
+
+@profiled
+def compute_distance(ratings_pivot, block_size=None, dtype='float64', max_memory_mb=None,
+                     metric='pearson', shrinkage=100):
     """
     The model training step, where a correlation score for each pair of movies is computed.
 
     Args:
-        ratings_pivot (pandas.DataFrame) - the pivoted ratings dataframe
+        ratings_pivot (pandas.DataFrame or scipy.sparse matrix) - the pivoted ratings
+        block_size (int) - the number of movies per block in blocked mode
+        dtype (str) - the float type of the correlation matrix
+        max_memory_mb (float) - the peak memory ceiling in MB, including the output matrix
+        metric (str) - the similarity metric, pearson over the zero-filled ratings by default
+        shrinkage (float) - the significance shrinkage of the corated_pearson metric
 
     Returns:
         corr (numpy.array) - the correlation / distance matrix (the trained model object for
         collaborative filtering algorithm)
     """
-    if not isinstance(ratings_pivot, pd.DataFrame):
+    if isinstance(ratings_pivot, pd.DataFrame):
+        ratings_matrix = ratings_pivot.values
+    elif scipy.sparse.issparse(ratings_pivot):
+        ratings_matrix = ratings_pivot
+    else:
         logger.error("Provided argument `ratings_pivot` is not a Panda's DataFrame object")
         raise TypeError("Provided argument `ratings_pivot` is not a Panda's DataFrame object")
 
-    corr = np.corrcoef(ratings_pivot) # use numpy to speed up computation
+    blocked = block_size is not None or max_memory_mb is not None or metric != 'pearson' or \
+        np.dtype(dtype) != np.float64 or scipy.sparse.issparse(ratings_matrix)
+
+    if blocked:
+        corr = np.empty((ratings_matrix.shape[0],)*2, dtype=dtype)
+        for start, corr_block in iter_similarity_blocks(ratings_matrix, metric, shrinkage,
+                                                        block_size, dtype, max_memory_mb,
+                                                        reserved_bytes=corr.nbytes):
+            corr[start:start+len(corr_block)] = corr_block
+    else:
+        corr = np.corrcoef(ratings_matrix) # use numpy to speed up computation
 
     logger.info("The movie distance/correlation matrix of shape (%d,%d) is generated.",
                 corr.shape[0], corr.shape[1])
 
     return corr
 
-def train(ratings):
+def get_top_k(scores, k):
+    """
+    Rank the k highest scores of each row without sorting the whole row.
+
+    Args:
+        scores (numpy.array) - the 2-d array of scores, e.g. a block of the correlation matrix
+        k (int) - the number of top entries to keep per row
+
+    Returns:
+        top_k (numpy.array) - the column positions of the k best scores per row, best first,
+        ties broken by position and nan ranked last like `np.argsort`
+    """
+    scores = np.asarray(scores)
+    n_cols = scores.shape[1]
+
+    if k < n_cols:
+        top_k = np.argpartition(-scores, k-1, axis=1)[:, :k]
+        top_k.sort(axis=1) # so that the stable sort below breaks ties by position
+    else:
+        top_k = np.tile(np.arange(n_cols), (scores.shape[0], 1))
+
+    order = np.argsort(-np.take_along_axis(scores, top_k, axis=1), axis=1, kind='stable')
+
+    return np.take_along_axis(top_k, order, axis=1)
+
+def drop_neighbors(neighbors, scores, min_similarity):
+    """
+    Drop the neighbours below a minimum similarity in place.
+
+    Args:
+        neighbors (numpy.array) - the movie IDs of the neighbours, set to -1 when dropped
+        scores (numpy.array) - the correlations with the neighbours, set to nan when dropped
+        min_similarity (float) - the minimum correlation of a neighbour
+
+    Returns: None
+    """
+    with np.errstate(invalid='ignore'):
+        dropped = ~(scores >= min_similarity)
+    neighbors[dropped] = -1
+    scores[dropped] = np.nan
+
+    logger.info("%d neighbours below similarity %s are dropped", dropped.sum(), min_similarity)
+
+@profiled
+def get_neighbors(ratings_pivot, movie_id, k=10, min_similarity=None, block_size=None,
+                  dtype='float64', max_memory_mb=None, metric='pearson', shrinkage=100):
+    """
+    Keep only the k most similar movies of each movie while the correlations are computed.
+
+    As in prediction, the best match of each row (the movie itself) is discarded, so the
+    full correlation matrix never has to be held in memory or saved.
+
+    Args:
+        ratings_pivot (pandas.DataFrame or scipy.sparse matrix) - the pivoted ratings
+        movie_id (numpy.array) - the movie IDs used for modeling
+        k (int) - how many neighbours to keep for each movie
+        min_similarity (float) - neighbours below this correlation are dropped if given
+        block_size (int) - the number of movies per block
+        dtype (str) - the float type of the computation
+        max_memory_mb (float) - the peak memory ceiling in MB
+        metric (str) - the similarity metric, pearson over the zero-filled ratings by default
+        shrinkage (float) - the significance shrinkage of the corated_pearson metric
+
+    Returns:
+        neighbors (numpy.array) - the movie IDs of the k neighbours of each movie, best
+        first, -1 where fewer than k neighbours pass `min_similarity`
+        scores (numpy.array) - the correlations with those neighbours, nan where missing
+    """
+    if isinstance(ratings_pivot, pd.DataFrame):
+        ratings_matrix = ratings_pivot.values
+    elif scipy.sparse.issparse(ratings_pivot):
+        ratings_matrix = ratings_pivot
+    else:
+        logger.error("Provided argument `ratings_pivot` is not a Panda's DataFrame object")
+        raise TypeError("Provided argument `ratings_pivot` is not a Panda's DataFrame object")
+
+    movie_id = np.asarray(movie_id)
+    n_movies = ratings_matrix.shape[0]
+    k = min(k, n_movies - 1)
+
+    neighbors = np.empty((n_movies, k), dtype=movie_id.dtype)
+    scores = np.empty((n_movies, k), dtype=dtype)
+    # ranking a block needs a negated copy and the partition indices
+    extra_row_bytes = n_movies * (np.dtype(dtype).itemsize + 8)
+
+    for start, corr_block in iter_similarity_blocks(ratings_matrix, metric, shrinkage,
+                                                    block_size, dtype, max_memory_mb,
+                                                    neighbors.nbytes + scores.nbytes,
+                                                    extra_row_bytes):
+        stop = start + len(corr_block)
+        top_k = get_top_k(corr_block, k+1)[:, 1:] # discard the movie itself
+        neighbors[start:stop] = movie_id[top_k]
+        scores[start:stop] = np.take_along_axis(corr_block, top_k, axis=1)
+
+    if min_similarity is not None:
+        drop_neighbors(neighbors, scores, min_similarity)
+
+    logger.info("The top %d neighbours of %d movies are generated.", k, n_movies)
+
+    return neighbors, scores
+
+def train(ratings, config):
     """
     Perform all model training steps.
 
     Args:
         ratings (pandas.DataFrame) - the cleaned ratings dataframe
+        config (dict) - the `train` section of the model configuration
 
     Returns:
-        ratings_pivot (pandas.DataFrame) - the pivoted ratings dataframe
+        ratings_pivot (pandas.DataFrame or scipy.sparse.csr_matrix) - the pivoted ratings
         movie_id (list) - the movie IDs used for modeling
         user_id (list) - the user IDs used for modeling
         corr (numpy.array) - the correlation / distance matrix (the trained model object for
         collaborative filtering algorithm)
     """
     # streamline the process
-    ratings_pivot, movie_id, user_id = get_rating_matrix(ratings)
-    corr = compute_distance(ratings_pivot)
+    ratings_pivot, movie_id, user_id = get_rating_matrix(ratings, **config['get_rating_matrix'])
+    corr = compute_distance(ratings_pivot, **config['compute_distance'])
 
     return ratings_pivot, movie_id, user_id, corr
+
+def train_neighbors(ratings, config):
+    """
+    Perform all model training steps, keeping a top-K neighbour index as the model.
+
+    Args:
+        ratings (pandas.DataFrame) - the cleaned ratings dataframe
+        config (dict) - the `train` section of the model configuration
+
+    Returns:
+        ratings_pivot (pandas.DataFrame or scipy.sparse.csr_matrix) - the pivoted ratings
+        movie_id (list) - the movie IDs used for modeling
+        user_id (list) - the user IDs used for modeling
+        neighbors (numpy.array) - the movie IDs of the top neighbours of each movie
+        scores (numpy.array) - the correlations with those neighbours
+    """
+    ratings_pivot, movie_id, user_id = get_rating_matrix(ratings, **config['get_rating_matrix'])
+    # the neighbour search shares the blocking options of the full computation
+    neighbors, scores = get_neighbors(ratings_pivot, movie_id, **config['get_neighbors'],
+                                      **config['compute_distance'])
+
+    return ratings_pivot, movie_id, user_id, neighbors, scores
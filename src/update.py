@@ -0,0 +1,342 @@
+"""Incremental model updates from new rating batches."""
+
+import logging
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from src.profiling import profiled
+from src.train import drop_neighbors, get_block_size, get_top_k
+
+logger = logging.getLogger(__name__)
+
+SPARSE_STATISTICS = ('ratings', 'cross')
+
+
+def get_statistics(ratings_pivot, movie_id, user_id):
+    """
+    Compute the sufficient statistics of the movie correlations.
+
+    The Pearson correlation of the zero-filled rating vectors only depends on the
+    per-movie sums and sums of squares, the number of users and the co-rating
+    cross-products X X', so these are enough to recompute any row of the correlation
+    matrix. The sparse rating matrix itself is kept to fold in later batches.
+
+    Args:
+        ratings_pivot (pandas.DataFrame or scipy.sparse matrix) - the pivoted ratings
+        movie_id (numpy.array) - the movie IDs used for modeling
+        user_id (numpy.array) - the user IDs used for modeling
+
+    Returns:
+        statistics (dict) - the movie and user IDs, the sparse `ratings` matrix, the
+        `sums` and `sum_sq` of each movie and the sparse `cross` products
+    """
+    if isinstance(ratings_pivot, pd.DataFrame):
+        ratings_pivot = ratings_pivot.values
+    ratings_matrix = scipy.sparse.csr_matrix(ratings_pivot, dtype=np.float64)
+    squared = ratings_matrix.multiply(ratings_matrix)
+
+    statistics = {'movie_id': np.asarray(movie_id), 'user_id': np.asarray(user_id),
+                  'ratings': ratings_matrix,
+                  'sums': np.asarray(ratings_matrix.sum(axis=1)).ravel(),
+                  'sum_sq': np.asarray(squared.sum(axis=1)).ravel(),
+                  'cross': (ratings_matrix @ ratings_matrix.T).tocsr()}
+
+    logger.info("Statistics of %d movies with %d co-rated pairs are generated.",
+                len(statistics['movie_id']), statistics['cross'].nnz)
+
+    return statistics
+
+def save_statistics(statistics, path):
+    """
+    Save the sufficient statistics to a single .npz file.
+
+    Args:
+        statistics (dict) - the statistics from `get_statistics`
+        path (str) - the path of the .npz file
+
+    Returns: None
+    """
+    arrays = {}
+    for key, value in statistics.items():
+        if key in SPARSE_STATISTICS:
+            arrays.update({key+'_data': value.data, key+'_indices': value.indices,
+                           key+'_indptr': value.indptr, key+'_shape': np.array(value.shape)})
+        else:
+            arrays[key] = value
+
+    np.savez(path, **arrays)
+
+def load_statistics(path):
+    """
+    Load the sufficient statistics saved by `save_statistics`.
+
+    Args:
+        path (str) - the path of the .npz file
+
+    Returns:
+        statistics (dict) - the statistics
+    """
+    with np.load(path) as arrays:
+        statistics = {key: arrays[key] for key in arrays.files
+                      if key.rsplit('_', 1)[0] not in SPARSE_STATISTICS}
+        for key in SPARSE_STATISTICS:
+            if key+'_data' in arrays.files:
+                statistics[key] = scipy.sparse.csr_matrix(
+                    (arrays[key+'_data'], arrays[key+'_indices'], arrays[key+'_indptr']),
+                    shape=tuple(arrays[key+'_shape']))
+
+    return statistics
+
+def iter_statistics_corr_blocks(statistics, rows, block_size=1024):
+    """
+    Compute rows of the correlation matrix from the sufficient statistics.
+
+    Args:
+        statistics (dict) - the statistics from `get_statistics`
+        rows (numpy.array) - the positions of the movies whose rows are computed
+        block_size (int) - how many rows are computed at a time
+
+    Yields:
+        start (int) - the index in `rows` of the first movie in the block
+        corr_block (numpy.array) - the correlations of the movies in the block with all movies
+    """
+    n_users = len(statistics['user_id'])
+    mean = statistics['sums'] / n_users
+    std = np.sqrt(np.maximum(statistics['sum_sq'] - n_users * mean**2, 0))
+
+    for start in range(0, len(rows), block_size):
+        index = rows[start:start + block_size]
+
+        corr_block = statistics['cross'][index].toarray()
+        corr_block -= np.multiply.outer(n_users * mean[index], mean)
+        with np.errstate(divide='ignore', invalid='ignore'): # constant rows give nan like numpy
+            corr_block /= std[index, None]
+            corr_block /= std[None, :]
+        np.clip(corr_block, -1, 1, out=corr_block)
+
+        yield start, corr_block
+
+def get_neighbors_from_statistics(statistics, k=10, min_similarity=None, block_size=None,
+                                  max_memory_mb=None, rows=None):
+    """
+    Find the top-K neighbours of movies from the sufficient statistics.
+
+    The ranking follows `train.get_neighbors`: the best match of each row, the movie
+    itself, is discarded.
+
+    Args:
+        statistics (dict) - the statistics from `get_statistics`
+        k (int) - how many neighbours to keep for each movie
+        min_similarity (float) - neighbours below this correlation are dropped if given
+        block_size (int) - how many rows are computed at a time
+        max_memory_mb (float) - the peak memory ceiling in MB, which bounds the block size
+        rows (numpy.array) - the positions of the movies to rank, all if None
+
+    Returns:
+        neighbors (numpy.array) - the movie IDs of the k neighbours of each movie in `rows`
+        scores (numpy.array) - the correlations with those neighbours
+    """
+    movie_id = statistics['movie_id']
+    n_movies = len(movie_id)
+    rows = np.arange(n_movies) if rows is None else np.asarray(rows)
+    k = min(k, n_movies - 1)
+
+    neighbors = np.empty((len(rows), k), dtype=movie_id.dtype)
+    scores = np.empty((len(rows), k))
+    # a dense block, its negated copy and the partition indices per row
+    block_size = get_block_size(len(rows), n_movies * 24, block_size, max_memory_mb,
+                                neighbors.nbytes + scores.nbytes)
+
+    for start, corr_block in iter_statistics_corr_blocks(statistics, rows, block_size):
+        stop = start + len(corr_block)
+        top_k = get_top_k(corr_block, k+1)[:, 1:] # discard the movie itself
+        neighbors[start:stop] = movie_id[top_k]
+        scores[start:stop] = np.take_along_axis(corr_block, top_k, axis=1)
+
+    if min_similarity is not None:
+        drop_neighbors(neighbors, scores, min_similarity)
+
+    return neighbors, scores
+
+def update_statistics(statistics, delta):
+    """
+    Fold a batch of new ratings into the sufficient statistics.
+
+    A rating of an already rated movie by the same user replaces the old one. With the
+    change D of the rating matrix X, the cross-products become X X' + D X' + X D' + D D',
+    so only the rows of the changed movies need the old ratings.
+
+    Args:
+        statistics (dict) - the statistics from `get_statistics`, including the ratings
+        delta (pandas.DataFrame) - the new ratings with userId, movieId and rating columns
+
+    Returns:
+        statistics (dict) - the updated statistics, new movies and users appended
+        affected (numpy.array) - the positions of the movies whose ratings changed
+    """
+    if not isinstance(delta, pd.DataFrame):
+        logger.error("Provided argument `delta` is not a Panda's DataFrame object")
+        raise TypeError("Provided argument `delta` is not a Panda's DataFrame object")
+
+    if 'ratings' not in statistics:
+        logger.error("The statistics do not include the rating matrix to update from")
+        raise ValueError("The statistics do not include the rating matrix to update from")
+
+    # a later rating in the batch replaces an earlier one
+    delta = delta.drop_duplicates(['userId', 'movieId'], keep='last')
+
+    movie_id = append_ids(statistics['movie_id'], delta['movieId'].values)
+    user_id = append_ids(statistics['user_id'], delta['userId'].values)
+    shape = (len(movie_id), len(user_id))
+    rows = pd.Index(movie_id).get_indexer(delta['movieId'])
+    cols = pd.Index(user_id).get_indexer(delta['userId'])
+
+    ratings_matrix = statistics['ratings'].copy()
+    ratings_matrix.resize(shape)
+    cross = statistics['cross'].copy()
+    cross.resize((shape[0], shape[0]))
+
+    old = np.asarray(ratings_matrix[rows, cols]).ravel()
+    new = delta['rating'].values.astype(np.float64)
+    change = scipy.sparse.csr_matrix((new - old, (rows, cols)), shape=shape)
+
+    products = (change @ ratings_matrix.T).tocsr()
+    cross = (cross + products + products.T + change @ change.T).tocsr()
+    cross.eliminate_zeros()
+    ratings_matrix = (ratings_matrix + change).tocsr()
+    ratings_matrix.eliminate_zeros()
+
+    sums = np.bincount(rows, new - old, shape[0])
+    sums[:len(statistics['sums'])] += statistics['sums']
+    sum_sq = np.bincount(rows, new**2 - old**2, shape[0])
+    sum_sq[:len(statistics['sum_sq'])] += statistics['sum_sq']
+
+    affected = np.unique(rows)
+    logger.info("%d ratings of %d movies are folded in, %d new movies and %d new users",
+                len(delta), len(affected), shape[0] - len(statistics['movie_id']),
+                shape[1] - len(statistics['user_id']))
+
+    statistics = {'movie_id': movie_id, 'user_id': user_id, 'ratings': ratings_matrix,
+                  'sums': sums, 'sum_sq': sum_sq, 'cross': cross}
+
+    return statistics, affected
+
+def append_ids(ids, new_ids):
+    """
+    Append the IDs not seen yet, keeping the positions of the existing ones.
+
+    Args:
+        ids (numpy.array) - the existing IDs
+        new_ids (numpy.array) - the IDs of a new batch, possibly repeated
+
+    Returns:
+        ids (numpy.array) - the existing IDs followed by the unseen ones in sorted order
+    """
+    unseen = np.setdiff1d(new_ids, ids)
+
+    return np.concatenate([ids, unseen.astype(ids.dtype)])
+
+@profiled
+def update_neighbors(statistics, affected, neighbors, k=10, min_similarity=None,
+                     block_size=1024):
+    """
+    Refresh the top-K lists after a batch of ratings was folded into the statistics.
+
+    The rows of the affected movies are recomputed from the statistics. Every other movie
+    only changes its correlations with the affected movies, which are read off the same
+    rows by symmetry and merged with its previous list. The correlations between two
+    unaffected movies are kept, which ignores the small drift of the means when new users
+    join; a full retrain resets it.
+
+    When an affected neighbour falls out of a list, the movie that was just below the
+    previous top K is not known, so a list refilled from the affected movies alone could
+    miss a true neighbour. Such lists, whose K-th score is now below the lowest previous
+    score, and lists left with fewer than K neighbours are recomputed from the statistics.
+
+    Args:
+        statistics (dict) - the updated statistics from `update_statistics`
+        affected (numpy.array) - the positions of the movies whose ratings changed
+        neighbors (dict) - the previous `movie_id`, `neighbors` and `scores` arrays
+        k (int) - how many neighbours to keep for each movie
+        min_similarity (float) - neighbours below this correlation are dropped if given
+        block_size (int) - how many rows are computed at a time
+
+    Returns:
+        neighbors (numpy.array) - the movie IDs of the top neighbours of each movie, in the
+        order of `statistics['movie_id']`
+        scores (numpy.array) - the correlations with those neighbours
+    """
+    movie_id = statistics['movie_id']
+    n_movies = len(movie_id)
+    k = min(k, n_movies - 1)
+    affected = np.asarray(affected)
+
+    # previous lists, padded for new movies which are all affected anyway
+    old_neighbors = np.full((n_movies, neighbors['neighbors'].shape[1]), -1,
+                            dtype=movie_id.dtype)
+    old_scores = np.full(old_neighbors.shape, np.nan)
+    old_rows = pd.Index(movie_id).get_indexer(neighbors['movie_id'])
+    old_neighbors[old_rows] = neighbors['neighbors']
+    old_scores[old_rows] = neighbors['scores']
+
+    new_neighbors = np.full((n_movies, k), -1, dtype=movie_id.dtype)
+    new_scores = np.full((n_movies, k), np.nan)
+    corr_affected = np.empty((len(affected), n_movies))
+
+    for start, corr_block in iter_statistics_corr_blocks(statistics, affected, block_size):
+        stop = start + len(corr_block)
+        corr_affected[start:stop] = corr_block
+        top_k = get_top_k(corr_block, k+1)[:, 1:] # discard the movie itself
+        new_neighbors[affected[start:stop]] = movie_id[top_k]
+        new_scores[affected[start:stop]] = np.take_along_axis(corr_block, top_k, axis=1)
+
+    # other movies: previous neighbours that are not affected plus all affected movies
+    unaffected = np.setdiff1d(np.arange(n_movies), affected)
+    is_affected = np.zeros(n_movies, dtype=bool)
+    is_affected[affected] = True
+    old_positions = pd.Index(movie_id).get_indexer(old_neighbors.ravel()).reshape(
+        old_neighbors.shape)
+    stale = (old_positions < 0) | is_affected[np.maximum(old_positions, 0)]
+
+    for start in range(0, len(unaffected), block_size):
+        index = unaffected[start:start + block_size]
+        candidates = np.hstack([old_neighbors[index],
+                                np.broadcast_to(movie_id[affected], (len(index), len(affected)))])
+        candidate_scores = np.hstack([np.where(stale[index], -np.inf, old_scores[index]),
+                                      corr_affected[:, index].T])
+        top_k = get_top_k(candidate_scores, k)
+        new_neighbors[index, :top_k.shape[1]] = np.take_along_axis(candidates, top_k, axis=1)
+        new_scores[index, :top_k.shape[1]] = np.take_along_axis(candidate_scores, top_k, axis=1)
+
+    missing = np.isneginf(new_scores)
+    new_neighbors[missing] = -1
+    new_scores[missing] = np.nan
+
+    # the movies outside a previous list scored at most its lowest score, so a merged list
+    # whose k-th score fell below it may miss one and is recomputed in full
+    floor = np.where(np.isnan(old_scores).any(axis=1),
+                     np.inf if min_similarity is None else min_similarity,
+                     np.fmin.reduce(old_scores, axis=1))
+    if old_scores.shape[1] < k:
+        floor[:] = np.inf
+    last = np.nan_to_num(new_scores[unaffected, k-1], nan=-np.inf) if k > 0 else np.inf
+    inexact = last < floor[unaffected]
+    if min_similarity is not None:
+        inexact &= floor[unaffected] > min_similarity
+    recomputed = unaffected[inexact]
+    for start, corr_block in iter_statistics_corr_blocks(statistics, recomputed, block_size):
+        stop = start + len(corr_block)
+        top_k = get_top_k(corr_block, k+1)[:, 1:] # discard the movie itself
+        new_neighbors[recomputed[start:stop]] = movie_id[top_k]
+        new_scores[recomputed[start:stop]] = np.take_along_axis(corr_block, top_k, axis=1)
+
+    if min_similarity is not None:
+        drop_neighbors(new_neighbors, new_scores, min_similarity)
+
+    logger.info("The top %d neighbours of %d affected movies are recomputed and merged into "
+                "%d other movies, %d of which are recomputed in full.", k, len(affected),
+                len(unaffected), len(recomputed))
+
+    return new_neighbors, new_scores
@@ -0,0 +1,159 @@
+"""Test acquire module"""
+
+import gzip
+import hashlib
+import io
+import os
+import shutil
+
+import botocore
+import pandas as pd
+import pytest
+
+from src.acquire import acquire, download_files, get_ranges, get_versions
+
+MOVIES = pd.DataFrame({'movieId': [1, 2, 3], 'title': ['Alien', 'Up', 'Heat']})
+
+LINKS = pd.DataFrame({'movieId': [1, 2, 3], 'imdbId': [78748., 1049413., 113277.],
+                      'doubanId': [1293039., 2129039., 1292215.]})
+
+RATINGS = pd.DataFrame({'userId': [1] * 40 + [2] * 40, 'movieId': [1, 2, 3, 1] * 20,
+                        'rating': [4.5, 3., 5., 0.5] * 20, 'timestamp': range(80)})
+
+
+class FakeS3Client:
+    """Stand-in for an S3 client serving objects from memory, failing some transfers."""
+
+    def __init__(self, objects, n_failures=0):
+        self.objects = objects
+        self.n_failures = n_failures
+        self.ranges = []
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise botocore.exceptions.ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        data = self.objects[(Bucket, Key)]
+        return {'ContentLength': len(data), 'ETag': '"%s"' % hashlib.md5(data).hexdigest()}
+
+    def get_object(self, Bucket, Key, Range):
+        if self.n_failures > 0:
+            self.n_failures -= 1
+            raise botocore.exceptions.EndpointConnectionError(endpoint_url='s3://fake')
+        first, last = [int(byte) for byte in Range[len('bytes='):].split('-')]
+        self.ranges.append((Key, first, last))
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)][first:last + 1])}
+
+def get_client(n_failures=0):
+    return FakeS3Client({
+        ('bucket', 'raw/movies.csv'): MOVIES.to_csv(index=False).encode(),
+        ('bucket', 'raw/links.csv'): LINKS.to_csv(index=False).encode(),
+        ('bucket', 'raw/ratings.csv.gz'): gzip.compress(RATINGS.to_csv(index=False).encode())},
+                        n_failures)
+
+def test_get_ranges():
+    # Test that the ranges cover every byte once
+    assert get_ranges(10, 4) == [(0, 3), (4, 7), (8, 9)]
+    assert get_ranges(0, 4) == []
+
+def test_get_ranges_part_size():
+    with pytest.raises(ValueError):
+        get_ranges(10, 0)
+
+def test_download_files():
+    # Define inputs, the ratings are split in parts of 100 bytes and two transfers fail
+    client = get_client(n_failures=2)
+    output_dir = '/tmp/test-download'
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    # Compute test output
+    paths = download_files('s3://bucket/raw/', ['movies.csv', 'links.csv', 'ratings.csv.gz'],
+                           output_dir, part_size_mb=100 / 2**20, n_jobs=4, retries=2,
+                           backoff=0., client=client)
+
+    # Test that the files are complete, the ratings decompressed and downloaded in parts
+    assert paths == [os.path.join(output_dir, name)
+                     for name in ('movies.csv', 'links.csv', 'ratings.csv')]
+    pd._testing.assert_frame_equal(pd.read_csv(paths[2]), RATINGS)
+    assert not os.path.exists(os.path.join(output_dir, 'ratings.csv.gz'))
+    assert len([key for key, _, _ in client.ranges if key == 'raw/ratings.csv.gz']) > 1
+
+def test_download_files_retries():
+    # Define inputs, more transfers fail than are retried
+    client = get_client(n_failures=5)
+
+    with pytest.raises(botocore.exceptions.EndpointConnectionError):
+        download_files('s3://bucket/raw/', ['movies.csv'], '/tmp/test-download', n_jobs=1,
+                       retries=2, backoff=0., client=client)
+
+def test_download_files_cache():
+    # Define inputs, the movies change after the first download
+    client = get_client()
+    cache_dir = '/tmp/test-download-cache'
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    download_files('s3://bucket/raw/', ['movies.csv', 'ratings.csv.gz'], '/tmp/test-download',
+                   part_size_mb=100 / 2**20, cache_dir=cache_dir, client=client)
+    client.objects[('bucket', 'raw/movies.csv')] = MOVIES.iloc[:2].to_csv(index=False).encode()
+    client.ranges = []
+
+    # Compute test output
+    paths = download_files('s3://bucket/raw/', ['movies.csv', 'ratings.csv.gz'],
+                           '/tmp/test-download', part_size_mb=100 / 2**20,
+                           cache_dir=cache_dir, client=client)
+
+    # Test that only the changed movies are downloaded again
+    assert {key for key, _, _ in client.ranges} == {'raw/movies.csv'}
+    pd._testing.assert_frame_equal(pd.read_csv(paths[0]), MOVIES.iloc[:2])
+    pd._testing.assert_frame_equal(pd.read_csv(paths[1]), RATINGS)
+
+def test_get_versions():
+    # Define inputs, the ratings change after the first check
+    client = get_client()
+    file_names = ['movies.csv', 'ratings.csv.gz']
+    versions = get_versions('s3://bucket/raw/', file_names, client)
+    client.objects[('bucket', 'raw/ratings.csv.gz')] = gzip.compress(b'userId,movieId,rating\n')
+
+    # Compute test output
+    unchanged = get_versions('s3://bucket/raw/', file_names[:1], client)
+    changed = get_versions('s3://bucket/raw/', file_names, client)
+
+    # Test that only the changed object gets a new version, without being downloaded
+    assert unchanged['s3://bucket/raw/movies.csv'] == versions['s3://bucket/raw/movies.csv']
+    assert changed['s3://bucket/raw/ratings.csv.gz'] != versions['s3://bucket/raw/ratings.csv.gz']
+    assert client.ranges == []
+
+def test_get_versions_unreachable():
+    # Define inputs, a client that cannot find the object
+    client = get_client()
+
+    # Test that no versions are given, so the acquisition is not skipped
+    assert get_versions('s3://bucket/raw/', ['missing.csv'], client) is None
+
+def test_acquire_no_download():
+    # Define inputs, raw files read one after another with gzip ratings
+    raw_dir = '/tmp/test-raw/'
+    os.makedirs(raw_dir, exist_ok=True)
+    MOVIES.to_csv(raw_dir + 'movies.csv', index=False)
+    LINKS.to_csv(raw_dir + 'links.csv', index=False)
+    RATINGS.to_csv(raw_dir + 'ratings.csv.gz', index=False)
+
+    # Compute test output
+    _, _, ratings = acquire(raw_dir, 'movies.csv', 'links.csv', 'ratings.csv.gz')
+    _, _, ratings_dropped = acquire(raw_dir, 'movies.csv', 'links.csv', 'ratings.csv.gz',
+                                    timestamp=False)
+
+    # Test that the gzip ratings are decompressed as they are read
+    pd._testing.assert_frame_equal(ratings, RATINGS, check_dtype=False)
+    pd._testing.assert_frame_equal(ratings_dropped, RATINGS.drop(columns='timestamp'),
+                                   check_dtype=False)
+
+def test_acquire():
+    # Compute test output
+    download = {'output_dir': '/tmp/test-download', 'part_size_mb': 100 / 2**20,
+                'backoff': 0., 'client': get_client()}
+    movies, links, ratings = acquire('s3://bucket/raw/', 'movies.csv', 'links.csv',
+                                     'ratings.csv.gz', download=download)
+
+    # Test that the raw data is read from the downloaded files, keeping the rating times
+    pd._testing.assert_frame_equal(movies, MOVIES)
+    pd._testing.assert_frame_equal(links, LINKS)
+    pd._testing.assert_frame_equal(ratings, RATINGS, check_dtype=False)
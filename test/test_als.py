@@ -0,0 +1,46 @@
+"""Test als module"""
+
+import pytest
+import numpy as np
+import scipy.sparse
+
+from src.als import solve_factors, get_rmse, fit_als
+
+def test_solve_factors():
+    # Define input ratings and fixed factors
+    ratings_matrix = scipy.sparse.csr_matrix(np.array([[5., 4., 0., 0.],
+                                                       [0., 3., 2., 1.],
+                                                       [0., 0., 0., 0.]]))
+    fixed = np.array([[1., 0.], [0.5, 1.], [0., 2.], [1., 1.]])
+
+    # Define true output from the normal equations of each row, row of no ratings is 0
+    output_true = np.zeros((3, 2))
+    for row in range(2):
+        rated = ratings_matrix[row].indices
+        gram = fixed[rated].T @ fixed[rated] + 0.1 * len(rated) * np.eye(2)
+        output_true[row] = np.linalg.solve(gram, fixed[rated].T @ ratings_matrix[row].data)
+
+    # Compute test output, one row at a time on two threads
+    output_test = solve_factors(ratings_matrix, fixed, regularization=0.1, block_size=1,
+                                n_jobs=2)
+
+    # Test that the true and test are the same
+    np.testing.assert_almost_equal(output_test, output_true)
+
+def test_fit_als():
+    # Define a rank 1 rating matrix
+    ratings_matrix = scipy.sparse.csr_matrix(np.outer([1., 2., 1.5, 2.5], [2., 1., 2., 1.5, 2.]))
+
+    # Compute test output
+    item_factors, user_factors = fit_als(ratings_matrix, rank=1, n_iter=20,
+                                         regularization=1e-6)
+
+    # Test that the factorization recovers the ratings
+    assert item_factors.shape == (4, 1)
+    assert get_rmse(ratings_matrix, item_factors, user_factors) < 1e-3
+
+def test_fit_als_nondf():
+    df_in = 'I am not a dataframe'
+
+    with pytest.raises(TypeError):
+        fit_als(df_in)
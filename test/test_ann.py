@@ -0,0 +1,60 @@
+"""Test ann module"""
+
+import pytest
+import numpy as np
+import scipy.sparse
+
+from src.ann import get_buckets, get_n_bits, lsh_neighbors, get_recall
+from src.train import get_neighbors
+
+def test_get_buckets():
+    # Define input codes of 3 bits, the bucket of the first two bits 11 is too large
+    codes = np.array([0b110, 0b111, 0b110, 0b010, 0b011, 0b001])
+
+    # Compute test output
+    order, starts = get_buckets(codes, split_bits=1, max_bucket_size=2)
+
+    # Test that the large bucket is split by the last bit and the others are kept whole
+    np.testing.assert_array_equal(order, [5, 3, 4, 0, 2, 1])
+    np.testing.assert_array_equal(starts, [0, 1, 3, 5])
+
+def test_get_n_bits():
+    # Test that the buckets hold about the maximum size as the catalogue grows
+    assert get_n_bits(200, 256) == 0
+    assert get_n_bits(20000, 256) == 7
+
+def test_lsh_neighbors_single_bucket():
+    # Define input matrix
+    rng = np.random.default_rng(423)
+    matrix_in = scipy.sparse.random(40, 60, density=0.3, format='csr', random_state=423)
+    matrix_in.data = rng.integers(1, 11, matrix_in.nnz) / 2
+    movie_id = np.arange(40) * 2
+
+    # Without any hyperplane all movies share one bucket, so the search is exact
+    neighbors_true, scores_true = get_neighbors(matrix_in, movie_id, k=5)
+    neighbors_test, scores_test = lsh_neighbors(matrix_in, movie_id, k=5, n_tables=1,
+                                                n_bits=0, max_bucket_size=64)
+
+    # Test that the true and test are the same
+    np.testing.assert_array_equal(neighbors_test, neighbors_true)
+    np.testing.assert_almost_equal(scores_test, scores_true)
+    assert get_recall(matrix_in, movie_id, neighbors_test, sample_size=10) == 1
+
+def test_lsh_neighbors_nondf():
+    with pytest.raises(TypeError):
+        lsh_neighbors('I am not a dataframe', np.arange(3))
+
+def test_get_recall_min_recall(caplog):
+    # Define inputs, every movie is given the same two neighbours
+    rng = np.random.default_rng(423)
+    matrix_in = scipy.sparse.random(40, 60, density=0.3, format='csr', random_state=423)
+    matrix_in.data = rng.integers(1, 11, matrix_in.nnz) / 2
+    movie_id = np.arange(40)
+    neighbors = np.tile([0, 1], (40, 1))
+
+    # Compute test output
+    recall = get_recall(matrix_in, movie_id, neighbors, sample_size=10, min_recall=0.8)
+
+    # Test that the low recall is warned about
+    assert recall < 0.8
+    assert any(record.levelname == 'WARNING' for record in caplog.records)
@@ -0,0 +1,95 @@
+"""Test artifacts module"""
+
+import os
+
+import pytest
+import pandas as pd
+import numpy as np
+import scipy.sparse
+
+from src.artifacts import (compact_dtypes, find_matrix, iter_table_chunks, read_matrix,
+                           read_ratings, read_table, with_format, write_matrix, write_table)
+
+MOVIES = pd.DataFrame({'movieId': [1, 2, 3], 'title': ['Alien', 'Up', 'Heat'],
+                       'rating': [4.5, 3.0, 5.0], 'avg_rating': [0.1, 0.2, np.nan]})
+
+
+def test_compact_dtypes():
+    # Compute test output
+    movies_test = compact_dtypes(MOVIES)
+
+    # Test that ids and ratings are downcast but lossy floats are not
+    assert movies_test['movieId'].dtype == np.int32
+    assert movies_test['rating'].dtype == np.float32
+    assert movies_test['avg_rating'].dtype == np.float64
+    assert movies_test['title'].dtype == object
+
+@pytest.mark.parametrize('extension', ['.csv', '.parquet', '.feather'])
+def test_write_table(extension):
+    # Compute test output
+    path = '/tmp/test-movies' + extension
+    write_table(MOVIES, path)
+    movies_test = read_table(path, ['movieId', 'rating'])
+    chunks_test = pd.concat(iter_table_chunks(path, ['movieId', 'rating'], chunksize=2),
+                            ignore_index=True)
+
+    # Test that the table comes back with the same values
+    pd._testing.assert_frame_equal(movies_test, MOVIES[['movieId', 'rating']], check_dtype=False)
+    pd._testing.assert_frame_equal(chunks_test, MOVIES[['movieId', 'rating']], check_dtype=False)
+
+@pytest.mark.parametrize('extension', ['.csv', '.parquet', '.feather'])
+def test_read_ratings(extension):
+    # Define inputs
+    ratings = pd.DataFrame({'userId': [1, 1, 2], 'movieId': [10, 20, 10],
+                            'rating': [4.5, 3.0, 0.5], 'timestamp': [300, 100, 200]})
+    path = '/tmp/test-ratings' + extension
+    write_table(ratings, path)
+
+    # Compute test output
+    ratings_test = read_ratings(path, timestamp=False)
+    ratings_timestamp = read_ratings(path)
+
+    # Test that the ratings are read in compact types, with the timestamp unless dropped
+    assert list(ratings_test.columns) == ['userId', 'movieId', 'rating']
+    assert list(ratings_test.dtypes) == [np.int32, np.int32, np.float32]
+    pd._testing.assert_frame_equal(ratings_timestamp, ratings, check_dtype=False)
+
+def test_write_matrix():
+    # Define inputs
+    ratings_pivot = pd.DataFrame([[5., 0., 4.], [0., 3., 0.]])
+
+    # Compute test output from a dense and a sparse matrix
+    write_matrix(ratings_pivot, '/tmp/test-pivot.npz')
+    dense_test = read_matrix('/tmp/test-pivot.npz')
+    sparse_path = write_matrix(scipy.sparse.csr_matrix(ratings_pivot.values),
+                               '/tmp/test-pivot-sparse.csv')
+    sparse_test = read_matrix(sparse_path)
+
+    # Test that the true and test are the same and the matrices are read as sparse
+    assert scipy.sparse.issparse(dense_test) and scipy.sparse.issparse(sparse_test)
+    np.testing.assert_array_equal(dense_test.toarray(), ratings_pivot.values)
+    np.testing.assert_array_equal(sparse_test.toarray(), ratings_pivot.values)
+    assert sparse_path == '/tmp/test-pivot-sparse.npz'
+
+def test_find_matrix():
+    # Define inputs, a stale dense pivot and the sparse one written after it
+    ratings_pivot = pd.DataFrame([[5., 0.], [0., 3.]])
+    write_matrix(ratings_pivot, '/tmp/test-find.csv')
+    os.utime('/tmp/test-find.csv', (0, 0))
+    write_matrix(scipy.sparse.csr_matrix(ratings_pivot.values), '/tmp/test-find.csv')
+
+    # Test that the matrix written last is found, and a missing path is kept as it is
+    assert find_matrix('/tmp/test-find.csv') == '/tmp/test-find.npz'
+    assert find_matrix('/tmp/test-find-missing.csv') == '/tmp/test-find-missing.csv'
+
+def test_with_format():
+    # Test that tables and matrices get the extension of the format
+    assert with_format('data/ratings-clean.csv', 'parquet') == 'data/ratings-clean.parquet'
+    assert with_format('models/pivot.csv', 'feather', matrix=True) == 'models/pivot.npz'
+    assert with_format('models/pivot.npz', 'csv', matrix=True) == 'models/pivot.csv'
+    assert with_format('models/pivot.csv', 'csv', matrix=True, sparse=True) == \
+        'models/pivot.npz'
+
+def test_read_table_unknown_extension():
+    with pytest.raises(ValueError):
+        read_table('/tmp/test-movies.xlsx')
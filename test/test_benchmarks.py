@@ -0,0 +1,36 @@
+"""Test benchmarks modules"""
+
+import numpy as np
+
+from benchmarks.generate import generate
+from benchmarks.run_benchmarks import compare
+
+
+def test_generate():
+    # Compute test output
+    movies, links, ratings = generate(5000, n_users=1000, seed=1)
+    _, _, ratings_again = generate(5000, n_users=1000, seed=1)
+
+    # Test that the tables are consistent, reproducible and long-tailed
+    assert len(ratings) == 5000 and list(movies.columns) == ['movieId', 'title']
+    assert not ratings.duplicated(['userId', 'movieId']).any()
+    assert ratings['userId'].is_monotonic_increasing
+    assert ratings['movieId'].isin(links['movieId']).all()
+    assert set(np.unique(ratings['rating'] * 2)) <= set(range(1, 11))
+    counts = ratings['movieId'].value_counts()
+    assert counts.iloc[0] > 5 * counts.median()
+    assert ratings.equals(ratings_again)
+
+def test_compare():
+    # Define inputs
+    baseline = {'n_ratings': 100, 'stages': {'train': {'wall_seconds': 2., 'peak_memory_mb': 10.},
+                                             'predict': {'wall_seconds': 1., 'peak_memory_mb': 5.}}}
+    results = {'n_ratings': 100, 'stages': {'train': {'wall_seconds': 3., 'peak_memory_mb': 10.},
+                                            'predict': {'wall_seconds': 1., 'peak_memory_mb': 5.5}}}
+
+    # Compute test output
+    comparison = compare(results, baseline, tolerance=0.2)
+
+    # Test that only the stage slower beyond the tolerance is a regression
+    np.testing.assert_almost_equal(comparison.loc['train', 'wall_seconds_ratio'], 1.5)
+    assert comparison['regression'].tolist() == [True, False]
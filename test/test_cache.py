@@ -0,0 +1,42 @@
+"""Test cache module"""
+
+import os
+import shutil
+
+from src.cache import evict, get_cache_path, lookup, store
+
+
+def test_lookup():
+    # Define inputs
+    cache_dir = '/tmp/test-cache'
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    with open('/tmp/test-cache-ratings.csv', 'w') as f:
+        f.write('userId,movieId,rating\n1,10,4.5\n')
+
+    # Compute test output
+    cache_path = store(cache_dir, 'bucket', 'raw/ratings.csv.gz', '"abc"',
+                       '/tmp/test-cache-ratings.csv')
+
+    # Test that only the stored version of the object is found, decompressed
+    assert lookup(cache_dir, 'bucket', 'raw/ratings.csv.gz', '"abc"') == cache_path
+    assert lookup(cache_dir, 'bucket', 'raw/ratings.csv.gz', '"abd"') is None
+    assert cache_path.endswith('-ratings.csv')
+
+def test_evict():
+    # Define inputs, three copies of 1 MB used in order, then the first one used again
+    cache_dir = '/tmp/test-cache'
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.makedirs(cache_dir)
+    paths = [get_cache_path(cache_dir, 'bucket', 'raw/%d.csv' % i, '"1"') for i in range(3)]
+    for i, path in enumerate(paths):
+        with open(path, 'wb') as f:
+            f.write(b'0' * 2**20)
+        os.utime(path, (1000 + i, 1000 + i))
+    lookup(cache_dir, 'bucket', 'raw/0.csv', '"1"')
+
+    # Compute test output
+    removed = evict(cache_dir, 2.5, keep=[paths[1]])
+
+    # Test that the least recently used copy not in use is evicted
+    assert removed == [paths[2]]
+    assert evict(cache_dir, 1.5) == [paths[1]]
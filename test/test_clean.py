@@ -5,7 +5,7 @@ import pytest
 import pandas as pd
 import numpy as np
 
-from src.clean import merge_data, filter_rating
+from src.clean import merge_data, filter_rating, filter_rating_file
 
 def test_merge_data():
     # Define input dataframe
@@ -79,6 +79,41 @@ def test_filter_rating():
     # Test that the true and test are the same
     pd._testing.assert_frame_equal(df_true, df_test)
 
+def test_filter_rating_iterative():
+    # Define input, user 2 keeps one rating once the movies with one rating are dropped
+    df_in = pd.DataFrame([[0, 0], [0, 1], [1, 0], [1, 1], [2, 0], [2, 2]],
+                         columns=['userId', 'movieId'])
+
+    # Compute test output
+    df_test = filter_rating(df_in, user_min=2, movie_min=2)
+
+    # Test that user 2 is dropped as well, so every user and movie left has two ratings
+    assert list(df_test.index) == [0, 1, 2, 3]
+
+@pytest.mark.parametrize('extension', ['.csv', '.parquet'])
+def test_filter_rating_file(extension):
+    # Define inputs, random ratings of 30 users and 20 movies
+    rng = np.random.default_rng(423)
+    pairs = np.unique(rng.integers(0, [30, 20], size=(300, 2)), axis=0)
+    df_in = pd.DataFrame({'userId': pairs[:, 0], 'movieId': pairs[:, 1],
+                          'rating': rng.integers(1, 11, len(pairs)) / 2.,
+                          'timestamp': rng.integers(0, 1000, len(pairs))})
+    df_in.to_csv('/tmp/test-ratings-raw.csv', index=False)
+
+    # Define expected output, df_true
+    df_true = filter_rating(df_in, user_min=5, movie_min=8).reset_index(drop=True)
+
+    # Compute test output, in chunks smaller than the ratings of a user
+    n_ratings = filter_rating_file('/tmp/test-ratings-raw.csv',
+                                   '/tmp/test-ratings-clean' + extension, user_min=5,
+                                   movie_min=8, chunksize=7)
+    df_test = pd.read_csv('/tmp/test-ratings-clean.csv') if extension == '.csv' else \
+        pd.read_parquet('/tmp/test-ratings-clean.parquet')
+
+    # Test that the true and test are the same
+    assert 0 < n_ratings == len(df_true) < len(df_in)
+    pd._testing.assert_frame_equal(df_true, df_test, check_dtype=False)
+
 def test_filter_nondf():
     df_in = 'I am not a dataframe'
 
@@ -0,0 +1,67 @@
+"""Test cross_validate module"""
+
+import pytest
+import pandas as pd
+import numpy as np
+
+from src.cross_validate import get_folds, get_ratings_frame, cross_validate
+from src.parallel import attach_array, release, share_array
+
+CONFIG = {'clean': {'filter': {'user_min': 2, 'movie_min': 2}},
+          'train': {'engine': 'exact', 'get_rating_matrix': {'sparse': True},
+                    'compute_distance': {'block_size': None, 'dtype': 'float64',
+                                         'max_memory_mb': None, 'metric': 'pearson',
+                                         'shrinkage': 100},
+                    'get_neighbors': {'k': 5, 'min_similarity': None}},
+          'predict': {'predict_df': {'top_n': 3}},
+          'evaluate': {'evaluate_ranking': {'ks': [1, 3], 'block_size': 16, 'n_jobs': 1}}}
+
+def test_get_folds():
+    # Compute test output
+    folds = get_folds(103, n_folds=5)
+
+    # Test that the folds are as equal as possible
+    np.testing.assert_array_equal(np.bincount(folds), [21, 21, 21, 20, 20])
+
+def test_get_folds_unhappy():
+    with pytest.raises(ValueError):
+        get_folds(10, n_folds=1)
+
+def test_get_ratings_frame():
+    # Define inputs, the rating columns attached from shared memory as in a worker
+    ratings = pd.DataFrame({'userId': np.arange(4, dtype=np.int32),
+                            'movieId': np.arange(4, dtype=np.int32)[::-1].copy(),
+                            'rating': np.array([4., 3., 5., .5], dtype=np.float32)})
+    shms, specs = zip(*[share_array(ratings[column].values) for column in ratings])
+    attached, columns = zip(*[attach_array(spec) for spec in specs])
+
+    # Compute test output
+    frame = get_ratings_frame(columns)
+
+    # Test that the frame reads the shared buffers instead of owning a copy
+    pd._testing.assert_frame_equal(frame, ratings)
+    assert all(np.shares_memory(frame[name].values, column)
+               for name, column in zip(frame.columns, columns))
+
+    del frame, columns
+    for shm in attached:
+        shm.close()
+    release(*shms)
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_cross_validate(n_jobs):
+    # Define input ratings of 30 users on 12 movies
+    rng = np.random.default_rng(0)
+    ratings = pd.DataFrame({'userId': np.repeat(np.arange(30), 6),
+                            'movieId': np.concatenate([rng.choice(12, 6, replace=False)
+                                                       for _ in range(30)]),
+                            'rating': rng.integers(1, 6, 180).astype(float)})
+
+    # Compute true output serially and test output with n_jobs workers
+    results_true = cross_validate(ratings, CONFIG, n_folds=3)
+    results_test = cross_validate(ratings, CONFIG, n_folds=3, n_jobs=n_jobs)
+
+    # Test that there is a row per fold and cutoff, then the mean and std per cutoff
+    assert list(results_test['fold']) == [0, 0, 1, 1, 2, 2, 'mean', 'mean', 'std', 'std']
+    pd._testing.assert_frame_equal(results_test.drop(columns='seconds'),
+                                   results_true.drop(columns='seconds'))
@@ -0,0 +1,74 @@
+"""Test data_acquisition module"""
+
+import gzip
+import os
+import shutil
+
+import botocore
+
+from src.data_acquisition import GzipReader, parse_s3, upload_files_to_s3
+
+
+class FakeS3Client:
+    """Stand-in for an S3 client keeping the uploaded objects in memory."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = []
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise botocore.exceptions.ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {'Metadata': self.objects[(Bucket, Key)]['Metadata']}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None):
+        self.objects[(Bucket, Key)] = {'Body': Fileobj.read(), 'Metadata': ExtraArgs['Metadata']}
+        self.uploads.append(Key)
+
+def write_files(local_path):
+    shutil.rmtree(local_path, ignore_errors=True)
+    os.makedirs(os.path.join(local_path, 'extra'))
+    for name, content in [('movies.csv', 'movieId,title\n1,Alien\n'),
+                          ('ratings.csv', 'userId,movieId,rating\n1,1,4.5\n' * 1000),
+                          ('extra/links.csv', 'movieId,imdbId\n1,78748\n')]:
+        with open(os.path.join(local_path, name), 'w') as f:
+            f.write(content)
+
+def test_parse_s3():
+    # Test that the bucket and key are split
+    assert parse_s3('s3://2021-msia423-fei-lanqi/raw/movies.csv') == ('2021-msia423-fei-lanqi',
+                                                                     'raw/movies.csv')
+
+def test_gzip_reader():
+    # Define inputs
+    write_files('/tmp/test-upload')
+
+    # Compute test output, in reads smaller than the compressed blocks
+    reader = GzipReader('/tmp/test-upload/ratings.csv', block_size=100)
+    data = b''.join(iter(lambda: reader.read(7), b''))
+    reader.close()
+
+    # Test that the stream decompresses to the file
+    with open('/tmp/test-upload/ratings.csv', 'rb') as f:
+        assert gzip.decompress(data) == f.read()
+
+def test_upload_files_to_s3():
+    # Define inputs
+    write_files('/tmp/test-upload')
+    client = FakeS3Client()
+    upload_files_to_s3('/tmp/test-upload/', 's3://bucket/raw/', n_jobs=2, compress=True,
+                       client=client)
+    with open('/tmp/test-upload/movies.csv', 'a') as f:
+        f.write('2,Up\n')
+
+    # Compute test output, after changing the movies
+    uploaded = upload_files_to_s3('/tmp/test-upload/', 's3://bucket/raw/', n_jobs=2,
+                                  compress=True, client=client)
+
+    # Test that every file is uploaded compressed, then only the changed one again
+    assert sorted(client.objects) == [('bucket', 'raw/extra/links.csv.gz'),
+                                      ('bucket', 'raw/movies.csv.gz'),
+                                      ('bucket', 'raw/ratings.csv.gz')]
+    assert uploaded == {'extra/links.csv': False, 'movies.csv': True, 'ratings.csv': False}
+    assert gzip.decompress(client.objects[('bucket', 'raw/movies.csv.gz')]['Body']) == \
+        b'movieId,title\n1,Alien\n2,Up\n'
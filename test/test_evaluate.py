@@ -1,8 +1,11 @@
 import pytest
 import pandas as pd
 import numpy as np
+import scipy.sparse
 
-from src.evaluate import get_fav_movies, get_most_similar_movie, get_score
+from src.evaluate import get_fav_movies, get_most_similar_movie, get_score, \
+    get_fav_movies_from_ratings, get_score_from_ratings, evaluate, evaluate_ratings, \
+    get_most_similar_movie_from_neighbors
 
 def test_get_fav_movies():
     # Define inputs
@@ -73,6 +76,38 @@ def test_get_most_similar_movie():
     # Test that the true and test are the same
     pd._testing.assert_frame_equal(df_true, df_test)
 
+def test_get_most_similar_movie_blocked():
+    # Define inputs, favorite movies shared by several users
+    fav_movies = pd.DataFrame([[0, 0], [2, 1], [0, 2], [2, 3]], columns=["fav_movie","userId"])
+    movie_id = [0, 2, 5]
+    corr = np.array([[1, 0.3, 0.6],
+                     [0.3, 1, 0.2],
+                     [0.6, 0.2, 1]])
+
+    # Compute test result, one distinct favorite movie at a time
+    df_test = get_most_similar_movie(fav_movies, movie_id, corr, block_size=1)
+
+    # Test that each user gets the top match of his or her favorite movie
+    np.testing.assert_array_equal(df_test['most_similar_to_fav'], [5, 0, 5, 0])
+
+def test_get_most_similar_movie_unknown():
+    # Define inputs, the favorite movie 9 of user 1 is not in the model
+    fav_movies = pd.DataFrame([[0, 0], [9, 1], [5, 2]], columns=["fav_movie","userId"])
+    movie_id = [0, 2, 5]
+    corr = np.array([[1, 0.3, 0.6],
+                     [0.3, 1, 0.2],
+                     [0.6, 0.2, 1]])
+    neighbors = np.array([[5, 2], [0, 5], [0, 2]])
+
+    # Compute test result from the correlations and from the neighbours
+    df_corr = get_most_similar_movie(fav_movies.copy(), movie_id, corr)
+    df_neighbors = get_most_similar_movie_from_neighbors(fav_movies.copy(), movie_id, neighbors)
+
+    # Test that the user is dropped instead of matched with the last movie
+    for df_test in (df_corr, df_neighbors):
+        np.testing.assert_array_equal(df_test['userId'], [0, 2])
+        np.testing.assert_array_equal(df_test['most_similar_to_fav'], [5, 0])
+
 def test_get_most_similar_movie_nondf():
     df_in = 'I am not a dataframe'
     movie_id = [0, 1, 2, 3, 4, 5, 6, 11, 17]
@@ -113,8 +148,91 @@ def test_get_score():
 
     assert score_test == score_true
 
+def test_get_score_unknown():
+    # Define inputs, user 3 and movie 9 are not in the pivot
+    ratings_pivot_t = pd.DataFrame([[4.8, 4], [0, 3]], index=[0, 2], columns=[2, 12])
+    fav_movies = pd.DataFrame([[2, 0, 12], [12, 2, 9], [2, 3, 12]],
+                              columns=["fav_movie", "userId", "most_similar_to_fav"])
+
+    # Compute test output
+    score_test = get_score(fav_movies, ratings_pivot_t)
+
+    # Test that only the known user and movie are scored
+    assert score_test == 4
+
 def test_get_score_nondf():
     df_in = 'I am not a dataframe'
 
     with pytest.raises(TypeError):
         get_score(df_in, df_in)
+
+def test_get_fav_movies_from_ratings():
+    # Define inputs, the ratings behind the pivot of `test_get_fav_movies`
+    ratings = pd.DataFrame([[0, 0, 5], [0, 1, 4], [0, 2, 5], [0, 3, 5], [0, 5, 4], [0, 6, 4],
+                            [1, 0, 4], [1, 2, 5], [2, 0, 3], [2, 1, 5], [2, 2, 4], [2, 3, 4],
+                            [2, 6, 2], [3, 5, 5], [3, 6, 4], [3, 11, 4], [3, 17, 2],
+                            [4, 2, 2], [4, 5, 5], [5, 4, 3]],
+                           columns=['userId', 'movieId', 'rating'])
+
+    # Define true output, ties go to the smallest movie ID
+    df_true = pd.DataFrame([[0, 0], [2, 1], [1, 2], [5, 3], [5, 4], [4, 5]],
+                           columns=["fav_movie","userId"])
+
+    # Compute test output from shuffled ratings
+    df_test = get_fav_movies_from_ratings(ratings.sample(frac=1, random_state=0))
+
+    # Test that the true and test are the same
+    pd._testing.assert_frame_equal(df_true, df_test)
+
+def test_get_score_from_ratings():
+    # Define inputs, user 4 has not watched movie 1715
+    ratings = pd.DataFrame([[0, 1413, 4.6], [2, 461, 4.8], [4, 43, 4.2], [5, 736, 0.],
+                            [8, 101, 0.]],
+                           columns=['userId', 'movieId', 'rating'])
+    fav_movies = pd.DataFrame([[2, 0, 1413], [15, 2, 461], [43, 4, 1715],
+                               [262, 5, 736], [12, 8, 101]],
+                              columns=["fav_movie", "userId", "most_similar_to_fav"])
+
+    # Compute test output
+    score_test = get_score_from_ratings(fav_movies, ratings)
+
+    # Test that only the watched movies are averaged
+    assert score_test == (4.6 + 4.8)/2
+
+def test_evaluate_ratings():
+    # Define inputs
+    ratings = pd.DataFrame([[0, 0, 5], [0, 1, 4], [0, 2, 3], [1, 0, 4], [1, 2, 5], [2, 1, 2],
+                            [2, 2, 4]],
+                           columns=['userId', 'movieId', 'rating'])
+    ratings_pivot = ratings.pivot(index='movieId', columns='userId', values='rating').fillna(0)
+    movie_id = np.array([0, 1, 2])
+    neighbors = np.array([[2, 1], [0, 2], [1, 0]])
+
+    # Compute true output from the pivot and test output from the long ratings
+    score_true = evaluate(ratings_pivot, movie_id, np.array([0, 1, 2]), neighbors=neighbors)
+    score_test = evaluate_ratings(ratings, movie_id, neighbors)
+
+    # Test that the true and test are the same
+    assert score_test == score_true
+
+def test_evaluate_sparse():
+    # Define inputs
+    ratings = pd.DataFrame([[0, 0, 5], [0, 1, 4], [0, 2, 3], [1, 0, 4], [1, 2, 5], [2, 1, 2],
+                            [2, 2, 4]],
+                           columns=['userId', 'movieId', 'rating'])
+    ratings_pivot = ratings.pivot(index='movieId', columns='userId', values='rating').fillna(0)
+    movie_id = np.array([10, 11, 12])
+    user_id = np.array([0, 1, 2])
+    corr = np.corrcoef(ratings_pivot.values)
+    neighbors = np.array([[12, 11], [10, 12], [11, 10]])
+    ratings_matrix = scipy.sparse.csr_matrix(ratings_pivot.values)
+
+    # Compute true output from the dense pivot and test output from the sparse matrix
+    score_corr_true = evaluate(ratings_pivot, movie_id, user_id, corr)
+    score_corr_test = evaluate(ratings_matrix, movie_id, user_id, corr)
+    score_neighbors_true = evaluate(ratings_pivot, movie_id, user_id, neighbors=neighbors)
+    score_neighbors_test = evaluate(ratings_matrix, movie_id, user_id, neighbors=neighbors)
+
+    # Test that the true and test are the same
+    assert score_corr_test == score_corr_true
+    assert score_neighbors_test == score_neighbors_true
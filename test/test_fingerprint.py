@@ -0,0 +1,48 @@
+"""Test fingerprint module"""
+
+import os
+import time
+
+from src.fingerprint import get_fingerprint, is_fresh, save_fingerprint
+
+CONFIG = {'filter': {'user_min': 50, 'movie_min': 50}}
+OPTIONS = {'input_ratings': '/tmp/test-fingerprint-in.csv',
+           'output_ratings': '/tmp/test-fingerprint-out.csv'}
+
+
+def write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+def test_get_fingerprint():
+    # Define inputs
+    write('/tmp/test-fingerprint-in.csv', 'userId,movieId,rating\n0,0,5\n')
+    inputs = ['/tmp/test-fingerprint-in.csv']
+
+    # Compute test output
+    fingerprint = get_fingerprint(inputs, CONFIG, OPTIONS, 'code')
+    unchanged = get_fingerprint(inputs, dict(CONFIG), dict(OPTIONS), 'code')
+    config_changed = get_fingerprint(inputs, {'filter': {'user_min': 5, 'movie_min': 50}},
+                                     OPTIONS, 'code')
+    code_changed = get_fingerprint(inputs, CONFIG, OPTIONS, 'new code')
+    remote_changed = get_fingerprint(inputs, CONFIG, OPTIONS, 'code', {'s3://raw.csv': '"1"'})
+    write('/tmp/test-fingerprint-in.csv', 'userId,movieId,rating\n0,0,4\n')
+    input_changed = get_fingerprint(inputs, CONFIG, OPTIONS, 'code')
+
+    # Test that the fingerprint is stable and changes with every dependency
+    assert fingerprint == unchanged
+    assert len({fingerprint, config_changed, code_changed, remote_changed, input_changed}) == 5
+
+def test_is_fresh():
+    # Define inputs
+    start = time.time()
+    write('/tmp/test-fingerprint-out.csv', 'userId,movieId,rating\n')
+    save_fingerprint('/tmp/test-fingerprint.json', 'abc', ['/tmp/test-fingerprint-out.csv'],
+                     start)
+
+    # Test that only the same fingerprint with the outputs in place is fresh
+    assert is_fresh('/tmp/test-fingerprint.json', 'abc')
+    assert not is_fresh('/tmp/test-fingerprint.json', 'abd')
+    os.remove('/tmp/test-fingerprint-out.csv')
+    assert not is_fresh('/tmp/test-fingerprint.json', 'abc')
+    assert not is_fresh('/tmp/test-fingerprint-missing.json', 'abc')
@@ -0,0 +1,54 @@
+"""Test metrics module"""
+
+import pytest
+import pandas as pd
+import numpy as np
+
+from src.metrics import holdout_split, evaluate_ranking
+
+def test_holdout_split():
+    # Define input ratings, user 2 only has one rating
+    ratings = pd.DataFrame([[1, 10, 4., 300], [1, 11, 3., 100], [1, 12, 5., 200],
+                            [1, 13, 2., 400], [1, 14, 4., 500], [2, 10, 5., 100]],
+                           columns=['userId', 'movieId', 'rating', 'timestamp'])
+
+    # Compute test output
+    train, test = holdout_split(ratings, test_ratio=0.4)
+
+    # Test that the two latest ratings of user 1 are held out
+    assert sorted(test['movieId']) == [13, 14]
+    assert sorted(train['movieId']) == [10, 10, 11, 12]
+
+def test_holdout_split_nondf():
+    df_in = 'I am not a dataframe'
+
+    with pytest.raises(TypeError):
+        holdout_split(df_in)
+
+def test_holdout_split_no_timestamp():
+    ratings = pd.DataFrame([[1, 10, 4.]], columns=['userId', 'movieId', 'rating'])
+
+    with pytest.raises(ValueError, match='acquire.acquire.timestamp'):
+        holdout_split(ratings)
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_evaluate_ranking(n_jobs):
+    # Define inputs, user 0 watched movie 0 and user 1 movie 1 before the holdout
+    train = pd.DataFrame([[0, 0], [1, 1]], columns=['userId', 'movieId'])
+    test = pd.DataFrame([[0, 2], [1, 3], [1, 0]], columns=['userId', 'movieId'])
+    movie_id = np.array([0, 1, 2, 3])
+    neighbors = np.array([[1, 2], [3, -1], [-1, -1], [-1, -1]])
+    scores = np.array([[0.9, 0.5], [0.8, np.nan], [np.nan, np.nan], [np.nan, np.nan]])
+
+    # Define true output, user 0 is recommended [1, 2] and user 1 only [3]
+    ndcg_0, ndcg_1 = 1 / np.log2(3), 1 / (1 + 1 / np.log2(3))
+    output_true = np.array([[0.5, 0.25, 0.5, 0.5, 0.5],
+                            [0.5, 0.75, (ndcg_0 + ndcg_1) / 2, 0.5, 0.75]])
+
+    # Compute test output, one user per block
+    output_test = evaluate_ranking(train, movie_id, neighbors, scores, test, ks=[1, 2],
+                                   block_size=1, n_jobs=n_jobs)
+
+    # Test that the true and test are the same
+    assert list(output_test.columns) == ['precision', 'recall', 'ndcg', 'map', 'coverage']
+    np.testing.assert_almost_equal(output_test.values, output_true)
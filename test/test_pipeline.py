@@ -0,0 +1,70 @@
+"""Test pipeline module"""
+
+import os
+
+import pandas as pd
+import numpy as np
+import scipy.sparse
+
+from src.train import train
+from src.predict import predict
+from src.pipeline import run_pipeline, save_stage
+
+MOVIES = pd.DataFrame({'movieId': range(7), 'title': ['Alien', 'Up', 'Heat', 'Jaws', 'Big',
+                                                       'Rocky', 'Fargo']})
+
+LINKS = pd.DataFrame({'movieId': range(7), 'imdbId': [78748., 1049413., 113277., 73195.,
+                                                      94737., 75148., 116282.],
+                      'doubanId': [1293039., 2129039., 1292215., 1293181., 1292289.,
+                                   1293375., 1291594.]})
+
+RATINGS = pd.DataFrame([[0, 0, 5], [0, 1, 4], [0, 2, 5], [0, 3, 5], [0, 5, 4], [0, 6, 4],
+                        [1, 0, 4], [1, 2, 5], [2, 0, 3], [2, 1, 5], [2, 2, 4], [2, 3, 4],
+                        [2, 6, 2], [3, 5, 5], [3, 6, 4], [3, 4, 4], [3, 1, 2], [4, 2, 2],
+                        [4, 5, 5], [5, 4, 3]],
+                       columns=['userId', 'movieId', 'rating'])
+
+CONFIG = {'acquire': {'acquire': {'timestamp': False}},
+          'clean': {'filter': {'user_min': 1, 'movie_min': 1}},
+          'featurize': {'featurize': {'feature_names': ['rating', 'popularity']}},
+          'train': {'engine': 'exact', 'get_rating_matrix': {'sparse': False},
+                    'compute_distance': {'block_size': None, 'dtype': 'float64',
+                                         'max_memory_mb': None}},
+          'predict': {'predict_matrix': {'block_size': 2, 'n_jobs': 1, 'backend': 'thread'},
+                      'predict_df': {'top_n': 3}}}
+
+
+def test_run_pipeline():
+    # Define inputs
+    raw_paths = {}
+    for name, data in [('movies', MOVIES), ('links', LINKS), ('ratings', RATINGS)]:
+        raw_paths[name] = '/tmp/test-%s-raw.csv' % name
+        data.to_csv(raw_paths[name], index=False)
+
+    # Define true output from the stages one after the other
+    _, movie_id, _, corr = train(RATINGS, CONFIG['train'])
+    predictions_true = predict(corr, movie_id, CONFIG['predict'])
+
+    # Compute test output
+    os.makedirs('/tmp/test-pipeline', exist_ok=True)
+    outputs = run_pipeline(CONFIG, raw_paths, '/tmp/test-pipeline', n_jobs=2)
+
+    # Test that the true and test are the same and the outputs are saved
+    pd._testing.assert_frame_equal(outputs['predict']['predictions'], predictions_true)
+    assert list(outputs['featurize']['movies'].columns) == ['movieId', 'doubanId', 'imdbId',
+                                                           'title', 'rating', 'popularity']
+    assert np.isfinite(outputs['evaluate']['score'])
+    predictions_saved = pd.read_csv('/tmp/test-pipeline/predictions-predict.csv')
+    np.testing.assert_array_equal(predictions_saved.values, predictions_true.values)
+
+def test_save_stage_sparse():
+    # Define inputs, a sparse rating matrix saved with csv tables
+    outputs = {'ratings_pivot': scipy.sparse.csr_matrix(np.eye(3)), 'movie_id': np.arange(3)}
+    os.makedirs('/tmp/test-pipeline-sparse', exist_ok=True)
+
+    # Compute test output
+    save_stage('train', outputs, '/tmp/test-pipeline-sparse', artifact_format='csv')
+
+    # Test that the matrix is saved as .npz under the name of the stage output
+    assert os.path.isfile('/tmp/test-pipeline-sparse/ratings-pivot-train.npz')
+    assert not os.path.exists('/tmp/test-pipeline-sparse/ratings-pivot-train.csv.npz')
@@ -4,7 +4,9 @@ import pytest
 import pandas as pd
 import numpy as np
 
-from src.predict import predict_aux, predict_matrix, predict_df
+import src.predict
+from src.predict import predict_aux, predict_matrix, predict_df, predict_neighbors, \
+    get_factor_neighbors
 
 def test_predict_aux():
     # Define input lists
@@ -53,6 +55,60 @@ def test_predict_matrix_nonarray():
     with pytest.raises(TypeError):
         predict_matrix(corr, movie_id)
 
+def test_predict_matrix_top_n():
+    # Define inputs
+    rng = np.random.default_rng(423)
+    corr = rng.random((50, 50))
+    movie_id = np.arange(50) * 3
+
+    # Define true output from the row by row ranking
+    output_true = np.array([predict_aux(x, movie_id)[:10] for x in corr])
+
+    # Compute test result in small blocks
+    output_test = predict_matrix(corr, movie_id, top_n=10, block_size=7)
+
+    # Test that the true and test are the same
+    np.testing.assert_array_equal(output_test, output_true)
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_predict_matrix_parallel(backend):
+    # Define inputs
+    rng = np.random.default_rng(423)
+    corr = rng.random((50, 50))
+    movie_id = np.arange(50) * 3
+
+    # Compute serial and parallel results
+    output_true = predict_matrix(corr, movie_id, top_n=5)
+    output_test = predict_matrix(corr, movie_id, top_n=5, block_size=8, n_jobs=3,
+                                 backend=backend)
+
+    # Test that the stitched blocks are the same as the serial result
+    np.testing.assert_array_equal(output_test, output_true)
+
+def test_predict_matrix_memmap(monkeypatch):
+    # Define inputs, the correlation matrix mapped from a .npy file
+    rng = np.random.default_rng(423)
+    np.save('/tmp/test-corr.npy', rng.random((50, 50)))
+    corr = np.load('/tmp/test-corr.npy', mmap_mode='r')
+    movie_id = np.arange(50) * 3
+
+    # Compute test output, failing if the matrix is copied into shared memory
+    def share_array(array):
+        raise AssertionError("The memory mapped matrix was copied")
+    monkeypatch.setattr(src.predict, 'share_array', share_array)
+    output_test = predict_matrix(corr, movie_id, top_n=5, block_size=8, n_jobs=3,
+                                 backend='process')
+
+    # Test that the workers ranked the mapped file like the serial ranking in memory
+    np.testing.assert_array_equal(output_test, predict_matrix(np.array(corr), movie_id,
+                                                              top_n=5))
+
+def test_predict_matrix_unhappy():
+    corr = np.ones((3, 3))
+
+    with pytest.raises(IndexError):
+        predict_matrix(corr, [1, 2])
+
 def test_predict_df():
     # Define inputs
     pred_matrix = np.array([[3, 5, 2, 8],
@@ -80,3 +136,41 @@ def test_predict_df_nonarray():
 
     with pytest.raises(TypeError):
         predict_df(pred_matrix, movie_id, top_n = 3)
+
+def test_predict_neighbors():
+    # Define inputs
+    neighbors = np.array([[3, 5, -1], [5, 1, 3], [1, 5, 2]])
+    movie_id = np.array([1, 2, 3])
+    config = {'predict_df': {'top_n': 2}}
+
+    # Compute test output
+    df_test = predict_neighbors(neighbors, movie_id, config)
+
+    # Test the predictions of the first movie
+    assert df_test.columns.tolist() == ['targetId', 1, 2]
+    assert df_test.loc[0, 1] == 3 and df_test.loc[2, 2] == 5
+
+def test_predict_neighbors_unhappy():
+    neighbors = np.array([[3, 5], [5, 1]])
+
+    with pytest.raises(ValueError):
+        predict_neighbors(neighbors, np.array([1, 2]), {'predict_df': {'top_n': 10}})
+
+def test_get_factor_neighbors():
+    # Define input factors, the third movie points the same way as the first
+    item_factors = np.array([[1., 0.], [0., 1.], [2., 0.1], [1., 1.2]])
+    movie_id = np.array([3, 5, 8, 14])
+
+    # Define true output from the full cosine similarity without the movie itself
+    normalized = item_factors / np.linalg.norm(item_factors, axis=1, keepdims=True)
+    similarity = normalized @ normalized.T
+    np.fill_diagonal(similarity, -np.inf)
+    output_true = movie_id[np.argsort(-similarity, axis=1)[:, :2]]
+
+    # Compute test output on two threads
+    neighbors, scores = get_factor_neighbors(item_factors, movie_id, k=2, block_size=1,
+                                             n_jobs=2)
+
+    # Test that the true and test are the same
+    np.testing.assert_array_equal(neighbors, output_true)
+    np.testing.assert_almost_equal(scores, -np.sort(-similarity, axis=1)[:, :2])
@@ -0,0 +1,69 @@
+"""Test profiling module"""
+
+import json
+
+import pandas as pd
+import numpy as np
+import scipy.sparse
+
+import src.profiling as profiling
+
+
+@profiling.profiled
+def double(ratings):
+    return pd.concat([ratings, ratings])
+
+@profiling.profiled
+def allocate(n_bytes):
+    return np.ones(n_bytes // 8)
+
+def test_get_size():
+    # Define inputs
+    ratings = pd.DataFrame({'userId': [0, 1, 2], 'rating': [5., 4., 3.]})
+    matrix = scipy.sparse.csr_matrix(np.eye(4))
+
+    # Test that rows and bytes add up over collections
+    assert profiling.get_size(ratings) == (3, 48)
+    assert profiling.get_size(np.zeros((4, 2))) == (4, 64)
+    assert profiling.get_size(matrix) == (4, 4 * 8 + 4 * 4 + 5 * 4)
+    assert profiling.get_size([ratings, {'corr': np.zeros((4, 2))}, 'pearson']) == (7, 112)
+
+def test_profiled():
+    # Define inputs
+    ratings = pd.DataFrame({'userId': [0, 1, 2], 'rating': [5., 4., 3.]})
+
+    # Compute test output with profiling off and on
+    double(ratings)
+    profiling.enable()
+    try:
+        double(ratings)
+        profiling.save_report('/tmp/test-profile.json')
+    finally:
+        profiling.disable()
+    with open('/tmp/test-profile.json') as f:
+        report = json.load(f)
+
+    # Test that only the profiled call is recorded with its data volume
+    assert len(report['records']) == 1
+    record = report['records'][0]
+    assert record['name'] == 'test.test_profiling.double'
+    assert (record['input_rows'], record['output_rows']) == (3, 6)
+    assert (record['input_bytes'], record['output_bytes']) == (48, 96)
+    assert record['wall_seconds'] >= 0 and record['cpu_seconds'] >= 0
+    assert report['summary']['test.test_profiling.double']['calls'] == 1
+
+def test_profiled_memory():
+    # Compute test output, a call holding 64 MB once it returns
+    profiling.enable()
+    try:
+        array = allocate(64 * 2**20)
+        report = profiling.get_report()
+    finally:
+        profiling.disable()
+
+    # Test that the memory of the call is measured apart from the peak of the process
+    record = report['records'][0]
+    if record['rss_change_mb'] is not None: # /proc is only available on Linux
+        assert 60 <= record['rss_change_mb'] < record['process_peak_rss_mb']
+    assert record['peak_rss_increase_mb'] is None or record['peak_rss_increase_mb'] >= 0
+    assert array.nbytes == 64 * 2**20
@@ -0,0 +1,57 @@
+"""Test run module"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import yaml
+
+RUN_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'run.py')
+
+RATINGS = pd.DataFrame([[0, 0, 5], [0, 1, 4], [0, 2, 5], [0, 3, 5], [0, 5, 4], [0, 6, 4],
+                        [1, 0, 4], [1, 2, 5], [2, 0, 3], [2, 1, 5], [2, 2, 4], [2, 3, 4],
+                        [2, 6, 2], [3, 5, 5], [3, 6, 4], [3, 4, 4], [3, 1, 2], [4, 2, 2],
+                        [4, 5, 5], [5, 4, 3]],
+                       columns=['userId', 'movieId', 'rating'])
+
+
+def test_train_evaluate_sparse():
+    # Define inputs, a work directory with the logging configuration and a sparse pivot
+    workdir = tempfile.mkdtemp(prefix='test-run-')
+    os.makedirs(os.path.join(workdir, 'config'))
+    os.makedirs(os.path.join(workdir, 'models'))
+    os.makedirs(os.path.join(workdir, 'data', 'outputs'))
+    os.symlink(os.path.join(os.path.dirname(RUN_PY), 'config', 'logging'),
+               os.path.join(workdir, 'config', 'logging'))
+    with open(os.path.join(os.path.dirname(RUN_PY), 'config', 'modelconfig.yaml')) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    config['train']['get_rating_matrix']['sparse'] = True
+    with open(os.path.join(workdir, 'config', 'modelconfig.yaml'), 'w') as f:
+        yaml.dump(config, f)
+    RATINGS.to_csv(os.path.join(workdir, 'ratings.csv'), index=False)
+    # a dense pivot left over from an earlier run, with ratings the model never saw
+    stale_path = os.path.join(workdir, 'models', 'ratings-pivot-train.csv')
+    pd.DataFrame(np.ones((7, 6))).to_csv(stale_path, index=False)
+    os.utime(stale_path, (0, 0))
+
+    # Compute test output, train and evaluate on their default paths, with and without the
+    # configuration
+    scores = []
+    for arguments in (['--config', 'config/modelconfig.yaml', 'train', '--input_ratings',
+                       'ratings.csv'], ['--config', 'config/modelconfig.yaml', 'evaluate'],
+                      ['evaluate']):
+        subprocess.run([sys.executable, RUN_PY] + arguments, cwd=workdir, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if 'evaluate' in arguments:
+            with open(os.path.join(workdir, 'data', 'outputs', 'score-evaluate.txt')) as f:
+                scores.append(f.read())
+
+    # Test that the matrix is saved as .npz and evaluate reads it with or without the
+    # configuration, rather than the stale dense pivot
+    assert os.path.isfile(os.path.join(workdir, 'models', 'ratings-pivot-train.npz'))
+    assert not os.path.exists(os.path.join(workdir, 'models', 'ratings-pivot-train.csv.npz'))
+    assert scores[0].startswith('Average satisfaction score')
+    assert scores[1] == scores[0]
@@ -0,0 +1,55 @@
+"""Test stream module"""
+
+import pytest
+import pandas as pd
+import numpy as np
+
+from src.train import get_rating_matrix, get_neighbors
+from src.update import get_statistics
+from src.stream import get_streaming_statistics, train_streaming
+
+RATINGS = pd.DataFrame([[0, 0, 5], [0, 1, 4], [0, 2, 5], [0, 3, 5], [0, 5, 4], [0, 6, 4],
+                        [1, 0, 4], [1, 2, 5], [2, 0, 3], [2, 1, 5], [2, 2, 4], [2, 3, 4],
+                        [2, 6, 2], [3, 5, 5], [3, 6, 4], [3, 11, 4], [3, 17, 2], [4, 2, 2],
+                        [4, 5, 5], [5, 4, 3]],
+                       columns=['userId', 'movieId', 'rating'])
+
+CONFIG = {'stream_ratings': {'chunksize': 3},
+          'get_neighbors': {'k': 3, 'min_similarity': None},
+          'compute_distance': {'block_size': 2, 'dtype': 'float64', 'max_memory_mb': None}}
+
+def test_get_streaming_statistics():
+    # Define true output from the ratings in memory
+    statistics_true = get_statistics(*get_rating_matrix(RATINGS, sparse=True))
+
+    # Compute test output from chunks cutting through the ratings of users
+    RATINGS.to_csv('/tmp/test-ratings.csv', index=False)
+    statistics_test = get_streaming_statistics('/tmp/test-ratings.csv', chunksize=4)
+
+    # Test that the true and test are the same
+    np.testing.assert_array_equal(statistics_test['movie_id'], statistics_true['movie_id'])
+    np.testing.assert_array_equal(statistics_test['user_id'], statistics_true['user_id'])
+    np.testing.assert_almost_equal(statistics_test['cross'].toarray(),
+                                   statistics_true['cross'].toarray())
+    np.testing.assert_almost_equal(statistics_test['sums'], statistics_true['sums'])
+    np.testing.assert_almost_equal(statistics_test['sum_sq'], statistics_true['sum_sq'])
+
+def test_train_streaming():
+    # Define true output from the ratings in memory
+    ratings_matrix, movie_id, _ = get_rating_matrix(RATINGS, sparse=True)
+    neighbors_true, scores_true = get_neighbors(ratings_matrix, movie_id, k=3)
+
+    # Compute test output
+    RATINGS.to_csv('/tmp/test-ratings.csv', index=False)
+    _, _, neighbors_test, scores_test, _ = train_streaming('/tmp/test-ratings.csv', CONFIG)
+
+    # Test that the true and test are the same
+    np.testing.assert_array_equal(neighbors_test, neighbors_true)
+    np.testing.assert_almost_equal(scores_test, scores_true)
+
+def test_get_streaming_statistics_ungrouped():
+    # Define the ratings of user 0 at both ends of the file
+    RATINGS.iloc[np.r_[1:len(RATINGS), 0]].to_csv('/tmp/test-ratings.csv', index=False)
+
+    with pytest.raises(ValueError):
+        get_streaming_statistics('/tmp/test-ratings.csv', chunksize=4)
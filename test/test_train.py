@@ -3,8 +3,10 @@
 import pytest
 import pandas as pd
 import numpy as np
+import scipy.sparse
 
-from src.train import get_rating_matrix, compute_distance
+from src.train import get_rating_matrix, compute_distance, get_block_size, get_top_k, \
+    get_neighbors
 
 def test_get_rating_matrix():
     # Define input dataframe
@@ -45,6 +47,21 @@ def test_get_rating_matrix():
     # Test that the true and test are the same
     pd._testing.assert_frame_equal(df_true, df_test)
 
+def test_get_rating_matrix_sparse():
+    # Define input dataframe
+    df_in = pd.DataFrame([[0, 0, 5], [0, 1, 4], [1, 0, 4], [1, 2, 5], [2, 0, 3], [3, 17, 2]],
+                         columns=['userId', 'movieId', 'rating'])
+
+    # Compute dense and sparse outputs
+    df_true, movie_true, user_true = get_rating_matrix(df_in)
+    matrix_test, movie_test, user_test = get_rating_matrix(df_in, sparse=True)
+
+    # Test that the sparse matrix holds the dense pivot with the same indices
+    assert scipy.sparse.isspmatrix_csr(matrix_test)
+    np.testing.assert_array_equal(matrix_test.toarray(), df_true.values)
+    pd._testing.assert_index_equal(movie_test, movie_true)
+    pd._testing.assert_index_equal(user_test, user_true)
+
 def test_get_rating_matrix_nondf():
     df_in = 'I am not a dataframe'
 
@@ -96,8 +113,154 @@ def test_compute_distance():
     # Test amost equal used because of floating point
     np.testing.assert_almost_equal(output_test, output_true)
 
+def test_compute_distance_sparse():
+    # Define input matrix
+    matrix_in = np.array([[5., 4., 3., 0., 0., 0.],
+                          [4., 0., 5., 0., 0., 0.],
+                          [5., 5., 4., 0., 2., 0.],
+                          [0., 0., 0., 0., 0., 3.],
+                          [4., 0., 2., 4., 0., 0.]])
+
+    # Compute test output
+    output_test = compute_distance(scipy.sparse.csr_matrix(matrix_in))
+
+    # Test that the sparse path matches numpy
+    np.testing.assert_almost_equal(output_test, np.corrcoef(matrix_in))
+
+def test_compute_distance_blocked():
+    # Define input matrix
+    matrix_in = np.array([[5., 4., 3., 0., 0., 0.],
+                          [4., 0., 5., 0., 0., 0.],
+                          [5., 5., 4., 0., 2., 0.],
+                          [0., 0., 0., 0., 0., 3.],
+                          [4., 0., 2., 4., 0., 0.]])
+
+    # Compute test outputs tile by tile, on dense and sparse input
+    output_dense = compute_distance(pd.DataFrame(matrix_in), block_size=2)
+    output_sparse = compute_distance(scipy.sparse.csr_matrix(matrix_in), block_size=2,
+                                     dtype='float32')
+
+    # Test that the blocked results match numpy
+    np.testing.assert_almost_equal(output_dense, np.corrcoef(matrix_in))
+    assert output_sparse.dtype == np.float32
+    np.testing.assert_almost_equal(output_sparse, np.corrcoef(matrix_in), decimal=5)
+
+def test_compute_distance_cosine():
+    # Define input matrix
+    matrix_in = np.array([[5., 4., 3., 0., 0., 0.],
+                          [4., 0., 5., 0., 0., 0.],
+                          [0., 0., 0., 0., 0., 0.],
+                          [4., 0., 2., 4., 0., 0.]])
+
+    # Define true output, the unrated movie is only similar to itself
+    normalized = matrix_in / np.maximum(np.linalg.norm(matrix_in, axis=1, keepdims=True), 1)
+    output_true = normalized @ normalized.T
+    np.fill_diagonal(output_true, 1)
+
+    # Compute test output
+    output_test = compute_distance(scipy.sparse.csr_matrix(matrix_in), metric='cosine',
+                                   block_size=3)
+
+    # Test that the true and test are the same
+    np.testing.assert_almost_equal(output_test, output_true)
+
+def test_compute_distance_jaccard():
+    # Define input matrix
+    matrix_in = np.array([[5., 4., 3., 0.],
+                          [4., 0., 5., 0.],
+                          [0., 0., 0., 1.]])
+
+    # Define true output from the shared over the total raters of each pair
+    output_true = np.array([[1., 2/3, 0.],
+                            [2/3, 1., 0.],
+                            [0., 0., 1.]])
+
+    # Compute test output
+    output_test = compute_distance(scipy.sparse.csr_matrix(matrix_in), metric='jaccard')
+
+    # Test that the true and test are the same
+    np.testing.assert_almost_equal(output_test, output_true)
+
+def test_compute_distance_corated_pearson():
+    # Define input matrix, the movies are co-rated by the first three users only
+    matrix_in = np.array([[5., 4., 3., 0.],
+                          [4., 5., 2., 3.]])
+
+    # Define true output, the correlation 2/sqrt(2 * 14/3) shrunk by 3 / (3 + 1)
+    output_true = np.array([[1., 0.75 * 2 / np.sqrt(28/3)],
+                            [0.75 * 2 / np.sqrt(28/3), 1.]])
+
+    # Compute test output
+    output_test = compute_distance(scipy.sparse.csr_matrix(matrix_in), metric='corated_pearson',
+                                   shrinkage=1)
+
+    # Test that the true and test are the same
+    np.testing.assert_almost_equal(output_test, output_true)
+
+def test_compute_distance_unknown_metric():
+    matrix_in = scipy.sparse.csr_matrix(np.eye(3))
+
+    with pytest.raises(ValueError):
+        compute_distance(matrix_in, metric='euclidean')
+
+def test_get_block_size():
+    # 1 MB budget with 0.5 MB reserved leaves room for 4 rows of 128 KB
+    assert get_block_size(100, 2**17, max_memory_mb=1, reserved_bytes=2**19) == 4
+    assert get_block_size(100, 2**17, block_size=3, max_memory_mb=1) == 3
+    assert get_block_size(100, 2**17) == 100
+
+def test_get_block_size_unhappy():
+    with pytest.raises(ValueError):
+        get_block_size(100, 2**20, max_memory_mb=1, reserved_bytes=2**19)
+
 def test_compute_distance_nondf():
     df_in = 'I am not a dataframe'
 
     with pytest.raises(TypeError):
         compute_distance(df_in)
+
+def test_get_top_k():
+    # Define input scores, with a tie between the last two columns of the second row
+    scores_in = np.array([[0.1, 0.9, 0.5, 0.7],
+                          [0.3, 0.2, 0.8, 0.8]])
+
+    # Define true output
+    output_true = np.array([[1, 3], [2, 3]])
+
+    # Compute test output
+    output_test = get_top_k(scores_in, 2)
+
+    # Test that the true and test are the same
+    np.testing.assert_array_equal(output_test, output_true)
+
+def test_get_neighbors():
+    # Define input matrix
+    matrix_in = np.array([[5., 4., 3., 0., 0., 0.],
+                          [4., 0., 5., 0., 0., 0.],
+                          [5., 5., 4., 0., 2., 0.],
+                          [0., 0., 0., 0., 0., 3.],
+                          [4., 0., 2., 4., 0., 0.]])
+    movie_id = np.array([1, 2, 3, 5, 8])
+
+    # Define true output from the full correlation matrix
+    corr = np.corrcoef(matrix_in)
+    output_true = movie_id[np.argsort(-corr, axis=1)[:, 1:3]]
+
+    # Compute test output
+    neighbors, scores = get_neighbors(scipy.sparse.csr_matrix(matrix_in), movie_id, k=2,
+                                      block_size=2)
+
+    # Test that the true and test are the same
+    np.testing.assert_array_equal(neighbors, output_true)
+    np.testing.assert_almost_equal(scores, -np.sort(-corr, axis=1)[:, 1:3])
+
+def test_get_neighbors_min_similarity():
+    # Define input matrix
+    matrix_in = pd.DataFrame([[5., 4., 3., 0.], [4., 0., 5., 0.], [0., 0., 0., 3.]])
+
+    # Compute test output
+    neighbors, scores = get_neighbors(matrix_in, np.array([1, 2, 3]), k=2, min_similarity=0)
+
+    # Test that the negatively correlated neighbours are dropped
+    np.testing.assert_array_equal(neighbors, [[2, -1], [1, -1], [-1, -1]])
+    assert np.isnan(scores[2]).all()
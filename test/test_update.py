@@ -0,0 +1,103 @@
+"""Test update module"""
+
+import pytest
+import pandas as pd
+import numpy as np
+
+from src.train import get_rating_matrix, get_neighbors
+from src.update import get_statistics, save_statistics, load_statistics, update_statistics, \
+    update_neighbors, get_neighbors_from_statistics
+
+RATINGS = pd.DataFrame([[0, 0, 5], [0, 1, 4], [0, 2, 5], [0, 3, 5], [0, 5, 4], [0, 6, 4],
+                        [1, 0, 4], [1, 2, 5], [2, 0, 3], [2, 1, 5], [2, 2, 4], [2, 3, 4],
+                        [2, 6, 2], [3, 5, 5], [3, 6, 4], [3, 11, 4], [3, 17, 2], [4, 2, 2],
+                        [4, 5, 5], [5, 4, 3]],
+                       columns=['userId', 'movieId', 'rating'])
+
+def test_get_neighbors_from_statistics():
+    # Define true output from the correlation of the rating matrix
+    ratings_matrix, movie_id, user_id = get_rating_matrix(RATINGS, sparse=True)
+    neighbors_true, scores_true = get_neighbors(ratings_matrix, movie_id, k=3)
+
+    # Compute test output from the saved statistics
+    save_statistics(get_statistics(ratings_matrix, movie_id, user_id), '/tmp/test-stats.npz')
+    neighbors_test, scores_test = \
+        get_neighbors_from_statistics(load_statistics('/tmp/test-stats.npz'), k=3)
+
+    # Test that the true and test are the same
+    np.testing.assert_array_equal(neighbors_test, neighbors_true)
+    np.testing.assert_almost_equal(scores_test, scores_true)
+
+def test_update_statistics():
+    # Define the batches, the delta re-rates a movie and adds a movie and a user
+    base = RATINGS.iloc[:15]
+    delta = pd.DataFrame([[3, 6, 1], [3, 11, 4], [6, 20, 3], [4, 2, 2]],
+                         columns=['userId', 'movieId', 'rating'])
+    full = pd.concat([base, delta]).drop_duplicates(['userId', 'movieId'], keep='last')
+
+    # Compute true statistics from scratch
+    statistics_true = get_statistics(*get_rating_matrix(full, sparse=True))
+
+    # Compute test statistics incrementally
+    statistics_base = get_statistics(*get_rating_matrix(base, sparse=True))
+    statistics_test, affected = update_statistics(statistics_base, delta)
+
+    # Test that the true and test are the same once movies and users are aligned
+    rows = pd.Index(statistics_true['movie_id']).get_indexer(statistics_test['movie_id'])
+    cols = pd.Index(statistics_true['user_id']).get_indexer(statistics_test['user_id'])
+    np.testing.assert_array_equal(statistics_test['movie_id'][affected], [2, 6, 11, 20])
+    np.testing.assert_almost_equal(statistics_test['cross'].toarray(),
+                                   statistics_true['cross'][rows][:, rows].toarray())
+    np.testing.assert_almost_equal(statistics_test['ratings'].toarray(),
+                                   statistics_true['ratings'][rows][:, cols].toarray())
+    np.testing.assert_almost_equal(statistics_test['sum_sq'], statistics_true['sum_sq'][rows])
+
+def test_update_neighbors():
+    # Define the batches, the delta only holds ratings of existing users
+    base = RATINGS.iloc[:16]
+    delta = RATINGS.iloc[16:]
+
+    # Compute true output from scratch
+    ratings_matrix, movie_id, _ = get_rating_matrix(RATINGS, sparse=True)
+    _, scores_true = get_neighbors(ratings_matrix, movie_id, k=3)
+
+    # Compute test output incrementally
+    statistics = get_statistics(*get_rating_matrix(base, sparse=True))
+    neighbors, scores = get_neighbors_from_statistics(statistics, k=3)
+    previous = {'movie_id': statistics['movie_id'], 'neighbors': neighbors, 'scores': scores}
+    statistics, affected = update_statistics(statistics, delta)
+    _, scores_test = update_neighbors(statistics, affected, previous, k=3)
+
+    # Test that the affected movies are ranked as from scratch, new movies are appended so
+    # tied neighbours may come in another order
+    rows = pd.Index(movie_id).get_indexer(statistics['movie_id'][affected])
+    np.testing.assert_almost_equal(scores_test[affected], scores_true[rows])
+
+def test_update_neighbors_short():
+    # Define the batches, the previous lists are cut short by a minimum similarity
+    base = RATINGS.iloc[:16]
+    delta = RATINGS.iloc[16:]
+    statistics = get_statistics(*get_rating_matrix(base, sparse=True))
+    neighbors, scores = get_neighbors_from_statistics(statistics, k=3, min_similarity=0.5)
+    previous = {'movie_id': statistics['movie_id'], 'neighbors': neighbors, 'scores': scores}
+
+    # Compute true output from scratch
+    ratings_matrix, movie_id, _ = get_rating_matrix(RATINGS, sparse=True)
+    _, scores_true = get_neighbors(ratings_matrix, movie_id, k=3)
+
+    # Compute test output incrementally
+    statistics, affected = update_statistics(statistics, delta)
+    _, scores_test = update_neighbors(statistics, affected, previous, k=3)
+
+    # Test that the lists left short are recomputed as from scratch
+    short = np.setdiff1d(np.where(np.isnan(scores).any(axis=1))[0], affected)
+    rows = pd.Index(movie_id).get_indexer(statistics['movie_id'][short])
+    assert len(short) > 0
+    assert not np.isnan(scores_test).any()
+    np.testing.assert_almost_equal(scores_test[short], scores_true[rows])
+
+def test_update_statistics_nondf():
+    statistics = get_statistics(*get_rating_matrix(RATINGS, sparse=True))
+
+    with pytest.raises(TypeError):
+        update_statistics(statistics, 'I am not a dataframe')